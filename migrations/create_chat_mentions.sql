@@ -0,0 +1,15 @@
+-- Contract addresses, tickers and token links mentioned in chat messages,
+-- extracted at ingest by src/helpers/mention_extractor.py
+CREATE TABLE IF NOT EXISTS chat_mentions (
+    chat_id VARCHAR(255) NOT NULL,
+    message_id VARCHAR(255) NOT NULL,
+    kind VARCHAR(32) NOT NULL,              -- evm_address, solana_address, ticker, pump_fun, dexscreener, gmgn
+    value TEXT NOT NULL,                    -- lowercased for evm addresses, upper case for tickers
+    chain VARCHAR(32),
+    message_timestamp BIGINT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, message_id, kind, value)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_mentions_value ON chat_mentions(value);
+CREATE INDEX IF NOT EXISTS idx_chat_mentions_chat_kind ON chat_mentions(chat_id, kind);
@@ -26,11 +26,15 @@ CREATE TABLE IF NOT EXISTS chat_messages (
 -- Index for querying messages by chat_id
 CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_id ON chat_messages(chat_id);
 
--- Index for timestamp-based queries within a chat
-CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_timestamp ON chat_messages(chat_id, message_timestamp DESC);
+-- Index for timestamp-based queries within a chat, id breaks ties on the newest message
+CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_timestamp_id ON chat_messages(chat_id, message_timestamp DESC, id DESC);
+DROP INDEX IF EXISTS idx_chat_messages_chat_timestamp;
 
 -- Index for sender-based queries
 CREATE INDEX IF NOT EXISTS idx_chat_messages_sender_id ON chat_messages(sender_id);
 
 -- Index for topic-based queries
 CREATE INDEX IF NOT EXISTS idx_chat_messages_topic_id ON chat_messages(topic_id);
+
+-- Index for time window scans across chats
+CREATE INDEX IF NOT EXISTS idx_chat_messages_timestamp ON chat_messages(message_timestamp);
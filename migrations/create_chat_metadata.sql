@@ -18,4 +18,9 @@ CREATE INDEX idx_chat_metadata_chat_id ON chat_metadata(chat_id);
 CREATE INDEX idx_chat_metadata_username ON chat_metadata(username);
 CREATE INDEX idx_chat_metadata_evaluated_at ON chat_metadata(evaluated_at);
 CREATE INDEX idx_chat_metadata_type ON chat_metadata(type);
-CREATE INDEX idx_chat_metadata_is_enabled ON chat_metadata(is_enabled);
\ No newline at end of file
+CREATE INDEX idx_chat_metadata_is_enabled ON chat_metadata(is_enabled);
+
+-- latest pin seen, pinned messages are refetched only when it moves, and the
+-- newest message fetched for chats without initial messages yet
+ALTER TABLE chat_metadata ADD COLUMN IF NOT EXISTS max_pinned_message_id BIGINT DEFAULT 0;
+ALTER TABLE chat_metadata ADD COLUMN IF NOT EXISTS last_fetched_message_id BIGINT DEFAULT 0;
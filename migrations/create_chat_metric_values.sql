@@ -17,3 +17,7 @@ CREATE INDEX idx_chat_metric_values_chat_id ON chat_metric_values(chat_id);
 CREATE INDEX idx_chat_metric_values_collection_id ON chat_metric_values(collection_id);
 CREATE INDEX idx_chat_metric_values_definition_id ON chat_metric_values(metric_definition_id);
 CREATE INDEX idx_chat_metric_values_next_refresh ON chat_metric_values(next_refresh_at);
+
+-- high-water mark (message_timestamp, id) of the chat messages a value was computed from
+ALTER TABLE chat_metric_values ADD COLUMN IF NOT EXISTS source_message_timestamp BIGINT;
+ALTER TABLE chat_metric_values ADD COLUMN IF NOT EXISTS source_message_row_id BIGINT;
@@ -0,0 +1,14 @@
+-- One row per chat, used to hand each chat's metadata refresh to exactly one
+-- member account per interval
+CREATE TABLE IF NOT EXISTS chat_refresh_leases (
+    chat_id VARCHAR(255) PRIMARY KEY,
+    owner_account_id VARCHAR(255),          -- account holding or last holding the lease
+    leased_until TIMESTAMP WITH TIME ZONE,  -- lease expiry, NULL when released
+    next_refresh_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    refreshed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_refresh_leases_next_refresh_at ON chat_refresh_leases(next_refresh_at);
+CREATE INDEX IF NOT EXISTS idx_chat_refresh_leases_owner ON chat_refresh_leases(owner_account_id);
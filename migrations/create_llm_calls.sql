@@ -0,0 +1,15 @@
+-- One row per LLM request, written in batches by src/common/llm_metrics.py
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id BIGSERIAL PRIMARY KEY,
+    caller VARCHAR(255) NOT NULL,           -- processor issuing the call
+    model VARCHAR(255) NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL DEFAULT 0,  -- including retries and queueing
+    retries INTEGER NOT NULL DEFAULT 0,
+    outcome VARCHAR(32) NOT NULL,           -- ok, empty, error or cached
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_calls_created_at ON llm_calls(created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_caller_created_at ON llm_calls(caller, created_at);
@@ -0,0 +1,30 @@
+-- Notify metric processors when metric definitions or their enablement change,
+-- so they reload the definition and time new jobs without a restart. The
+-- trigger argument names the column holding the metric definition id.
+CREATE OR REPLACE FUNCTION notify_metric_change() RETURNS trigger AS $$
+DECLARE
+    v_row RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_row := OLD;
+    ELSE
+        v_row := NEW;
+    END IF;
+    PERFORM pg_notify('metric_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'metric_definition_id', (to_jsonb(v_row) ->> TG_ARGV[0])::INTEGER
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_metric_definition_change ON chat_metric_definitions;
+CREATE TRIGGER notify_metric_definition_change
+    AFTER INSERT OR UPDATE OR DELETE ON chat_metric_definitions
+    FOR EACH ROW EXECUTE FUNCTION notify_metric_change('id');
+
+DROP TRIGGER IF EXISTS notify_user_metric_change ON user_metric;
+CREATE TRIGGER notify_user_metric_change
+    AFTER INSERT OR UPDATE OR DELETE ON user_metric
+    FOR EACH ROW EXECUTE FUNCTION notify_metric_change('metric_definition_id');
@@ -0,0 +1,189 @@
+-- One row per (chat, metric) the metric processor has to keep fresh. Rows are
+-- maintained by triggers as memberships, chats and metric enablement change,
+-- and claimed by src/helpers/metric_jobs.py with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS metric_jobs (
+    chat_id VARCHAR(255) NOT NULL,
+    metric_definition_id INTEGER NOT NULL,
+    due_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_by VARCHAR(255),                -- metric processor instance holding the job
+    claimed_until TIMESTAMP WITH TIME ZONE, -- claim expiry, NULL when unclaimed
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, metric_definition_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_metric_jobs_pending_due_at ON metric_jobs(due_at) WHERE claimed_until IS NULL;
+CREATE INDEX IF NOT EXISTS idx_metric_jobs_claimed_until ON metric_jobs(claimed_until) WHERE claimed_until IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_metric_jobs_metric ON metric_jobs(metric_definition_id);
+
+-- supporting indexes of the trigger lookups
+CREATE INDEX IF NOT EXISTS idx_user_account_account_id ON user_account(account_id);
+
+-- (chat, metric) pairs that should have a job: preset metrics and the enabled
+-- metrics of every user watching an enabled chat. NULL means all chats.
+CREATE OR REPLACE FUNCTION metric_job_targets(p_chat_ids TEXT[])
+RETURNS TABLE (chat_id VARCHAR, metric_definition_id INTEGER) AS $$
+    SELECT DISTINCT ac.chat_id, m.metric_definition_id
+    FROM account_chat ac
+    INNER JOIN chat_metadata cm ON cm.chat_id = ac.chat_id
+    INNER JOIN accounts a ON a.tg_id = ac.account_id
+    INNER JOIN user_account ua ON ua.account_id = a.id
+    CROSS JOIN LATERAL (
+        SELECT cmd.id AS metric_definition_id
+        FROM chat_metric_definitions cmd
+        WHERE cmd.is_preset = true
+        UNION
+        SELECT um.metric_definition_id
+        FROM user_metric um
+        WHERE um.user_id = ua.user_id::text AND um.is_enabled = true
+    ) m
+    WHERE ac.status = 'watching' AND cm.is_enabled = true
+    AND (p_chat_ids IS NULL OR ac.chat_id = ANY(p_chat_ids))
+$$ LANGUAGE sql STABLE;
+
+-- Add missing jobs, due when their value is, and drop jobs no longer wanted
+CREATE OR REPLACE FUNCTION sync_metric_jobs(p_chat_ids TEXT[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM metric_jobs j
+    WHERE (p_chat_ids IS NULL OR j.chat_id = ANY(p_chat_ids))
+    AND NOT EXISTS (
+        SELECT 1 FROM metric_job_targets(p_chat_ids) t
+        WHERE t.chat_id = j.chat_id
+        AND t.metric_definition_id = j.metric_definition_id
+    );
+
+    INSERT INTO metric_jobs (chat_id, metric_definition_id, due_at)
+    SELECT t.chat_id, t.metric_definition_id,
+           COALESCE(cmv.next_refresh_at, CURRENT_TIMESTAMP)
+    FROM metric_job_targets(p_chat_ids) t
+    LEFT JOIN chat_metric_values cmv
+        ON cmv.chat_id = t.chat_id
+        AND cmv.metric_definition_id = t.metric_definition_id
+    ON CONFLICT (chat_id, metric_definition_id) DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION metric_jobs_on_account_chat() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM sync_metric_jobs(ARRAY[OLD.chat_id]::TEXT[]);
+    ELSIF TG_OP = 'UPDATE' AND OLD.chat_id <> NEW.chat_id THEN
+        PERFORM sync_metric_jobs(ARRAY[OLD.chat_id, NEW.chat_id]::TEXT[]);
+    ELSE
+        PERFORM sync_metric_jobs(ARRAY[NEW.chat_id]::TEXT[]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_account_chat ON account_chat;
+CREATE TRIGGER metric_jobs_account_chat
+    AFTER INSERT OR DELETE OR UPDATE OF chat_id, account_id, status ON account_chat
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_account_chat();
+
+CREATE OR REPLACE FUNCTION metric_jobs_on_chat_metadata() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM sync_metric_jobs(ARRAY[OLD.chat_id]::TEXT[]);
+    ELSE
+        PERFORM sync_metric_jobs(ARRAY[NEW.chat_id]::TEXT[]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_chat_metadata ON chat_metadata;
+CREATE TRIGGER metric_jobs_chat_metadata
+    AFTER INSERT OR DELETE OR UPDATE OF is_enabled ON chat_metadata
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_chat_metadata();
+
+-- a user gaining or losing an account affects every chat the account watches
+CREATE OR REPLACE FUNCTION metric_jobs_on_user_account() RETURNS trigger AS $$
+DECLARE
+    v_account_ids INTEGER[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_account_ids := ARRAY[OLD.account_id];
+    ELSIF TG_OP = 'UPDATE' THEN
+        v_account_ids := ARRAY[OLD.account_id, NEW.account_id];
+    ELSE
+        v_account_ids := ARRAY[NEW.account_id];
+    END IF;
+    PERFORM sync_metric_jobs(ARRAY(
+        SELECT DISTINCT ac.chat_id::TEXT
+        FROM accounts a
+        INNER JOIN account_chat ac ON ac.account_id = a.tg_id
+        WHERE a.id = ANY(v_account_ids)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_user_account ON user_account;
+CREATE TRIGGER metric_jobs_user_account
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, account_id ON user_account
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_user_account();
+
+-- enabling a metric for a user affects every chat the user watches
+CREATE OR REPLACE FUNCTION metric_jobs_on_user_metric() RETURNS trigger AS $$
+DECLARE
+    v_user_ids TEXT[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_user_ids := ARRAY[OLD.user_id];
+    ELSIF TG_OP = 'UPDATE' THEN
+        v_user_ids := ARRAY[OLD.user_id, NEW.user_id];
+    ELSE
+        v_user_ids := ARRAY[NEW.user_id];
+    END IF;
+    PERFORM sync_metric_jobs(ARRAY(
+        SELECT DISTINCT ac.chat_id::TEXT
+        FROM user_account ua
+        INNER JOIN accounts a ON a.id = ua.account_id
+        INNER JOIN account_chat ac ON ac.account_id = a.tg_id
+        WHERE ua.user_id::text = ANY(v_user_ids)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_user_metric ON user_metric;
+CREATE TRIGGER metric_jobs_user_metric
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, metric_definition_id, is_enabled ON user_metric
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_user_metric();
+
+-- preset metrics apply to every chat, resync everything when one changes
+CREATE OR REPLACE FUNCTION metric_jobs_on_metric_definition() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM metric_jobs WHERE metric_definition_id = OLD.id;
+    ELSIF TG_OP = 'INSERT' AND NEW.is_preset
+        OR TG_OP = 'UPDATE' AND OLD.is_preset IS DISTINCT FROM NEW.is_preset THEN
+        PERFORM sync_metric_jobs(NULL);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_metric_definition ON chat_metric_definitions;
+CREATE TRIGGER metric_jobs_metric_definition
+    AFTER INSERT OR DELETE OR UPDATE OF is_preset ON chat_metric_definitions
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_metric_definition();
+
+-- a stored value moves its job to the value's next refresh
+CREATE OR REPLACE FUNCTION metric_jobs_on_metric_value() RETURNS trigger AS $$
+BEGIN
+    UPDATE metric_jobs
+    SET due_at = NEW.next_refresh_at, updated_at = CURRENT_TIMESTAMP
+    WHERE chat_id = NEW.chat_id
+    AND metric_definition_id = NEW.metric_definition_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS metric_jobs_metric_value ON chat_metric_values;
+CREATE TRIGGER metric_jobs_metric_value
+    AFTER INSERT OR UPDATE OF next_refresh_at ON chat_metric_values
+    FOR EACH ROW EXECUTE FUNCTION metric_jobs_on_metric_value();
+
+SELECT sync_metric_jobs(NULL);
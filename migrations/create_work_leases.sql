@@ -0,0 +1,14 @@
+-- Leases on work items of the processors, one row per (kind, item) being or
+-- last worked on, so several processor instances never take the same item.
+-- Claimed, heartbeated and released by WorkLeases in src/processors/processor.py
+CREATE TABLE IF NOT EXISTS work_leases (
+    kind VARCHAR(64) NOT NULL,              -- processor the item belongs to
+    item_id VARCHAR(255) NOT NULL,
+    owner VARCHAR(255),                     -- processor instance holding the lease
+    leased_until TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT '-infinity',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_work_leases_owner ON work_leases(owner, kind);
@@ -2,6 +2,8 @@ import argparse
 import asyncio
 import logging
 
+from src.common.config import METRICS_PORT
+from src.common.llm_metrics import start_metrics_server
 from src.processors.doxx_tweet import DoxxTweetProcessor
 from src.processors.entity_extractor import EntityExtractor
 from src.processors.message_queue import MessageQueueProcessor
@@ -29,6 +31,9 @@ tasks = {
 
 
 async def run(task_name=None):
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_PORT)
+
     if task_name:
         if task_name not in tasks:
             logger.error(f"Unknown task: {task_name}")
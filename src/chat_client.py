@@ -51,7 +51,7 @@ async def run():
                     new_accounts = await init_accounts(pg_conn, new_accounts)
                     for account in new_accounts:
                         tg_link_proc = TgLinkPreProcessor(account.client)
-                        group_proc = GroupProcessor(account.client)
+                        group_proc = GroupProcessor(account.tg_id, account.client)
                         task_group.create_task(account.client.run_until_disconnected())
                         task_group.create_task(tg_link_proc.start_processing())
                         task_group.create_task(group_proc.start_processing())
@@ -1,33 +1,415 @@
+import asyncio
+import json
 import logging
+import random
+import time
+from typing import Callable, Optional
 
-from openai import AsyncOpenAI
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    RateLimitError,
+)
+from openai.types import CompletionUsage
+from pydantic import BaseModel, ValidationError
 
-from .config import MODEL_NAME, OPENROUTER_API_KEY, OPENROUTER_API_URL
+from .config import (
+    CASCADE_CONFIDENCE_THRESHOLD,
+    CHEAP_MODEL_NAME,
+    DEEPSEEK_API_KEY,
+    DEEPSEEK_API_URL,
+    LLM_EXPECTED_COMPLETION_TOKENS,
+    LLM_MAX_CONNECTIONS_PER_PROVIDER,
+    LLM_MAX_RETRIES,
+    LLM_STREAM_MAX_SECONDS,
+    LLM_STREAM_MAX_TOKENS,
+    LLM_STREAMING,
+    MODEL_NAME,
+    OPENROUTER_API_KEY,
+    OPENROUTER_API_URL,
+)
+from .json_repair import JsonObjectScanner
+from .llm_cache import LLMResponseCache
+from .llm_metrics import record_llm_call
+from .rate_limiter import caller_priority, get_governor
+from .tokenizer import count_message_tokens, count_tokens
 
 logger = logging.getLogger(__name__)
 
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
 
-class AgentClient:
-    def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=OPENROUTER_API_KEY,
-            base_url=OPENROUTER_API_URL,
+OPENROUTER_PROVIDER = "openrouter"
+DEEPSEEK_PROVIDER = "deepseek"
+PROVIDERS = {
+    OPENROUTER_PROVIDER: (OPENROUTER_API_URL, OPENROUTER_API_KEY),
+    DEEPSEEK_PROVIDER: (DEEPSEEK_API_URL, DEEPSEEK_API_KEY),
+}
+# models served by the deepseek api directly, everything else via openrouter
+DEEPSEEK_NATIVE_MODELS = {"deepseek-chat", "deepseek-reasoner"}
+
+_clients: dict[str, AsyncOpenAI] = {}
+
+
+def resolve_model(model: Optional[str]) -> tuple[str, str]:
+    """Map a model name to its provider and the provider's model name."""
+    model = model or MODEL_NAME
+    if model in DEEPSEEK_NATIVE_MODELS and DEEPSEEK_API_KEY:
+        return DEEPSEEK_PROVIDER, model
+    if "/" not in model:
+        # bare names like gpt-4 are namespaced by vendor on openrouter
+        vendor = "deepseek" if model.startswith("deepseek") else "openai"
+        model = f"{vendor}/{model}"
+    return OPENROUTER_PROVIDER, model
+
+
+def get_openai_client(provider: str) -> AsyncOpenAI:
+    """Return the shared client of the provider, pooling its connections."""
+    base_url, api_key = PROVIDERS[provider]
+    if base_url not in _clients:
+        _clients[base_url] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,  # retries are handled by the governor loop
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS_PER_PROVIDER,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS_PER_PROVIDER,
+                )
+            ),
         )
-        self.model = MODEL_NAME
+    return _clients[base_url]
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def _is_valid_object(text: str, schema: Optional[type[BaseModel]]) -> bool:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    if schema is None:
+        return isinstance(value, dict)
+    try:
+        schema.model_validate(value)
+    except ValidationError:
+        return False
+    return True
+
+
+def _backoff_seconds(error: Exception, attempt: int) -> float:
+    """Full jitter exponential backoff, honoring Retry-After when given."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(
+        0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+
+
+class CascadePolicy:
+    """Try a cheap model first and escalate to the strong one when needed.
+
+    `confidence` extracts the 0-100 confidence of a response, returning None
+    when the response fails validation. Responses below `threshold` or failing
+    validation are escalated.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        confidence: Callable[[str | None], Optional[float]],
+        threshold: float = CASCADE_CONFIDENCE_THRESHOLD,
+        cheap_model: str = CHEAP_MODEL_NAME,
+        strong_model: str = MODEL_NAME,
+    ):
+        self.name = name
+        self.confidence = confidence
+        self.threshold = threshold
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.stats = {"requests": 0, "escalations": 0, "invalid": 0}
+
+    def should_escalate(self, response: str | None) -> bool:
+        confidence = self.confidence(response)
+        if confidence is None:
+            self.stats["invalid"] += 1
+            return True
+        return confidence < self.threshold
+
+    def escalation_rate(self) -> float:
+        if not self.stats["requests"]:
+            return 0.0
+        return self.stats["escalations"] / self.stats["requests"]
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "escalation_rate": self.escalation_rate()}
+
+
+class AgentClient:
+    def __init__(
+        self,
+        caller: str = "default",
+        cache: Optional[LLMResponseCache] = None,
+        model: Optional[str] = None,
+    ):
+        self.model = model or MODEL_NAME
+        self.caller = caller
+        self.cache = cache
         logger.info(f"Using model: {self.model}")
 
     async def chat_completion(
-        self, messages, temperature=0.1, response_format=None
+        self,
+        messages,
+        temperature=0.1,
+        response_format=None,
+        bypass_cache=False,
+        model: Optional[str] = None,
+        stream: bool = False,
+        schema: Optional[type[BaseModel]] = None,
     ) -> str | None:
-        logger.info(f"Sending message to {self.model}")
-        response = await self.client.chat.completions.create(
-            model=self.model,
+        """Send a chat completion request.
+
+        `model` overrides the client's default model for this call and is
+        routed to its provider. When a cache is configured, identical requests
+        are served from it. `bypass_cache` forces a fresh call and overwrites
+        the cached response.
+
+        With `stream`, the completion is read only until the first JSON object
+        that parses, and validates against `schema` when given, and that
+        object is returned. See `_read_stream` for the ceilings.
+        """
+        provider, model = resolve_model(model or self.model)
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(
+                model, messages, temperature, response_format
+            )
+            if bypass_cache:
+                self.cache.record_bypass(self.caller)
+            else:
+                cached = await self.cache.get(self.caller, cache_key)
+                if cached is not None:
+                    logger.info(f"Serving cached response for {self.caller}")
+                    record_llm_call(self.caller, model, "cached")
+                    return cached
+
+        content, result = await self._create_with_retry(
+            provider,
+            stream=stream and LLM_STREAMING,
+            schema=schema,
+            model=model,
             messages=messages,
             temperature=temperature,
             response_format=response_format,
         )
-        if response.choices:
-            return response.choices[0].message.content
-        else:
-            logger.error(f"No response from {self.model}: {response}")
+        if not content:
+            logger.error(f"No response from {model}")
             return None
+        # content cut off by a ceiling is returned for repair, never cached
+        if cache_key and result == "ok":
+            await self.cache.set(cache_key, content)
+        return content
+
+    async def cascade_completion(
+        self,
+        policy: CascadePolicy,
+        messages,
+        temperature=0.1,
+        response_format=None,
+        model: Optional[str] = None,
+        stream: bool = False,
+        schema: Optional[type[BaseModel]] = None,
+        bypass_cache=False,
+    ) -> str | None:
+        """Send a chat completion request through a cascade policy.
+
+        `model` overrides the policy's strong model. The cascade is skipped when
+        no cheap model is configured or it is the strong model itself.
+        `bypass_cache` applies to every tier.
+        """
+        strong_model = model or policy.strong_model
+        kwargs = dict(
+            messages=messages,
+            temperature=temperature,
+            response_format=response_format,
+            stream=stream,
+            schema=schema,
+            bypass_cache=bypass_cache,
+        )
+        if not policy.cheap_model or policy.cheap_model == strong_model:
+            return await self.chat_completion(model=strong_model, **kwargs)
+
+        policy.stats["requests"] += 1
+        try:
+            response = await self.chat_completion(model=policy.cheap_model, **kwargs)
+        except Exception as e:
+            logger.warning(f"{policy.name}: {policy.cheap_model} failed ({e})")
+            response = None
+        if not policy.should_escalate(response):
+            return response
+
+        policy.stats["escalations"] += 1
+        logger.info(
+            f"{policy.name}: escalating to {strong_model}, "
+            f"escalation rate {policy.escalation_rate():.1%}"
+        )
+        return await self.chat_completion(model=strong_model, **kwargs)
+
+    async def _create_with_retry(
+        self,
+        provider: str,
+        stream: bool = False,
+        schema: Optional[type[BaseModel]] = None,
+        **kwargs,
+    ) -> tuple[str | None, str]:
+        """Call the model through the governor, retrying 429 and 5xx errors.
+
+        Returns the content of the completion and the outcome of the call, ok
+        when the completion ended normally.
+        """
+        model = kwargs["model"]
+        client = get_openai_client(provider)
+        governor = get_governor(model)
+        priority = caller_priority(self.caller)
+        tokens = (
+            count_message_tokens(kwargs["messages"]) + LLM_EXPECTED_COMPLETION_TOKENS
+        )
+        started_at = time.monotonic()
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with governor.slot(priority, tokens) as outcome:
+                try:
+                    logger.info(f"Sending message to {model} via {provider}")
+                    if stream:
+                        content, usage, result = await self._read_stream(
+                            client, schema, outcome, **kwargs
+                        )
+                    else:
+                        response = await client.chat.completions.create(**kwargs)
+                        choice = response.choices[0] if response.choices else None
+                        content = choice.message.content if choice else None
+                        usage = response.usage
+                        result = (
+                            "token_limit"
+                            if choice and choice.finish_reason == "length"
+                            else "ok"
+                        )
+                    outcome["stopped"] = result != "ok"
+                    record_llm_call(
+                        self.caller,
+                        model,
+                        result if content or result != "ok" else "empty",
+                        latency=time.monotonic() - started_at,
+                        retries=attempt,
+                        usage=usage,
+                    )
+                    return content, result
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        record_llm_call(
+                            self.caller,
+                            model,
+                            "error",
+                            latency=time.monotonic() - started_at,
+                            retries=attempt,
+                        )
+                        raise
+                    outcome["throttled"] = isinstance(e, RateLimitError)
+                    delay = _backoff_seconds(e, attempt)
+                    logger.warning(
+                        f"{self.caller} call to {model} failed ({e}), "
+                        f"retrying in {delay:.1f}s"
+                    )
+            await asyncio.sleep(delay)
+
+    async def _read_stream(
+        self,
+        client: AsyncOpenAI,
+        schema: Optional[type[BaseModel]],
+        slot: dict,
+        **kwargs,
+    ) -> tuple[str | None, CompletionUsage, str]:
+        """Stream a completion, stopping at its first valid JSON object.
+
+        The arrival of the first token is recorded on the governor `slot`.
+
+        Reading also stops after LLM_STREAM_MAX_SECONDS or LLM_STREAM_MAX_TOKENS
+        completion tokens, reasoning included, and whatever content arrived is
+        returned for the caller to repair or reject.
+
+        Returns the content, the estimated usage and the outcome: ok, timeout
+        or token_limit.
+        """
+        scanner = JsonObjectScanner()
+        stream = None
+        content = None
+        completion_tokens = 0
+        outcome = "ok"
+
+        async def read():
+            nonlocal stream, content, completion_tokens, outcome
+            stream = await client.chat.completions.create(
+                stream=True, max_tokens=LLM_STREAM_MAX_TOKENS, **kwargs
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                text = choice.delta.content or ""
+                # reasoning is a separate field on openrouter and deepseek
+                reasoning = getattr(choice.delta, "reasoning", None) or getattr(
+                    choice.delta, "reasoning_content", None
+                )
+                if slot["first_token_at"] is None and (text or reasoning):
+                    slot["first_token_at"] = time.monotonic()
+                completion_tokens += count_tokens(text) + count_tokens(reasoning)
+                content = next(
+                    (
+                        found
+                        for found in scanner.feed(text)
+                        if _is_valid_object(found, schema)
+                    ),
+                    None,
+                )
+                if content:
+                    return
+                if choice.finish_reason == "length":
+                    outcome = "token_limit"
+                if completion_tokens >= LLM_STREAM_MAX_TOKENS:
+                    outcome = "token_limit"
+                    return
+
+        try:
+            await asyncio.wait_for(read(), LLM_STREAM_MAX_SECONDS)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        finally:
+            if stream is not None:
+                await stream.close()
+
+        if content is None:
+            content = scanner.text or None
+        if outcome != "ok":
+            logger.warning(
+                f"{self.caller} call to {kwargs['model']} stopped: {outcome}, "
+                f"{completion_tokens} completion tokens"
+            )
+        prompt_tokens = count_message_tokens(kwargs["messages"])
+        usage = CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        return content, usage, outcome
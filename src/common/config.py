@@ -1,3 +1,4 @@
+import json
 import os
 import time
 
@@ -10,15 +11,58 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
 DEEPSEEK_MODEL_NAME = "deepseek-chat"
 
-OPENROUTER_API_URL: str = "https://openrouter.ai/api/v1/"
+OPENROUTER_API_URL: str = os.getenv(
+    "OPENROUTER_API_URL", "https://openrouter.ai/api/v1/"
+)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 MODEL_NAME: str = os.getenv("MODEL_NAME", "deepseek/deepseek-r1-distill-llama-70b")
+# first model tried by cascade policies, empty disables the cascade
+CHEAP_MODEL_NAME: str = os.getenv("CHEAP_MODEL_NAME", "")
+CASCADE_CONFIDENCE_THRESHOLD = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", 70))
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com")
 
+# rule based classifications at or above this confidence skip the llm
+PRE_CLASSIFY_MIN_CONFIDENCE = int(os.getenv("PRE_CLASSIFY_MIN_CONFIDENCE", 80))
+
+# chats whose latest messages are kept in memory for prompt contexts
+CHAT_SNAPSHOT_MAX_CHATS = int(os.getenv("CHAT_SNAPSHOT_MAX_CHATS", 1000))
+# metric values of chats without new messages are recomputed after this long
+METRIC_FORCED_REFRESH_HOURS = int(os.getenv("METRIC_FORCED_REFRESH_HOURS", 168))
+
 SERVICE_PREFIX = "the_sinper_bot"
 MESSAGE_QUEUE_KEY = f"{SERVICE_PREFIX}:message_queue"
 
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 3600 * 24))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 20000))
+LLM_CACHE_INDEX_KEY = f"{SERVICE_PREFIX}:llm_cache:index"
+
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 200))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 400000))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 20))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+LLM_TARGET_LATENCY_SECONDS = float(os.getenv("LLM_TARGET_LATENCY_SECONDS", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_MAX_CONNECTIONS_PER_PROVIDER = int(
+    os.getenv("LLM_MAX_CONNECTIONS_PER_PROVIDER", 50)
+)
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", 1000))
+# stream json completions and stop reading once the object is complete
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+# ceilings of a single streamed call, reasoning tokens included
+LLM_STREAM_MAX_SECONDS = float(os.getenv("LLM_STREAM_MAX_SECONDS", 180))
+LLM_STREAM_MAX_TOKENS = int(os.getenv("LLM_STREAM_MAX_TOKENS", 8000))
+# persist every llm call to the llm_calls table
+LLM_CALLS_PERSIST = os.getenv("LLM_CALLS_PERSIST", "false").lower() == "true"
+LLM_CALLS_FLUSH_SECONDS = int(os.getenv("LLM_CALLS_FLUSH_SECONDS", 10))
+LLM_CALLS_FLUSH_BATCH_SIZE = int(os.getenv("LLM_CALLS_FLUSH_BATCH_SIZE", 500))
+# {"model": [prompt_usd, completion_usd]} per million tokens, for cost estimates
+LLM_MODEL_PRICES = json.loads(os.getenv("LLM_MODEL_PRICES", "{}"))
+# port of the /metrics endpoint, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# share rate limits across processes through redis
+LLM_RATE_LIMIT_REDIS = os.getenv("LLM_RATE_LIMIT_REDIS", "false").lower() == "true"
+
 R2_ENDPOINT = f"https://{os.environ.get('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com"
 R2_BUCKET_NAME = os.environ.get("R2_BUCKET_NAME", "the-sniper")
 R2_ACCESS_KEY_ID = os.environ.get("R2_ACCESS_KEY_ID")
@@ -40,3 +84,11 @@ def message_seen_key(chat_id: str, message_id: str):
 
 def chat_watched_by_key(chat_id: str):
     return f"{SERVICE_PREFIX}:chat:{chat_id}:watched_by"
+
+
+def llm_cache_key(digest: str):
+    return f"{SERVICE_PREFIX}:llm_cache:{digest}"
+
+
+def llm_rate_limit_key(model: str, bucket: str):
+    return f"{SERVICE_PREFIX}:llm_rate_limit:{model}:{bucket}"
@@ -0,0 +1,224 @@
+import json
+import logging
+import re
+from collections import defaultdict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_EVERY = 100
+
+THINK_BLOCK_PATTERN = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+CODE_FENCE_PATTERN = re.compile(r"```(?:json)?", re.IGNORECASE)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSING = {"{": "}", "[": "]"}
+THINK_OPEN, THINK_CLOSE = "<think>", "</think>"
+
+# number of responses that needed each kind of repair
+repair_stats = defaultdict(int)
+
+
+def _record(repairs: list[str]):
+    repair_stats["responses"] += 1
+    for repair in repairs:
+        repair_stats[repair] += 1
+    if repair_stats["responses"] % STATS_LOG_EVERY == 0:
+        logger.info(f"json repairs: {dict(repair_stats)}")
+
+
+def _strip_wrappers(text: str, repairs: list[str]) -> str:
+    """Drop reasoning blocks and markdown fences around the JSON."""
+    if "<think>" in text:
+        text = THINK_BLOCK_PATTERN.sub("", text)
+        repairs.append("think_block")
+    if "```" in text:
+        text = CODE_FENCE_PATTERN.sub("", text)
+        repairs.append("code_fence")
+    return text
+
+
+def _scan(text: str, repairs: list[str]) -> Optional[str]:
+    """Copy the outermost JSON value in text, fixing defects on the way.
+
+    Fixes trailing commas, raw newlines in strings and python literals, and
+    closes whatever is left open when the output was truncated.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+    if text[:start].strip():
+        repairs.append("leading_text")
+
+    out: list[str] = []
+    stack: list[str] = []
+    # output length and open brackets after each member, to cut a truncated
+    # trailing member back to the last complete one
+    checkpoints: list[tuple[int, list[str]]] = []
+    in_string = escaped = False
+    i = start
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char in "\n\r\t":
+                char = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}[char]
+                repairs.append("control_char")
+            out.append(char)
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in CLOSING:
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.append("trailing_comma")
+            if not stack:
+                break
+            out.append(CLOSING[stack.pop()])
+            if not stack:
+                if text[i:].strip() != char:
+                    repairs.append("trailing_text")
+                break
+        elif char == ",":
+            checkpoints.append((len(out), list(stack)))
+            out.append(char)
+        elif char.isalpha():
+            word = re.match(r"[A-Za-z_]+", text[i:]).group(0)
+            if word in PYTHON_LITERALS:
+                out.append(PYTHON_LITERALS[word])
+                repairs.append("python_literal")
+            else:
+                out.append(word)
+            i += len(word)
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    if not stack:
+        return "".join(out)
+
+    # truncated output, close the open string and brackets
+    repairs.append("truncated")
+    if in_string:
+        out.append('"')
+    candidate = _close("".join(out), stack)
+    if _loads(candidate) is not None:
+        return candidate
+    # drop the incomplete trailing member, back to the last complete one
+    for length, open_brackets in reversed(checkpoints):
+        candidate = _close("".join(out[:length]), open_brackets)
+        if _loads(candidate) is not None:
+            return candidate
+    return None
+
+
+def _close(text: str, stack: list[str]) -> str:
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(CLOSING[bracket] for bracket in reversed(stack))
+
+
+def _loads(text: str) -> Optional[Any]:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def repair_json(text: str) -> tuple[Optional[Any], list[str]]:
+    """Parse the JSON value in an LLM response, repairing common defects.
+
+    Returns the parsed value, or None, and the kinds of repairs applied.
+    """
+    repairs: list[str] = []
+    value = _loads(text)
+    if value is None:
+        cleaned = _strip_wrappers(text, repairs)
+        value = _loads(cleaned.strip())
+        if value is None:
+            scanned = _scan(cleaned, repairs)
+            value = _loads(scanned) if scanned else None
+            if value is None:
+                repairs.append("failed")
+    repairs = list(dict.fromkeys(repairs))
+    _record(repairs)
+    return value, repairs
+
+
+def get_repair_stats() -> dict[str, int]:
+    return dict(repair_stats)
+
+
+class JsonObjectScanner:
+    """Find complete top-level JSON objects in streamed text as it arrives.
+
+    Reasoning blocks are skipped, and so is text between objects. Only the
+    nesting is tracked, the objects still have to be parsed.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+        self.start = -1  # of the object being read
+        self.depth = 0
+        self.in_string = self.escaped = self.in_think = False
+
+    def feed(self, chunk: str) -> list[str]:
+        """Add a chunk, returning the objects it completed."""
+        self.text += chunk
+        objects = []
+        while self.position < len(self.text):
+            if self.in_think:
+                end = self.text.find(THINK_CLOSE, self.position)
+                if end < 0:
+                    # keep a partial closing tag for the next chunk
+                    self.position = max(
+                        self.position, len(self.text) - len(THINK_CLOSE)
+                    )
+                    break
+                self.in_think = False
+                self.position = end + len(THINK_CLOSE)
+                continue
+
+            char = self.text[self.position]
+            if self.depth == 0:
+                position = self.position
+                rest = self.text[position:]
+                if rest.startswith(THINK_OPEN):
+                    self.in_think = True
+                    self.position += len(THINK_OPEN)
+                    continue
+                if char == "<" and THINK_OPEN.startswith(rest):
+                    break  # wait for the rest of the tag
+                if char == "{":
+                    self.start = self.position
+                    self.depth = 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    start, end = self.start, self.position + 1
+                    objects.append(self.text[start:end])
+            self.position += 1
+        return objects
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from .config import (
+    LLM_CACHE_INDEX_KEY,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL_SECONDS,
+    REDIS_URL,
+    llm_cache_key,
+)
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_EVERY = 100
+
+
+class LLMResponseCache:
+    """Redis backed cache of LLM responses keyed by a hash of the request.
+
+    Entries expire after `ttl` seconds. A sorted set indexes entries by
+    insertion time so the oldest ones are evicted once `max_entries` is hit.
+    """
+
+    def __init__(
+        self,
+        ttl: int = LLM_CACHE_TTL_SECONDS,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        redis_client: Optional[Redis] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis = redis_client or Redis.from_url(REDIS_URL)
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0, "bypassed": 0})
+
+    @staticmethod
+    def make_key(
+        model: str, messages: list[dict], temperature: float, response_format: dict
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "response_format": response_format,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, caller: str, digest: str) -> Optional[str]:
+        try:
+            value = await self.redis.get(llm_cache_key(digest))
+        except Exception as e:
+            logger.error(f"Failed to read llm cache: {e}")
+            value = None
+
+        stats = self.stats[caller]
+        stats["hits" if value is not None else "misses"] += 1
+        if (stats["hits"] + stats["misses"]) % STATS_LOG_EVERY == 0:
+            logger.info(
+                f"llm cache for {caller}: hit rate {self.hit_rate(caller):.2%}, {stats}"
+            )
+        if value is None:
+            return None
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def record_bypass(self, caller: str):
+        self.stats[caller]["bypassed"] += 1
+
+    async def set(self, digest: str, response: str):
+        now = time.time()
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.set(llm_cache_key(digest), response, ex=self.ttl)
+            pipeline.zadd(LLM_CACHE_INDEX_KEY, {digest: now})
+            # drop index entries whose values already expired
+            pipeline.zremrangebyscore(LLM_CACHE_INDEX_KEY, 0, now - self.ttl)
+            pipeline.zcard(LLM_CACHE_INDEX_KEY)
+            *_, size = await pipeline.execute()
+            if size > self.max_entries:
+                await self._evict(size - self.max_entries)
+        except Exception as e:
+            logger.error(f"Failed to write llm cache: {e}")
+
+    async def _evict(self, count: int):
+        evicted = await self.redis.zpopmin(LLM_CACHE_INDEX_KEY, count)
+        if evicted:
+            await self.redis.delete(
+                *[llm_cache_key(self._decode(digest)) for digest, _ in evicted]
+            )
+            logger.info(f"evicted {len(evicted)} llm cache entries")
+
+    def hit_rate(self, caller: str) -> float:
+        stats = self.stats[caller]
+        total = stats["hits"] + stats["misses"]
+        return stats["hits"] / total if total else 0.0
+
+    def get_stats(self) -> dict[str, dict]:
+        return {
+            caller: {**stats, "hit_rate": self.hit_rate(caller)}
+            for caller, stats in self.stats.items()
+        }
+
+    @staticmethod
+    def _decode(value: str | bytes) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -0,0 +1,238 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+import asyncpg
+from aiohttp import web
+from pydantic import BaseModel
+
+from .config import (
+    DATABASE_URL,
+    LLM_CALLS_FLUSH_BATCH_SIZE,
+    LLM_CALLS_FLUSH_SECONDS,
+    LLM_CALLS_PERSIST,
+    LLM_MODEL_PRICES,
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# calls kept in memory when postgres is unreachable, oldest dropped first
+MAX_PENDING_CALLS = 10000
+
+
+class LLMCall(BaseModel):
+    caller: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    retries: int = 0
+    outcome: str  # ok, empty, error, cached, timeout or token_limit
+    created_at: float
+
+
+class Histogram:
+    """Cumulative histogram over fixed upper bounds, as prometheus expects."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost in USD from LLM_MODEL_PRICES, given per million tokens."""
+    prompt_price, completion_price = LLM_MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class LLMMetrics:
+    """In-memory aggregates of LLM calls per caller and model.
+
+    When `persist` is set, calls are also written to the llm_calls table in
+    batches by a background task.
+    """
+
+    def __init__(self, persist: bool = LLM_CALLS_PERSIST):
+        self.persist = persist
+        self.calls = defaultdict(int)  # (caller, model, outcome) -> count
+        self.tokens = defaultdict(int)  # (caller, model, kind) -> count
+        self.retries = defaultdict(int)  # (caller, model) -> count
+        self.cost = defaultdict(float)  # (caller, model) -> usd
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.prompt_tokens = defaultdict(lambda: Histogram(TOKEN_BUCKETS))
+        self.pending: list[LLMCall] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        self.pg_conn: Optional[asyncpg.Connection] = None
+
+    def record(self, call: LLMCall):
+        key = (call.caller, call.model)
+        self.calls[(*key, call.outcome)] += 1
+        if call.outcome != "cached":
+            self.tokens[(*key, "prompt")] += call.prompt_tokens
+            self.tokens[(*key, "completion")] += call.completion_tokens
+            self.retries[key] += call.retries
+            self.cost[key] += estimate_cost(
+                call.model, call.prompt_tokens, call.completion_tokens
+            )
+            self.latency[key].observe(call.latency)
+            self.prompt_tokens[key].observe(call.prompt_tokens)
+
+        if self.persist:
+            self.pending.append(call)
+            if len(self.pending) > MAX_PENDING_CALLS:
+                del self.pending[: len(self.pending) - MAX_PENDING_CALLS]
+            if self.flush_task is None or self.flush_task.done():
+                self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self.pending:
+            if len(self.pending) < LLM_CALLS_FLUSH_BATCH_SIZE:
+                await asyncio.sleep(LLM_CALLS_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush llm calls: {e}")
+                self.pg_conn = None
+                await asyncio.sleep(LLM_CALLS_FLUSH_SECONDS)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        if self.pg_conn is None or self.pg_conn.is_closed():
+            self.pg_conn = await asyncpg.connect(DATABASE_URL)
+        batch = self.pending[:LLM_CALLS_FLUSH_BATCH_SIZE]
+        del self.pending[:LLM_CALLS_FLUSH_BATCH_SIZE]
+        try:
+            await self._insert(batch)
+        except Exception:
+            self.pending[:0] = batch
+            raise
+        logger.info(f"flushed {len(batch)} llm calls")
+
+    async def _insert(self, batch: list[LLMCall]):
+        await self.pg_conn.execute(
+            """
+            INSERT INTO llm_calls (
+                caller, model, prompt_tokens, completion_tokens, latency_ms,
+                retries, outcome, created_at
+            )
+            SELECT caller, model, prompt_tokens, completion_tokens, latency_ms,
+                   retries, outcome, to_timestamp(created_at)
+            FROM unnest(
+                $1::text[], $2::text[], $3::int[], $4::int[], $5::int[],
+                $6::int[], $7::text[], $8::float8[]
+            ) AS t(caller, model, prompt_tokens, completion_tokens, latency_ms,
+                   retries, outcome, created_at)
+            """,
+            [call.caller for call in batch],
+            [call.model for call in batch],
+            [call.prompt_tokens for call in batch],
+            [call.completion_tokens for call in batch],
+            [int(call.latency * 1000) for call in batch],
+            [call.retries for call in batch],
+            [call.outcome for call in batch],
+            [call.created_at for call in batch],
+        )
+
+    def render(self) -> str:
+        """Render all aggregates in the prometheus text format."""
+        lines = ["# TYPE llm_calls_total counter"]
+        for (caller, model, outcome), count in sorted(self.calls.items()):
+            labels = f'caller="{caller}",model="{model}",outcome="{outcome}"'
+            lines.append(f"llm_calls_total{{{labels}}} {count}")
+        lines.append("# TYPE llm_tokens_total counter")
+        for (caller, model, kind), count in sorted(self.tokens.items()):
+            labels = f'caller="{caller}",model="{model}",kind="{kind}"'
+            lines.append(f"llm_tokens_total{{{labels}}} {count}")
+        lines.append("# TYPE llm_retries_total counter")
+        for (caller, model), count in sorted(self.retries.items()):
+            lines.append(
+                f'llm_retries_total{{caller="{caller}",model="{model}"}} {count}'
+            )
+        lines.append("# TYPE llm_cost_usd_total counter")
+        for (caller, model), cost in sorted(self.cost.items()):
+            lines.append(
+                f'llm_cost_usd_total{{caller="{caller}",model="{model}"}} {cost:.6f}'
+            )
+        lines.append("# TYPE llm_latency_seconds histogram")
+        for (caller, model), histogram in sorted(self.latency.items()):
+            lines.extend(
+                histogram.render(
+                    "llm_latency_seconds", f'caller="{caller}",model="{model}"'
+                )
+            )
+        lines.append("# TYPE llm_prompt_tokens histogram")
+        for (caller, model), histogram in sorted(self.prompt_tokens.items()):
+            lines.extend(
+                histogram.render(
+                    "llm_prompt_tokens", f'caller="{caller}",model="{model}"'
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+llm_metrics = LLMMetrics()
+
+
+def record_llm_call(
+    caller: str,
+    model: str,
+    outcome: str,
+    latency: float = 0.0,
+    retries: int = 0,
+    usage=None,
+):
+    """Record a call, taking token counts from the response usage if any."""
+    try:
+        llm_metrics.record(
+            LLMCall(
+                caller=caller,
+                model=model,
+                prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+                latency=latency,
+                retries=retries,
+                outcome=outcome,
+                created_at=time.time(),
+            )
+        )
+    except Exception as e:
+        logger.error(f"Failed to record llm call: {e}")
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=llm_metrics.render(), content_type="text/plain")
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """Serve the llm metrics on /metrics in the running event loop."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"metrics server listening on :{port}")
+    return runner
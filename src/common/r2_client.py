@@ -26,6 +26,11 @@ def upload_file(file_path: str, key: str):
     s3.upload_file(file_path, R2_BUCKET_NAME, key)
 
 
+def upload_bytes(data: bytes, key: str, content_type: str | None = None):
+    extra_args = {"ContentType": content_type} if content_type else {}
+    s3.put_object(Bucket=R2_BUCKET_NAME, Key=key, Body=data, **extra_args)
+
+
 def download_file(key: str, file_path: str):
     s3.download_file(R2_BUCKET_NAME, key, file_path)
 
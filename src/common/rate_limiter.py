@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from redis.asyncio import Redis
+
+from .config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MIN_CONCURRENCY,
+    LLM_RATE_LIMIT_REDIS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TARGET_LATENCY_SECONDS,
+    LLM_TOKENS_PER_MINUTE,
+    REDIS_URL,
+    llm_rate_limit_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# lower value is served first when callers wait for a slot
+CALLER_PRIORITIES = {
+    "doxx_tweet": 0,
+    "entity_extractor": 1,
+    "metric_processor": 2,
+    "quality_evaluation": 3,
+    "score_summarizer": 3,
+}
+DEFAULT_PRIORITY = 5
+
+AIMD_DECREASE_FACTOR = 0.5
+
+# Refill both buckets and take one request plus the tokens atomically. Returns
+# the seconds to wait when either bucket is short, taking nothing in that case.
+REDIS_BUCKET_SCRIPT = """
+local function refill(key, rate, now)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or rate
+    local ts = tonumber(state[2]) or now
+    return math.min(rate, level + (now - ts) * rate / 60)
+end
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local tokens = tonumber(ARGV[4])
+local requests_level = refill(KEYS[1], rpm, now)
+local tokens_level = refill(KEYS[2], tpm, now)
+local wait = 0
+if requests_level < 1 then
+    wait = math.max(wait, (1 - requests_level) * 60 / rpm)
+end
+if tokens_level < tokens then
+    wait = math.max(wait, (tokens - tokens_level) * 60 / tpm)
+end
+if wait == 0 then
+    requests_level = requests_level - 1
+    tokens_level = tokens_level - tokens
+end
+redis.call('HSET', KEYS[1], 'level', requests_level, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tokens_level, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """In-process bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute: int):
+        self.rate = rate_per_minute
+        self.level = float(rate_per_minute)
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, amount: int) -> float:
+        now = time.monotonic()
+        self.level = min(
+            self.rate, self.level + (now - self.updated_at) * self.rate / 60
+        )
+        self.updated_at = now
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.rate
+
+    def take(self, amount: int):
+        self.level -= amount
+
+
+class LLMGovernor:
+    """Limits requests, tokens and concurrency for one model.
+
+    Requests and tokens per minute are enforced with token buckets, kept in
+    Redis when shared across processes. Concurrency is tuned with AIMD: it
+    grows by one slot per window of fast successful calls and is halved on
+    throttling or when latency exceeds the target. Streamed calls are timed to
+    their first token, since their full duration is bounded by the stream
+    ceiling rather than by congestion, and calls stopped at that ceiling leave
+    the concurrency as it is. Waiting callers are served by priority.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        min_concurrency: int = LLM_MIN_CONCURRENCY,
+        target_latency: float = LLM_TARGET_LATENCY_SECONDS,
+        redis_client: Optional[Redis] = None,
+    ):
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.redis = redis_client
+        self._redis_script = (
+            redis_client.register_script(REDIS_BUCKET_SCRIPT) if redis_client else None
+        )
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_concurrency, int(self.concurrency))
+
+    @asynccontextmanager
+    async def slot(self, priority: int, tokens: int):
+        """Hold a concurrency slot for one request, recording its outcome.
+
+        The caller sets `first_token_at` for streamed calls and `stopped` when
+        the call was cut off at a timeout or token limit.
+        """
+        await self._acquire_slot(priority)
+        outcome = {"throttled": False, "stopped": False, "first_token_at": None}
+        started_at = time.monotonic()
+        try:
+            await self._wait_for_rate(tokens)
+            started_at = time.monotonic()
+            yield outcome
+        finally:
+            latency = (outcome["first_token_at"] or time.monotonic()) - started_at
+            self._release_slot(latency, outcome["throttled"], outcome["stopped"])
+
+    async def _acquire_slot(self, priority: int):
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was granted as we got cancelled, hand it on
+                self.in_flight -= 1
+                self._grant()
+            raise
+
+    def _release_slot(self, latency: float, throttled: bool, stopped: bool = False):
+        self.in_flight -= 1
+        if throttled or (not stopped and latency > self.target_latency):
+            self.concurrency = max(
+                self.min_concurrency, self.concurrency * AIMD_DECREASE_FACTOR
+            )
+            logger.info(
+                f"{self.model} concurrency decreased to {self.limit} "
+                f"(throttled={throttled}, latency={latency:.1f}s)"
+            )
+        elif not stopped:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / max(self.concurrency, 1)
+            )
+        self._grant()
+
+    def _grant(self):
+        while self.waiters and self.in_flight < self.limit:
+            _, _, future = heapq.heappop(self.waiters)
+            if future.cancelled():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def _wait_for_rate(self, tokens: int):
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            wait = await self._reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _reserve(self, tokens: int) -> float:
+        if self._redis_script:
+            try:
+                wait = await self._redis_script(
+                    keys=[
+                        llm_rate_limit_key(self.model, "requests"),
+                        llm_rate_limit_key(self.model, "tokens"),
+                    ],
+                    args=[
+                        time.time(),
+                        self.requests_per_minute,
+                        self.tokens_per_minute,
+                        tokens,
+                    ],
+                )
+                return float(wait)
+            except Exception as e:
+                logger.error(f"Redis rate limiter failed, using local buckets: {e}")
+
+        wait = max(
+            self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens)
+        )
+        if wait <= 0:
+            self.request_bucket.take(1)
+            self.token_bucket.take(tokens)
+        return wait
+
+
+_governors: dict[str, LLMGovernor] = {}
+_redis_client: Optional[Redis] = None
+
+
+def get_governor(model: str) -> LLMGovernor:
+    """Return the process-wide governor of the model."""
+    global _redis_client
+    if model not in _governors:
+        if LLM_RATE_LIMIT_REDIS and _redis_client is None:
+            _redis_client = Redis.from_url(REDIS_URL)
+        _governors[model] = LLMGovernor(model, redis_client=_redis_client)
+    return _governors[model]
+
+
+def caller_priority(caller: str) -> int:
+    return CALLER_PRIORITIES.get(caller, DEFAULT_PRIORITY)
@@ -0,0 +1,39 @@
+import math
+import re
+
+# CJK, kana and hangul characters usually cost at least one token each, latin
+# words about one token per four characters. Estimates round up so budgets are
+# not overflowed.
+CJK_PATTERN = r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+TOKEN_PATTERN = re.compile(
+    rf"(?P<cjk>{CJK_PATTERN})|(?P<word>(?:(?!{CJK_PATTERN})[^\W_])+)|(?P<other>\S)"
+)
+
+CHARS_PER_WORD_TOKEN = 4
+TOKENS_PER_CJK_CHAR = 1.25
+TOKENS_PER_MESSAGE = 4
+
+
+def count_tokens(text: str | None) -> int:
+    """Estimate the number of tokens of the text without a remote tokenizer."""
+    if not text:
+        return 0
+    cjk = 0
+    tokens = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "cjk":
+            cjk += 1
+        elif kind == "word":
+            tokens += math.ceil(len(match.group()) / CHARS_PER_WORD_TOKEN)
+        else:
+            tokens += 1
+    return tokens + math.ceil(cjk * TOKENS_PER_CJK_CHAR)
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """Estimate the prompt tokens of a list of chat completion messages."""
+    return sum(
+        count_tokens(message.get("content")) + TOKENS_PER_MESSAGE
+        for message in messages
+    )
@@ -1,7 +1,7 @@
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
 from telethon import TelegramClient
 
 
@@ -61,6 +61,7 @@ class ProxySettings(BaseModel):
 class ChatPhoto(BaseModel):
     id: str | int
     path: str
+    thumbnail_path: Optional[str] = None
 
 
 class MemeCoinEntityMetadata(BaseModel):
@@ -145,3 +146,47 @@ class Account(BaseModel):
 class Tweet(BaseModel):
     text: str
     posted_at: int
+
+
+# response schemas of the LLM prompts, see parse_ai_response
+
+
+class AIField(BaseModel):
+    data: Any = None
+    confidence: float = 0
+    reason: Any = ""
+
+
+class AIClassification(BaseModel):
+    category: AIField
+    description: Optional[str] = None
+    entity: AIField = AIField()
+
+
+class AIMetricResult(BaseModel):
+    value: Any
+    confidence: float
+    reason: Any = ""
+
+
+class AIMetricBatch(BaseModel):
+    results: list[Any] = []
+
+
+class AIQualityResult(BaseModel):
+    score: float
+    category_alignment: float
+
+
+class AIScoreSummary(BaseModel):
+    score: float
+    summary: str
+    highlights: str = ""
+
+    @field_validator("highlights", mode="before")
+    @classmethod
+    def join_highlights(cls, value: Any) -> Any:
+        # asked for a comma separated string, models often send a list
+        if isinstance(value, list):
+            return ", ".join(str(item) for item in value)
+        return "" if value is None else value
@@ -1,42 +1,54 @@
-import json
 import logging
 import re
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+from src.common.json_repair import repair_json, repair_stats
 
 logger = logging.getLogger(__name__)
 
 
-def parse_ai_response(response: str | None, fields: list[str] = None) -> dict:
+def _extract_fields(response: str, fields: list[str]) -> dict:
+    """Last resort: pull flat string fields out with a regex each."""
+    result = {}
+    for field in fields:
+        match = re.search(rf'{field}"?\s*:\s*"([^"]+)"', response)
+        if match and match.group(1):
+            result[field] = match.group(1)
+    return result
+
+
+def parse_ai_response(
+    response: str | None,
+    fields: list[str] = None,
+    schema: Optional[type[BaseModel]] = None,
+) -> dict:
+    """Parse the JSON object in an LLM response.
+
+    Reasoning blocks, markdown and surrounding text are stripped and common
+    defects repaired, see `repair_json`. When `schema` is given the result is
+    validated and normalized by it, and {} is returned if it does not fit.
+    """
     if not response:
         return {}
 
-    try:
-        # First try direct JSON parsing
-        return json.loads(response)
-    except json.JSONDecodeError:
-        # If that fails, try to extract JSON from markdown
-        if response.startswith("```json"):
-            logger.info("Found JSON in markdown")
-            # Remove markdown formatting
-            cleaned_result = response.replace("```json\n", "").replace("\n```", "")
-            try:
-                return json.loads(cleaned_result)
-            except json.JSONDecodeError:
-                pass
-
+    result, repairs = repair_json(response)
+    if repairs:
+        logger.info(f"Repaired AI response: {', '.join(repairs)}")
+    if result is None:
         logger.info(f"Trying regex to extract JSON: {response}")
-        # Last resort: try to extract using regex
-
-        result = {}
-        for field in fields or []:
-            match = re.search(rf'{field}"?\s*:\s*"([^"]+)"', response)
-            if match and match.group(1):
-                result[field] = match.group(1)
-            else:
-                result[field] = None
-
-        # exclude none fields
-        result = {k: v for k, v in result.items() if v is not None}
+        repair_stats["regex_fallback"] += 1
+        result = _extract_fields(response, fields or [])
+
+    if schema is None:
         return result
+    try:
+        return schema.model_validate(result).model_dump()
+    except ValidationError as e:
+        repair_stats["schema_invalid"] += 1
+        logger.warning(f"AI response does not match {schema.__name__}: {e}")
+        return {}
 
 
 def normalize_chat_id(chat_id: str | int) -> str:
@@ -0,0 +1,163 @@
+import logging
+from collections import OrderedDict
+from typing import Callable
+
+import asyncpg
+
+from src.common.config import CHAT_SNAPSHOT_MAX_CHATS
+from src.common.tokenizer import count_tokens
+from src.common.types import ChatMessage
+from src.helpers.dedup import DedupStats, compress_near_duplicates
+from src.helpers.message_helper import (
+    db_row_to_chat_message,
+    gen_message_content,
+    gen_timeline_content,
+)
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_EVERY = 100
+
+# how a message is rendered into a prompt line, by style name
+RENDERERS: dict[str, Callable[[ChatMessage], str]] = {
+    "content": gen_message_content,
+    "timeline": gen_timeline_content,
+}
+
+
+class ChatSnapshot:
+    """Latest messages of a chat as of a high-water mark.
+
+    Rendered lines and their token counts are computed once per style and
+    shared by every processor reading the snapshot.
+    """
+
+    def __init__(
+        self,
+        chat_id: str,
+        high_water_mark: tuple[int, int],
+        messages: list[ChatMessage],
+        limit: int,
+    ):
+        self.chat_id = chat_id
+        self.high_water_mark = high_water_mark
+        self.messages = messages  # chronological
+        self.limit = limit
+        self._rendered: dict[str, tuple[list[str], list[int]]] = {}
+        self._compressed: dict[
+            tuple[str, int], tuple[list[str], list[int], DedupStats]
+        ] = {}
+
+    @property
+    def last_message_timestamp(self) -> int:
+        return self.high_water_mark[0]
+
+    def covers(self, limit: int) -> bool:
+        """Whether the snapshot holds the latest `limit` messages."""
+        return self.limit >= limit or len(self.messages) < self.limit
+
+    def recent(self, limit: int) -> list[ChatMessage]:
+        return self.messages[-limit:] if limit else []
+
+    def rendered(self, style: str, limit: int) -> tuple[list[str], list[int]]:
+        """Prompt lines of the latest `limit` messages and their token counts."""
+        if style not in self._rendered:
+            lines = [RENDERERS[style](message) for message in self.messages]
+            self._rendered[style] = (lines, [count_tokens(line) for line in lines])
+        lines, tokens = self._rendered[style]
+        if not limit:
+            return [], []
+        return lines[-limit:], tokens[-limit:]
+
+    def compressed(
+        self, style: str, limit: int
+    ) -> tuple[list[str], list[int], DedupStats]:
+        """Like rendered, with near-duplicate messages folded into one line."""
+        key = (style, limit)
+        if key not in self._compressed:
+            lines, tokens = self.rendered(style, limit)
+            texts = [message.message_text for message in self.recent(limit)]
+            self._compressed[key] = compress_near_duplicates(lines, tokens, texts)
+        return self._compressed[key]
+
+
+class ChatSnapshotStore:
+    """In-process LRU of chat snapshots, refreshed only when messages arrive.
+
+    A lookup costs one index-only query for the chat's newest message; the
+    messages are only fetched again when it moved past the snapshot.
+    """
+
+    def __init__(self, max_chats: int = CHAT_SNAPSHOT_MAX_CHATS):
+        self.max_chats = max_chats
+        self.snapshots: OrderedDict[str, ChatSnapshot] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def get(
+        self, conn: asyncpg.Connection, chat_id: str, limit: int
+    ) -> ChatSnapshot:
+        high_water_mark = await self._high_water_mark(conn, chat_id)
+        snapshot = self.snapshots.get(chat_id)
+        if (
+            snapshot
+            and snapshot.high_water_mark == high_water_mark
+            and snapshot.covers(limit)
+        ):
+            self.snapshots.move_to_end(chat_id)
+            self._record("hits")
+            return snapshot
+
+        self._record("misses")
+        # never shrink a snapshot another processor needs more of
+        limit = max(limit, snapshot.limit if snapshot else 0)
+        rows = await conn.fetch(
+            """
+            SELECT chat_id, message_id, reply_to, topic_id,
+            sender_id, message_text, buttons, message_timestamp
+            FROM chat_messages
+            WHERE chat_id = $1
+            ORDER BY message_timestamp DESC, id DESC
+            LIMIT $2
+            """,
+            chat_id,
+            limit,
+        )
+        messages = [db_row_to_chat_message(row) for row in rows]
+        messages.reverse()
+        snapshot = ChatSnapshot(chat_id, high_water_mark, messages, limit)
+        self.snapshots[chat_id] = snapshot
+        self.snapshots.move_to_end(chat_id)
+        while len(self.snapshots) > self.max_chats:
+            self.snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, chat_id: str):
+        self.snapshots.pop(chat_id, None)
+
+    @staticmethod
+    async def _high_water_mark(
+        conn: asyncpg.Connection, chat_id: str
+    ) -> tuple[int, int]:
+        row = await conn.fetchrow(
+            """
+            SELECT message_timestamp, id
+            FROM chat_messages
+            WHERE chat_id = $1
+            ORDER BY message_timestamp DESC, id DESC
+            LIMIT 1
+            """,
+            chat_id,
+        )
+        return (row["message_timestamp"], row["id"]) if row else (0, 0)
+
+    def _record(self, outcome: str):
+        self.stats[outcome] += 1
+        total = self.stats["hits"] + self.stats["misses"]
+        if total % STATS_LOG_EVERY == 0:
+            logger.info(
+                f"chat snapshots: hit rate {self.stats['hits'] / total:.2%}, "
+                f"{len(self.snapshots)} chats cached"
+            )
+
+
+chat_snapshots = ChatSnapshotStore()
@@ -0,0 +1,136 @@
+import logging
+from typing import Optional
+
+from pydantic import BaseModel
+
+from src.common.tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 6000
+MODEL_CONTEXT_TOKEN_BUDGETS = {
+    "deepseek/deepseek-r1-distill-llama-70b": 8000,
+    "deepseek-chat": 8000,
+    "gpt-3.5-turbo": 3000,
+    "gpt-4": 6000,
+}
+
+# maximum share of the budget description and pinned messages may take, so
+# recent messages always get room; unused shares roll over to recent messages
+DESCRIPTION_BUDGET_SHARE = 0.1
+PINNED_BUDGET_SHARE = 0.3
+
+RECENT_MESSAGES_HEADER = "\nRecent Messages:"
+
+
+class ChatContext(BaseModel):
+    text: str
+    token_budget: int
+    tokens_used: int
+    messages_included: int
+    messages_dropped: int
+
+
+def context_token_budget(model: str | None) -> int:
+    if model in MODEL_CONTEXT_TOKEN_BUDGETS:
+        return MODEL_CONTEXT_TOKEN_BUDGETS[model]
+    # openrouter names are namespaced by vendor, e.g. openai/gpt-4
+    name = (model or "").rsplit("/", 1)[-1]
+    return MODEL_CONTEXT_TOKEN_BUDGETS.get(name, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def _take_within(
+    parts: list[str], budget: int, costs: Optional[list[int]] = None
+) -> tuple[list[str], int]:
+    """Take whole parts in order while they fit in the budget.
+
+    `costs` are the precomputed token counts of the parts, if known.
+    """
+    taken = []
+    used = 0
+    for i, part in enumerate(parts):
+        cost = (costs[i] if costs else count_tokens(part)) + 1  # newline separator
+        if used + cost > budget:
+            break
+        taken.append(part)
+        used += cost
+    return taken, used
+
+
+def _trim_text(text: str, budget: int) -> str:
+    """Trim text to the budget, cutting at line boundaries where possible."""
+    if count_tokens(text) <= budget:
+        return text
+    lines, _ = _take_within(text.splitlines(), budget)
+    if lines:
+        return "\n".join(lines)
+    # a single oversized line, cut proportionally
+    ratio = budget / max(count_tokens(text), 1)
+    return text[: int(len(text) * ratio)]
+
+
+def build_chat_context(
+    header: list[str],
+    recent_messages: list[str],
+    token_budget: int,
+    description: Optional[str] = None,
+    pinned_messages: Optional[list[str]] = None,
+    recent_message_tokens: Optional[list[int]] = None,
+) -> ChatContext:
+    """Assemble a prompt context that fills the token budget by priority.
+
+    The header is always kept, then the description, pinned messages and
+    finally recent messages, newest first. Recent messages are given in
+    chronological order and are only ever dropped whole. Their token counts
+    may be passed in `recent_message_tokens`, e.g. from a chat snapshot.
+    """
+    used = sum(count_tokens(part) + 1 for part in header)
+    parts = list(header)
+
+    if description:
+        description = _trim_text(
+            description,
+            min(
+                int(token_budget * DESCRIPTION_BUDGET_SHARE),
+                max(token_budget - used, 0),
+            ),
+        )
+        if description:
+            parts.append(f"Description: {description}")
+            used += count_tokens(parts[-1]) + 1
+
+    pinned_messages = pinned_messages or []
+    pinned_budget = min(
+        int(token_budget * PINNED_BUDGET_SHARE), max(token_budget - used, 0)
+    )
+    pinned, pinned_used = _take_within(
+        [f"Pinned Message: {message}" for message in pinned_messages],
+        pinned_budget,
+    )
+    parts.extend(pinned)
+    used += pinned_used
+
+    used += count_tokens(RECENT_MESSAGES_HEADER) + 1
+    recent, recent_used = _take_within(
+        list(reversed(recent_messages)),
+        max(token_budget - used, 0),
+        list(reversed(recent_message_tokens)) if recent_message_tokens else None,
+    )
+    recent.reverse()
+    used += recent_used
+    parts.append(RECENT_MESSAGES_HEADER)
+    parts.extend(recent)
+
+    dropped = len(pinned_messages) - len(pinned) + len(recent_messages) - len(recent)
+    if dropped:
+        logger.info(
+            f"context budget {token_budget} tokens: used {used}, dropped "
+            f"{dropped} messages"
+        )
+    return ChatContext(
+        text="\n".join(parts),
+        token_budget=token_budget,
+        tokens_used=used,
+        messages_included=len(pinned) + len(recent),
+        messages_dropped=dropped,
+    )
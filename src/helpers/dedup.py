@@ -0,0 +1,131 @@
+import hashlib
+import re
+
+from pydantic import BaseModel
+
+from src.common.tokenizer import count_tokens
+
+SIMHASH_BITS = 64
+# messages within this many differing bits are near-duplicates
+MAX_HAMMING_DISTANCE = 3
+# with 4 bands of 16 bits, any pair within 3 bits shares at least one band
+BANDS = 4
+BAND_BITS = SIMHASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+URL_PATTERN = re.compile(r"https?://\S+")
+# amounts, wallet fragments and other words containing digits
+NUMBER_PATTERN = re.compile(r"\w*\d[\w.,]*")
+WORD_PATTERN = re.compile(r"\w+")
+# shorter texts have too few bigrams for a stable fingerprint, they are only
+# folded when their normalized words are identical
+MIN_SIMHASH_WORDS = 4
+
+
+class DedupStats(BaseModel):
+    messages: int
+    groups: int
+    duplicates: int  # messages folded into another one
+
+    @property
+    def duplicate_ratio(self) -> float:
+        return self.duplicates / self.messages if self.messages else 0.0
+
+    def summary(self) -> str:
+        """Context header line, a high ratio hints at spam or bot floods."""
+        return (
+            f"Near-Duplicate Messages: {self.duplicates} of {self.messages} "
+            f"({self.duplicate_ratio:.0%})"
+        )
+
+
+def _words(text: str) -> list[str]:
+    """Words of the text, ignoring numbers, ids and link targets."""
+    text = URL_PATTERN.sub("url", text.lower())
+    text = NUMBER_PATTERN.sub("0", text)
+    return WORD_PATTERN.findall(text)
+
+
+def _features(text: str) -> list[str]:
+    """Word bigrams of the text."""
+    words = _words(text)
+    if len(words) < 2:
+        return words or [text]
+    return [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def simhash(text: str) -> int:
+    weights = [0] * SIMHASH_BITS
+    for feature in _features(text):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def group_near_duplicates(texts: list[str]) -> list[list[int]]:
+    """Indices of the texts grouped by near-duplicate SimHash, in order.
+
+    Texts under MIN_SIMHASH_WORDS words are only grouped with identical ones,
+    texts without words are never grouped.
+    """
+    hashes = [simhash(text) for text in texts]
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    exact: dict[tuple[str, ...], int] = {}
+    buckets: dict[tuple[int, int], list[int]] = {}
+    for i, value in enumerate(hashes):
+        words = _words(texts[i])
+        if len(words) < MIN_SIMHASH_WORDS:
+            if words:
+                parent[i] = find(exact.setdefault(tuple(words), i))
+            continue
+        for band in range(BANDS):
+            key = (band, value >> (band * BAND_BITS) & BAND_MASK)
+            for j in buckets.setdefault(key, []):
+                if find(i) == find(j):
+                    continue
+                if bin(value ^ hashes[j]).count("1") <= MAX_HAMMING_DISTANCE:
+                    parent[find(i)] = find(j)
+            buckets[key].append(i)
+
+    groups: dict[int, list[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values(), key=lambda group: group[-1])
+
+
+def compress_near_duplicates(
+    lines: list[str], tokens: list[int], texts: list[str]
+) -> tuple[list[str], list[int], DedupStats]:
+    """Replace each group of near-duplicate lines by its latest line and a count.
+
+    Lines are grouped on their message `texts`, not the rendered lines whose
+    shared timestamp and sender parts would dominate short messages. Lines are
+    chronological, so representatives keep the position of their latest
+    occurrence.
+    """
+    groups = group_near_duplicates(texts)
+    compressed_lines = []
+    compressed_tokens = []
+    for group in groups:
+        latest = group[-1]
+        if len(group) == 1:
+            compressed_lines.append(lines[latest])
+            compressed_tokens.append(tokens[latest])
+            continue
+        suffix = f" [repeated {len(group)}x]"
+        compressed_lines.append(lines[latest] + suffix)
+        compressed_tokens.append(tokens[latest] + count_tokens(suffix))
+
+    stats = DedupStats(
+        messages=len(lines), groups=len(groups), duplicates=len(lines) - len(groups)
+    )
+    return compressed_lines, compressed_tokens, stats
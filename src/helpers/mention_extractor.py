@@ -0,0 +1,189 @@
+import logging
+import re
+from typing import Iterable, Optional
+
+import asyncpg
+from pydantic import BaseModel
+
+from src.common.types import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+SOLANA_ADDRESS_BYTES = 32
+
+EVM_ADDRESS_PATTERN = re.compile(r"\b0x[a-fA-F0-9]{40}\b")
+SOLANA_ADDRESS_PATTERN = re.compile(r"\b[1-9A-HJ-NP-Za-km-z]{32,44}\b")
+TICKER_PATTERN = re.compile(r"\$([A-Za-z][A-Za-z0-9]{1,9})\b")
+# one pass over the text, links first so addresses in their paths are
+# attributed to the link and parsed from it
+MENTION_PATTERN = re.compile(
+    r"(?P<link>https?://(?:www\.)?(?P<site>pump\.fun|dexscreener\.com|gmgn\.ai)"
+    r"/[^\s)\]]+)"
+    rf"|(?P<evm>{EVM_ADDRESS_PATTERN.pattern})"
+    rf"|(?P<ticker>{TICKER_PATTERN.pattern})"
+    rf"|(?P<solana>{SOLANA_ADDRESS_PATTERN.pattern})",
+)
+LINK_KINDS = {
+    "pump.fun": "pump_fun",
+    "dexscreener.com": "dexscreener",
+    "gmgn.ai": "gmgn",
+}
+# chain names used in dexscreener and gmgn paths
+CHAIN_ALIASES = {"sol": "solana", "eth": "ethereum"}
+
+
+class Mention(BaseModel):
+    chat_id: str
+    message_id: str
+    kind: str  # evm_address, solana_address, ticker, pump_fun, dexscreener, gmgn
+    value: str
+    chain: Optional[str] = None
+    message_timestamp: int
+
+
+def is_solana_address(value: str) -> bool:
+    """Whether value is base58 that decodes to a 32 byte public key."""
+    if not 32 <= len(value) <= 44:
+        return False
+    number = 0
+    for char in value:
+        index = BASE58_INDEX.get(char)
+        if index is None:
+            return False
+        number = number * 58 + index
+    leading_zeros = len(value) - len(value.lstrip("1"))
+    return leading_zeros + (number.bit_length() + 7) // 8 == SOLANA_ADDRESS_BYTES
+
+
+def _link_mentions(url: str, site: str) -> list[tuple[str, str, Optional[str]]]:
+    """The link itself plus the address in its path, if any."""
+    path = url.split(site, 1)[1].strip("/").split("?")[0].split("/")
+    chain = "solana" if site == "pump.fun" else None
+    if site in ("dexscreener.com", "gmgn.ai") and path:
+        chain = CHAIN_ALIASES.get(path[0].lower(), path[0].lower())
+
+    found = [(LINK_KINDS[site], url, chain)]
+    # dexscreener paths hold pair addresses, not token addresses
+    if site == "dexscreener.com":
+        return found
+    for segment in path:
+        if EVM_ADDRESS_PATTERN.fullmatch(segment):
+            found.append(("evm_address", segment.lower(), chain))
+        elif is_solana_address(segment):
+            found.append(("solana_address", segment, "solana"))
+    return found
+
+
+def extract_from_text(text: str) -> list[tuple[str, str, Optional[str]]]:
+    """All (kind, value, chain) mentions in a text, in order of appearance."""
+    found = []
+    for match in MENTION_PATTERN.finditer(text or ""):
+        if match.group("link"):
+            found.extend(_link_mentions(match.group("link"), match.group("site")))
+        elif match.group("evm"):
+            found.append(("evm_address", match.group("evm").lower(), None))
+        elif match.group("ticker"):
+            found.append(("ticker", match.group("ticker")[1:].upper(), None))
+        elif match.group("solana") and is_solana_address(match.group("solana")):
+            found.append(("solana_address", match.group("solana"), "solana"))
+    return found
+
+
+def extract_mentions(messages: Iterable[Optional[ChatMessage]]) -> list[Mention]:
+    """Extract unique mentions per message from its text and button urls."""
+    mentions = []
+    for message in messages:
+        if not message:
+            continue
+        texts = [message.message_text] + [
+            button.url for button in message.buttons if button.url
+        ]
+        seen = set()
+        for text in texts:
+            for kind, value, chain in extract_from_text(text):
+                if (kind, value) in seen:
+                    continue
+                seen.add((kind, value))
+                mentions.append(
+                    Mention(
+                        chat_id=message.chat_id,
+                        message_id=message.message_id,
+                        kind=kind,
+                        value=value,
+                        chain=chain,
+                        message_timestamp=message.message_timestamp,
+                    )
+                )
+    return mentions
+
+
+def first_contract(text: str) -> tuple[Optional[str], Optional[str]]:
+    """First contract address in a text and its chain."""
+    for kind, value, chain in extract_from_text(text):
+        if kind == "evm_address":
+            return value, chain or "evm"
+        if kind == "solana_address":
+            return value, "solana"
+    return None, None
+
+
+async def store_mentions(pg_conn: asyncpg.Connection, mentions: list[Mention]):
+    if not mentions:
+        return 0
+    await pg_conn.execute(
+        """
+        INSERT INTO chat_mentions (
+            chat_id, message_id, kind, value, chain, message_timestamp
+        )
+        SELECT * FROM unnest(
+            $1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::bigint[]
+        )
+        ON CONFLICT (chat_id, message_id, kind, value) DO NOTHING
+        """,
+        [m.chat_id for m in mentions],
+        [m.message_id for m in mentions],
+        [m.kind for m in mentions],
+        [m.value for m in mentions],
+        [m.chain for m in mentions],
+        [m.message_timestamp for m in mentions],
+    )
+    return len(mentions)
+
+
+async def get_top_mentions(
+    pg_conn: asyncpg.Connection, chat_id: str, kinds: list[str], limit: int = 5
+) -> list[dict]:
+    """Most mentioned values of the given kinds in a chat."""
+    rows = await pg_conn.fetch(
+        """
+        SELECT kind, value, max(chain) AS chain, count(*) AS mentions,
+               max(message_timestamp) AS last_mentioned_at
+        FROM chat_mentions
+        WHERE chat_id = $1 AND kind = ANY($2)
+        GROUP BY kind, value
+        ORDER BY mentions DESC, last_mentioned_at DESC
+        LIMIT $3
+        """,
+        chat_id,
+        kinds,
+        limit,
+    )
+    return [dict(row) for row in rows]
+
+
+async def get_mentioning_chats(
+    pg_conn: asyncpg.Connection, values: list[str]
+) -> dict[str, list[str]]:
+    """Chats mentioning each of the given addresses or tickers."""
+    rows = await pg_conn.fetch(
+        """
+        SELECT value, array_agg(DISTINCT chat_id) AS chat_ids
+        FROM chat_mentions
+        WHERE value = ANY($1)
+        GROUP BY value
+        """,
+        values,
+    )
+    return {row["value"]: list(row["chat_ids"]) for row in rows}
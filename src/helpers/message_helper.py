@@ -1,5 +1,6 @@
 import json
 import logging
+from datetime import datetime
 from typing import Optional
 
 import asyncpg
@@ -11,6 +12,7 @@ from src.common.types import (
     MessageReaction,
     MessageSender,
 )
+from src.helpers.mention_extractor import extract_mentions, store_mentions
 
 logger = logging.getLogger(__name__)
 
@@ -161,11 +163,16 @@ async def store_messages(
                 for m in messages
             ],
         )
-        return len(messages)
     except Exception as e:
         logger.error(f"Database error: {e}")
         return 0
 
+    try:
+        await store_mentions(pg_conn, extract_mentions(messages))
+    except Exception as e:
+        logger.error(f"Failed to store mentions: {e}")
+    return len(messages)
+
 
 def gen_message_content(message: ChatMessage) -> str:
     text = message.message_text
@@ -174,6 +181,11 @@ def gen_message_content(message: ChatMessage) -> str:
     return text
 
 
+def gen_timeline_content(message: ChatMessage) -> str:
+    timestamp = datetime.fromtimestamp(message.message_timestamp).isoformat()
+    return f"[{timestamp}] User {message.sender_id}: {message.message_text}"
+
+
 async def get_messages(
     pg_conn: asyncpg.Connection, chat_id: str, message_ids: list[str]
 ) -> dict[str, ChatMessage]:
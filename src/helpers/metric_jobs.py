@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# claims are heartbeated while their chat is processed, see extend_metric_job_claims
+CLAIM_SECONDS = 300
+RETRY_SECONDS = 600
+# jobs due within the horizon are timed in memory, reloaded every refill
+HORIZON_SECONDS = 900
+REFILL_SECONDS = 300
+MAX_TIMED_JOBS = 10000
+
+# Claim the given (chat, metric) jobs if they are still due and unclaimed. Claims
+# expire so a crashed instance's jobs are picked up again, see
+# release_expired_metric_jobs.
+CLAIM_QUERY = """
+    WITH due AS (
+        SELECT j.chat_id, j.metric_definition_id
+        FROM metric_jobs j
+        INNER JOIN unnest($2::text[], $3::int[]) AS k(chat_id, metric_definition_id)
+            ON k.chat_id = j.chat_id
+            AND k.metric_definition_id = j.metric_definition_id
+        WHERE j.claimed_until IS NULL AND j.due_at <= NOW()
+        FOR UPDATE OF j SKIP LOCKED
+    )
+    UPDATE metric_jobs j
+    SET claimed_by = $1,
+        claimed_until = NOW() + make_interval(secs => $4),
+        updated_at = NOW()
+    FROM due
+    WHERE j.chat_id = due.chat_id
+    AND j.metric_definition_id = due.metric_definition_id
+    RETURNING j.chat_id, j.metric_definition_id
+"""
+
+# Move jobs whose value was refreshed within its window, by another instance
+# after an expired claim or by a manual refresh, to the value's next refresh
+POSTPONE_FRESH_QUERY = """
+    UPDATE metric_jobs j
+    SET due_at = v.next_refresh_at, updated_at = NOW()
+    FROM unnest($1::text[], $2::int[]) AS k(chat_id, metric_definition_id),
+         chat_metric_values v
+    WHERE j.chat_id = k.chat_id
+    AND j.metric_definition_id = k.metric_definition_id
+    AND v.chat_id = j.chat_id
+    AND v.metric_definition_id = j.metric_definition_id
+    AND j.claimed_until IS NULL
+    AND v.next_refresh_at > NOW()
+"""
+
+JobKey = tuple[str, int]  # chat_id, metric_definition_id
+
+
+class DueTimer:
+    """Min-heap of job due times, sleeping until the next one is due.
+
+    Rescheduling a job leaves its old heap entry behind, entries not matching
+    `scheduled` are skipped when popped.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, JobKey]] = []
+        self.scheduled: dict[JobKey, float] = {}
+        self.woken = asyncio.Event()
+        self.woken.set()  # the first wait returns at once
+
+    def __len__(self) -> int:
+        return len(self.scheduled)
+
+    def schedule(self, key: JobKey, due_at: float):
+        if self.scheduled.get(key) == due_at:
+            return
+        earliest = self.next_due_at()
+        self.scheduled[key] = due_at
+        heapq.heappush(self.heap, (due_at, key))
+        if earliest is None or due_at < earliest:
+            self.woken.set()
+
+    def replace(self, jobs: list[tuple[JobKey, float]]):
+        self.scheduled = dict(jobs)
+        self.heap = [(due_at, key) for key, due_at in self.scheduled.items()]
+        heapq.heapify(self.heap)
+
+    def unschedule(self, key: JobKey):
+        self.scheduled.pop(key, None)
+
+    def next_due_at(self) -> Optional[float]:
+        while self.heap and self.scheduled.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, limit: int, now: Optional[float] = None) -> list[JobKey]:
+        """Remove and return up to `limit` jobs due by now."""
+        now = now or time.time()
+        due = []
+        while len(due) < limit:
+            due_at = self.next_due_at()
+            if due_at is None or due_at > now:
+                break
+            _, key = heapq.heappop(self.heap)
+            del self.scheduled[key]
+            due.append(key)
+        return due
+
+    def wake(self):
+        self.woken.set()
+
+    async def wait(self, max_seconds: float):
+        """Sleep until the next job is due, `max_seconds` or a wake call."""
+        next_due_at = self.next_due_at()
+        timeout = max_seconds
+        if next_due_at is not None:
+            timeout = min(timeout, max(next_due_at - time.time(), 0))
+        if timeout > 0 and not self.woken.is_set():
+            try:
+                await asyncio.wait_for(self.woken.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.woken.clear()
+
+
+async def claim_metric_jobs(
+    pg_conn: asyncpg.Connection, claimed_by: str, keys: list[JobKey]
+) -> dict[str, list[int]]:
+    """Claim the given jobs, skipping those no longer due or claimed elsewhere.
+
+    Jobs are per (chat, metric) whatever the number of users watching the
+    chat, and a job whose value is still fresh is postponed, not claimed, so
+    each value is computed once per refresh window.
+    """
+    if not keys:
+        return {}
+    chat_ids = [chat_id for chat_id, _ in keys]
+    metric_ids = [metric_id for _, metric_id in keys]
+    async with pg_conn.transaction():
+        result = await pg_conn.execute(POSTPONE_FRESH_QUERY, chat_ids, metric_ids)
+        rows = await pg_conn.fetch(
+            CLAIM_QUERY, claimed_by, chat_ids, metric_ids, CLAIM_SECONDS
+        )
+    jobs = defaultdict(list)
+    for row in rows:
+        jobs[row["chat_id"]].append(row["metric_definition_id"])
+    logger.info(
+        f"{claimed_by} claimed {len(rows)}/{len(keys)} due jobs, "
+        f"{result.split()[-1]} postponed as fresh"
+    )
+    return dict(jobs)
+
+
+async def load_upcoming_metric_jobs(
+    pg_conn: asyncpg.Connection,
+    horizon_seconds: int = HORIZON_SECONDS,
+    limit: int = MAX_TIMED_JOBS,
+) -> list[tuple[JobKey, float]]:
+    """Unclaimed jobs due within the horizon and their due epoch seconds."""
+    rows = await pg_conn.fetch(
+        """
+        SELECT chat_id, metric_definition_id, extract(epoch FROM due_at) AS due_at
+        FROM metric_jobs
+        WHERE claimed_until IS NULL
+        AND due_at <= NOW() + make_interval(secs => $1)
+        ORDER BY due_at
+        LIMIT $2
+        """,
+        horizon_seconds,
+        limit,
+    )
+    return [
+        ((row["chat_id"], row["metric_definition_id"]), float(row["due_at"]))
+        for row in rows
+    ]
+
+
+async def complete_metric_jobs(
+    pg_conn: asyncpg.Connection, claimed_by: str, chat_id: str, metric_ids: list[int]
+):
+    """Release refreshed jobs, their due time follows chat_metric_values."""
+    if not metric_ids:
+        return
+    await pg_conn.execute(
+        """
+        UPDATE metric_jobs
+        SET claimed_by = NULL, claimed_until = NULL, updated_at = NOW()
+        WHERE claimed_by = $1 AND chat_id = $2 AND metric_definition_id = ANY($3)
+        """,
+        claimed_by,
+        chat_id,
+        metric_ids,
+    )
+
+
+async def release_metric_jobs(
+    pg_conn: asyncpg.Connection,
+    claimed_by: str,
+    chat_id: str,
+    metric_ids: list[int],
+    retry_seconds: int = RETRY_SECONDS,
+):
+    """Release failed jobs, retrying them after `retry_seconds`."""
+    if not metric_ids:
+        return
+    await pg_conn.execute(
+        """
+        UPDATE metric_jobs
+        SET claimed_by = NULL,
+            claimed_until = NULL,
+            due_at = NOW() + make_interval(secs => $4),
+            updated_at = NOW()
+        WHERE claimed_by = $1 AND chat_id = $2 AND metric_definition_id = ANY($3)
+        """,
+        claimed_by,
+        chat_id,
+        metric_ids,
+        retry_seconds,
+    )
+
+
+async def extend_metric_job_claims(
+    pg_conn: asyncpg.Connection,
+    claimed_by: str,
+    claim_seconds: int = CLAIM_SECONDS,
+) -> int:
+    """Keep the live claims of an instance from expiring while it works."""
+    result = await pg_conn.execute(
+        """
+        UPDATE metric_jobs
+        SET claimed_until = NOW() + make_interval(secs => $2), updated_at = NOW()
+        WHERE claimed_by = $1 AND claimed_until > NOW()
+        """,
+        claimed_by,
+        claim_seconds,
+    )
+    return int(result.split()[-1])
+
+
+async def release_expired_metric_jobs(pg_conn: asyncpg.Connection) -> int:
+    """Make jobs of crashed or stalled instances claimable again."""
+    result = await pg_conn.execute("""
+        UPDATE metric_jobs
+        SET claimed_by = NULL, claimed_until = NULL, updated_at = NOW()
+        WHERE claimed_until < NOW()
+        """)
+    released = int(result.split()[-1])
+    if released:
+        logger.warning(f"released {released} expired metric job claims")
+    return released
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from PIL import Image
+
+from src.common.r2_client import file_exists, upload_bytes
+from src.common.types import ChatPhoto
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 128
+THUMBNAIL_WORKERS = 2
+# R2 keys known to exist, least recently used ones are forgotten past this
+MAX_KNOWN_KEYS = 10000
+
+# (magic bytes, offset, extension, content type)
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", 0, ".jpg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", 0, ".png", "image/png"),
+    (b"GIF87a", 0, ".gif", "image/gif"),
+    (b"GIF89a", 0, ".gif", "image/gif"),
+    (b"WEBP", 8, ".webp", "image/webp"),
+]
+
+_thumbnail_pool: Optional[ProcessPoolExecutor] = None
+_known_keys: OrderedDict[str, None] = OrderedDict()
+
+
+def detect_image_type(data: bytes) -> tuple[str, str]:
+    """Detect extension and content type from the image magic bytes."""
+    for signature, offset, extension, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature, offset):
+            return extension, content_type
+    return ".jpg", "image/jpeg"
+
+
+def photo_key(digest: str, extension: str) -> str:
+    return f"photos/{digest}{extension}"
+
+
+def thumbnail_key(digest: str, size: int = THUMBNAIL_SIZE) -> str:
+    return f"photos/thumbnails/{digest}_{size}.jpg"
+
+
+def make_thumbnail(data: bytes, size: int = THUMBNAIL_SIZE) -> bytes:
+    """Resize the image into a jpeg thumbnail, runs inside the process pool."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+
+def get_thumbnail_pool() -> ProcessPoolExecutor:
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _thumbnail_pool
+
+
+def _remember_key(key: str):
+    _known_keys[key] = None
+    _known_keys.move_to_end(key)
+    while len(_known_keys) > MAX_KNOWN_KEYS:
+        _known_keys.popitem(last=False)
+
+
+async def _key_exists(key: str) -> bool:
+    """Check R2 for the key, caching keys that are known to exist."""
+    if key in _known_keys:
+        _known_keys.move_to_end(key)
+        return True
+    if await asyncio.to_thread(file_exists, key):
+        _remember_key(key)
+        return True
+    return False
+
+
+async def _upload(data: bytes, key: str, content_type: str):
+    await asyncio.to_thread(upload_bytes, data, key, content_type)
+    _remember_key(key)
+
+
+async def store_photo(photo_id: str | int, data: bytes) -> ChatPhoto:
+    """Store photo bytes in R2 keyed by content hash, with a thumbnail."""
+    digest = hashlib.sha256(data).hexdigest()
+    extension, content_type = detect_image_type(data)
+    key = photo_key(digest, extension)
+    if await _key_exists(key):
+        logger.info(f"photo {photo_id} already stored at {key}, skipping upload")
+    else:
+        await _upload(data, key, content_type)
+        logger.info(f"uploaded photo {photo_id} to {key}")
+
+    thumbnail_path = thumbnail_key(digest)
+    if not await _key_exists(thumbnail_path):
+        try:
+            loop = asyncio.get_running_loop()
+            thumbnail = await loop.run_in_executor(
+                get_thumbnail_pool(), make_thumbnail, data
+            )
+            await _upload(thumbnail, thumbnail_path, "image/jpeg")
+        except Exception as e:
+            logger.error(f"Failed to create thumbnail for photo {photo_id}: {e}")
+            thumbnail_path = None
+
+    return ChatPhoto(id=str(photo_id), path=key, thumbnail_path=thumbnail_path)
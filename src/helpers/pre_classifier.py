@@ -0,0 +1,185 @@
+import logging
+import re
+from typing import Optional
+
+from src.common.config import PRE_CLASSIFY_MIN_CONFIDENCE
+from src.common.types import ChatMessage
+from src.helpers.mention_extractor import TICKER_PATTERN, first_contract
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_EVERY = 100
+MAX_RULE_CONFIDENCE = 95
+
+PORTAL_NAME_PATTERN = re.compile(r"\bportal\b", re.IGNORECASE)
+VERIFY_PATTERN = re.compile(
+    r"\b(tap to verify|human verification|verify|captcha)\b", re.IGNORECASE
+)
+# verification bots are matched on links only, "rose" is too common in text
+VERIFY_BOT_PATTERN = re.compile(
+    r"t\.me/\w*(safeguard|missrose|rose|captcha|guardian|shieldy)\w*",
+    re.IGNORECASE,
+)
+PROJECT_KEYWORDS_PATTERN = re.compile(
+    r"\b(tokenomics|whitepaper|roadmap|presale|liquidity locked)\b", re.IGNORECASE
+)
+TOKEN_LINK_PATTERN = re.compile(
+    r"https?://(?:www\.)?(?:dexscreener\.com|pump\.fun|gmgn\.ai|dextools\.io|"
+    r"birdeye\.so|raydium\.io|app\.uniswap\.org)\S*",
+    re.IGNORECASE,
+)
+
+stats = {"rules": 0, "llm": 0}
+
+
+def _message_texts(messages: list[ChatMessage]) -> list[str]:
+    return [message.message_text for message in messages if message]
+
+
+def _button_texts(messages: list[ChatMessage]) -> list[str]:
+    return [
+        f"{button.text} {button.url or ''}"
+        for message in messages
+        if message
+        for button in message.buttons
+    ]
+
+
+def _portal_score(
+    name: str,
+    pinned_messages: list[ChatMessage],
+    recent_messages: list[ChatMessage],
+) -> tuple[int, list[str]]:
+    messages = pinned_messages + recent_messages
+    buttons = _button_texts(messages)
+    texts = _message_texts(messages)
+    signals = []
+    score = 0
+
+    if any(VERIFY_PATTERN.search(button) for button in buttons):
+        score += 35
+        signals.append("verify button")
+    elif any(VERIFY_PATTERN.search(text) for text in texts):
+        score += 20
+        signals.append("verify message")
+    else:
+        # never a portal without human verification
+        return 0, []
+
+    if PORTAL_NAME_PATTERN.search(name):
+        score += 40
+        signals.append("portal in name")
+    if any(VERIFY_BOT_PATTERN.search(text) for text in buttons + texts):
+        score += 15
+        signals.append("verification bot link")
+    senders = {message.sender_id for message in recent_messages if message}
+    if len(senders) <= 2:
+        score += 10
+        signals.append(f"{len(senders)} senders")
+    return score, signals
+
+
+def _crypto_project_score(
+    name: str,
+    about: str,
+    pinned_messages: list[ChatMessage],
+    recent_messages: list[ChatMessage],
+    mentioned_contracts: Optional[list[dict]],
+) -> tuple[int, list[str], dict]:
+    profile = "\n".join([about] + _message_texts(pinned_messages))
+    profile += "\n" + "\n".join(_button_texts(pinned_messages))
+    recent = "\n".join(_message_texts(recent_messages) + _button_texts(recent_messages))
+    signals = []
+    score = 0
+
+    contract, chain = first_contract(profile)
+    if contract:
+        score += 40
+        signals.append("contract in profile")
+    else:
+        if mentioned_contracts:
+            contract = mentioned_contracts[0]["value"]
+            chain = mentioned_contracts[0]["chain"]
+        else:
+            contract, chain = first_contract(recent)
+        if contract:
+            score += 20
+            signals.append("contract in messages")
+
+    ticker_match = TICKER_PATTERN.search(name)
+    if ticker_match:
+        score += 25
+        signals.append("ticker in name")
+    if PROJECT_KEYWORDS_PATTERN.search(profile):
+        score += 10
+        signals.append("project keywords")
+    links = list(dict.fromkeys(TOKEN_LINK_PATTERN.findall(f"{profile}\n{recent}")))
+    if links:
+        score += 15
+        signals.append("token links")
+
+    entity = {
+        "ticker": ticker_match.group(1).upper() if ticker_match else "",
+        "chain": chain or "",
+        "contract": contract or "",
+        "website": "",
+        "name": "",
+        "social": {"twitter": "", "other": links},
+    }
+    return score, signals, entity
+
+
+def pre_classify(
+    name: str,
+    about: Optional[str],
+    pinned_messages: list[ChatMessage],
+    recent_messages: list[ChatMessage],
+    mentioned_contracts: Optional[list[dict]] = None,
+    min_confidence: int = PRE_CLASSIFY_MIN_CONFIDENCE,
+) -> Optional[dict]:
+    """Classify chats with unambiguous signals without calling the LLM.
+
+    `mentioned_contracts` are the chat's most mentioned contracts from the
+    mentions index, used instead of scanning the recent messages.
+
+    Returns a classification in the same shape as the LLM response, or None
+    when no category reaches `min_confidence` or the signals conflict.
+    """
+    name = name or ""
+    portal_score, portal_signals = _portal_score(name, pinned_messages, recent_messages)
+    crypto_score, crypto_signals, crypto_entity = _crypto_project_score(
+        name, about or "", pinned_messages, recent_messages, mentioned_contracts
+    )
+
+    result = None
+    if portal_score >= min_confidence and crypto_score < min_confidence / 2:
+        result = {
+            "category": {
+                "data": "PORTAL_GROUP",
+                "confidence": min(portal_score, MAX_RULE_CONFIDENCE),
+                "reason": f"rules: {', '.join(portal_signals)}",
+            },
+            "description": None,
+            "entity": {"data": None, "confidence": 0, "reason": "portal group"},
+        }
+    elif crypto_score >= min_confidence and portal_score < min_confidence / 2:
+        result = {
+            "category": {
+                "data": "CRYPTO_PROJECT",
+                "confidence": min(crypto_score, MAX_RULE_CONFIDENCE),
+                "reason": f"rules: {', '.join(crypto_signals)}",
+            },
+            "description": None,
+            # only contract and links are known, leave room for the llm to improve
+            "entity": {
+                "data": crypto_entity,
+                "confidence": 60 if crypto_entity["contract"] else 30,
+                "reason": "extracted by rules",
+            },
+        }
+
+    stats["rules" if result else "llm"] += 1
+    total = stats["rules"] + stats["llm"]
+    if total % STATS_LOG_EVERY == 0:
+        logger.info(f"pre-classified {stats['rules'] / total:.2%} of {total} chats")
+    return result
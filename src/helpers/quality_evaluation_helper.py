@@ -2,14 +2,15 @@ import asyncio
 import logging
 import time
 from asyncio import Queue
-from datetime import datetime
 from typing import List
 
 import asyncpg
 
 from src.common.config import DATABASE_URL
+from src.common.types import AIQualityResult
 from src.common.utils import parse_ai_response
-from src.helpers.message_helper import db_row_to_chat_message
+from src.helpers.chat_snapshot import chat_snapshots
+from src.helpers.context_builder import build_chat_context, context_token_budget
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 
 
 MIN_MESSAGES_THRESHOLD = 10
+EVALUATION_MESSAGES_LIMIT = 500
 INACTIVE_HOURS_THRESHOLD = 24
 LOW_QUALITY_THRESHOLD = 5.0
 
@@ -145,34 +147,27 @@ async def process_chat_worker(
                 chat_type = row["type"]
 
                 # Get messages for evaluation
-                message_rows = await pg_conn.fetch(
-                    """
-                    SELECT chat_id, message_id, reply_to, topic_id,
-                        sender_id, message_text, buttons, message_timestamp
-                    FROM chat_messages
-                    WHERE chat_id = $1
-                    ORDER BY message_timestamp DESC
-                    LIMIT 500
-                    """,
-                    chat_id,
+                snapshot = await chat_snapshots.get(
+                    pg_conn, chat_id, EVALUATION_MESSAGES_LIMIT
                 )
-
-                if not message_rows or len(message_rows) < MIN_MESSAGES_THRESHOLD:
+                message_count = len(snapshot.recent(EVALUATION_MESSAGES_LIMIT))
+                if message_count < MIN_MESSAGES_THRESHOLD:
                     task_queue.task_done()
                     continue
 
-                messages = [db_row_to_chat_message(msg_row) for msg_row in message_rows]
-
                 # Prepare messages for AI evaluation
-                messages.reverse()
-                message_texts = []
-                for msg in messages:
-                    message_texts.append(
-                        f"[{datetime.fromtimestamp(msg.message_timestamp).isoformat()}] "
-                        f"User {msg.sender_id}: {msg.message_text}"
-                    )
-
-                messages_text = "\n".join(message_texts)[:16000]
+                lines, tokens, dedup_stats = snapshot.compressed(
+                    "timeline", EVALUATION_MESSAGES_LIMIT
+                )
+                header = [f"Category: {category or 'OTHERS'}", f"Type: {chat_type}"]
+                if dedup_stats.duplicates:
+                    header.append(dedup_stats.summary())
+                context = build_chat_context(
+                    header=header,
+                    recent_messages=lines,
+                    recent_message_tokens=tokens,
+                    token_budget=context_token_budget(agent_client.model),
+                )
 
                 # Use AI to evaluate quality
                 response = await agent_client.chat_completion(
@@ -180,7 +175,7 @@ async def process_chat_worker(
                         {"role": "system", "content": QUALITY_EVALUATION_PROMPT},
                         {
                             "role": "user",
-                            "content": f"Evaluate this group:\nCategory: {category or 'OTHERS'}\nType: {chat_type}\n\nMessages:\n{messages_text}",
+                            "content": f"Evaluate this group:\n{context.text}",
                         },
                     ],
                     temperature=0.1,
@@ -192,7 +187,11 @@ async def process_chat_worker(
                     task_queue.task_done()
                     continue
 
-                result = parse_ai_response(response, ["score", "category_alignment"])
+                result = parse_ai_response(
+                    response,
+                    ["score", "category_alignment"],
+                    schema=AIQualityResult,
+                )
                 if result:
                     quality_score = (
                         float(result["score"]) * QUALITY_SCORE_WEIGHT
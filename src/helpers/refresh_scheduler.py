@@ -0,0 +1,140 @@
+import logging
+
+import asyncpg
+
+from src.common.types import AccountChatStatus, AccountStatus
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SECONDS = 3600
+# leases outlive a stalled account by this much, running cycles extend theirs
+# every LEASE_EXTEND_SECONDS, see extend_chat_refreshes
+LEASE_SECONDS = 1800
+LEASE_EXTEND_SECONDS = 300
+
+# Claim due chats for an account. A chat is only claimed when no other running
+# member account has done less refresh work in the current interval, so the
+# refresh goes to the least-loaded member. Chats overdue by a full interval can
+# be claimed by any member so a stalled account never starves a chat.
+CLAIM_QUERY = """
+    WITH loads AS (
+        SELECT owner_account_id AS account_id, COUNT(*) AS load
+        FROM chat_refresh_leases
+        WHERE leased_until > NOW()
+        OR refreshed_at > NOW() - make_interval(secs => $4)
+        GROUP BY owner_account_id
+    ),
+    due AS (
+        SELECT l.chat_id
+        FROM chat_refresh_leases l
+        WHERE l.chat_id = ANY($2)
+        AND l.next_refresh_at <= NOW()
+        AND (l.leased_until IS NULL OR l.leased_until <= NOW())
+        AND (
+            l.next_refresh_at <= NOW() - make_interval(secs => $4)
+            OR NOT EXISTS (
+                SELECT 1
+                FROM account_chat ac
+                INNER JOIN accounts a ON a.tg_id = ac.account_id
+                LEFT JOIN loads ON loads.account_id = ac.account_id
+                WHERE ac.chat_id = l.chat_id
+                AND ac.account_id != $1
+                AND ac.status = $5
+                AND a.status = $6
+                AND COALESCE(loads.load, 0) < COALESCE(
+                    (SELECT load FROM loads WHERE account_id = $1), 0
+                )
+            )
+        )
+        ORDER BY l.next_refresh_at
+        FOR UPDATE OF l SKIP LOCKED
+    )
+    UPDATE chat_refresh_leases l
+    SET owner_account_id = $1,
+        leased_until = NOW() + make_interval(secs => $3),
+        updated_at = NOW()
+    FROM due
+    WHERE l.chat_id = due.chat_id
+    RETURNING l.chat_id
+"""
+
+
+async def claim_chat_refreshes(
+    pg_conn: asyncpg.Connection, account_id: str, chat_ids: list[str]
+) -> set[str]:
+    """Claim the chats this account should refresh in the current interval."""
+    if not chat_ids:
+        return set()
+
+    await pg_conn.execute(
+        """
+        INSERT INTO chat_refresh_leases (chat_id)
+        SELECT unnest($1::text[])
+        ON CONFLICT (chat_id) DO NOTHING
+        """,
+        chat_ids,
+    )
+    rows = await pg_conn.fetch(
+        CLAIM_QUERY,
+        account_id,
+        chat_ids,
+        LEASE_SECONDS,
+        REFRESH_INTERVAL_SECONDS,
+        AccountChatStatus.WATCHING.value,
+        AccountStatus.RUNNING.value,
+    )
+    claimed = {row["chat_id"] for row in rows}
+    logger.info(f"account {account_id} claimed {len(claimed)}/{len(chat_ids)} chats")
+    return claimed
+
+
+async def extend_chat_refreshes(pg_conn: asyncpg.Connection, account_id: str) -> int:
+    """Keep the live leases of an account from expiring during a long cycle."""
+    result = await pg_conn.execute(
+        """
+        UPDATE chat_refresh_leases
+        SET leased_until = NOW() + make_interval(secs => $2), updated_at = NOW()
+        WHERE owner_account_id = $1 AND leased_until > NOW()
+        """,
+        account_id,
+        LEASE_SECONDS,
+    )
+    return int(result.split()[-1])
+
+
+async def complete_chat_refreshes(
+    pg_conn: asyncpg.Connection, account_id: str, chat_ids: list[str]
+):
+    """Release the leases and schedule the next refresh."""
+    if not chat_ids:
+        return
+    await pg_conn.execute(
+        """
+        UPDATE chat_refresh_leases
+        SET leased_until = NULL,
+            refreshed_at = NOW(),
+            next_refresh_at = NOW() + make_interval(secs => $3),
+            updated_at = NOW()
+        WHERE owner_account_id = $1 AND chat_id = ANY($2)
+        """,
+        account_id,
+        chat_ids,
+        REFRESH_INTERVAL_SECONDS,
+    )
+
+
+async def release_chat_refreshes(
+    pg_conn: asyncpg.Connection, account_id: str, chat_ids: list[str]
+):
+    """Release the leases without refreshing so another member can claim."""
+    if not chat_ids:
+        return
+    await pg_conn.execute(
+        """
+        UPDATE chat_refresh_leases
+        SET leased_until = NULL, updated_at = NOW()
+        WHERE owner_account_id = $1 AND chat_id = ANY($2)
+        """,
+        account_id,
+        chat_ids,
+    )
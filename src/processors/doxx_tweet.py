@@ -25,7 +25,7 @@ logger = logging.getLogger(__name__)
 MIN_TWEET_INTERVAL = 3600 * 4
 
 redis = Redis.from_url(REDIS_URL)
-agent = AgentClient()
+agent = AgentClient(caller="doxx_tweet")
 
 
 class DoxxTweetProcessor(ProcessorBase):
@@ -6,12 +6,17 @@ from typing import Optional
 
 import asyncpg
 
-from src.common.agent_client import AgentClient
+from src.common.agent_client import AgentClient, CascadePolicy
 from src.common.config import DATABASE_URL
-from src.common.types import ChatMessage, ChatMetadata
+from src.common.llm_cache import LLMResponseCache
+from src.common.types import AIClassification, ChatMessage, ChatMetadata
 from src.common.utils import parse_ai_response
+from src.helpers.chat_snapshot import ChatSnapshot, chat_snapshots
+from src.helpers.context_builder import build_chat_context, context_token_budget
+from src.helpers.mention_extractor import get_top_mentions
 from src.helpers.message_helper import db_row_to_chat_message, gen_message_content
-from src.processors.processor import ProcessorBase
+from src.helpers.pre_classifier import pre_classify
+from src.processors.processor import ProcessorBase, WorkLeases
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +26,18 @@ logger = logging.getLogger(__name__)
 
 
 EVALUATION_WINDOW_SECONDS = 3600 * 24  # 3 days
+RECENT_MESSAGES_LIMIT = 50
+LEASE_BATCH_SIZE = 100
+FAILED_RETRY_SECONDS = 600
+CONTRACT_MENTION_KINDS = ["evm_address", "solana_address"]
+
+
+def classification_confidence(response: str | None) -> Optional[float]:
+    """Confidence of the category in a classification, None when invalid."""
+    parsed = parse_ai_response(response, schema=AIClassification)
+    if not parsed or not parsed["category"]["data"]:
+        return None
+    return parsed["category"]["confidence"]
 
 
 class EntityExtractor(ProcessorBase):
@@ -28,8 +45,13 @@ class EntityExtractor(ProcessorBase):
         super().__init__(interval=60)
         self.batch_size = 20
         self.pg_pool = None
-        self.agent_client = AgentClient()
-        self.processing_ids = set()
+        self.agent_client = AgentClient(
+            caller="entity_extractor", cache=LLMResponseCache()
+        )
+        self.classify_cascade = CascadePolicy(
+            "classification", confidence=classification_confidence
+        )
+        self.leases = WorkLeases("entity_extractor")
         self.queue = asyncio.Queue()
         self.workers = []
 
@@ -41,36 +63,63 @@ class EntityExtractor(ProcessorBase):
             asyncio.create_task(self.evaluate_chat_item())
             for _ in range(self.batch_size)
         ]
+        self.workers.append(
+            asyncio.create_task(
+                self.keep_leases_alive(self.pg_pool, self.leases.heartbeat)
+            )
+        )
         logger.info(f"{self.__class__.__name__} processor initiated")
 
     async def process(self):
+        """Lease a batch of due groups and queue them"""
+        # lease only what the workers can start on, other instances take the rest
+        await self.queue.join()
+        evaluated_before = int(time.time() - EVALUATION_WINDOW_SECONDS)
         async with self.pg_pool.acquire() as conn:
-            query = """
-                SELECT id, chat_id, name, username, about, participants_count,
-                pinned_messages, initial_messages, admins, category, category_metadata,
-                entity, entity_metadata, ai_about, last_message_timestamp,
-                evaluated_at
-                FROM chat_metadata
-                WHERE evaluated_at < $1
+            candidates = await conn.fetch(
                 """
-            params = [int(time.time() - EVALUATION_WINDOW_SECONDS)]
-
-            if self.processing_ids:
-                query += " AND chat_id != ALL($2)"
-                params.append(list(self.processing_ids))
-
-            query += " ORDER BY evaluated_at ASC"
-
-            rows = await conn.fetch(query, *params)
-            if not rows:
+                SELECT cm.chat_id
+                FROM chat_metadata cm
+                WHERE cm.evaluated_at < $1
+                AND NOT EXISTS (
+                    SELECT 1 FROM work_leases l
+                    WHERE l.kind = $2 AND l.item_id = cm.chat_id
+                    AND l.leased_until > NOW()
+                )
+                ORDER BY cm.evaluated_at ASC
+                LIMIT $3
+                """,
+                evaluated_before,
+                self.leases.kind,
+                LEASE_BATCH_SIZE,
+            )
+            if not candidates:
                 logger.info("no groups to process")
                 return
 
+            chat_ids = await self.leases.claim(
+                conn, [row["chat_id"] for row in candidates]
+            )
+            # another instance may have evaluated a group since it was selected
+            rows = await conn.fetch(
+                """
+                SELECT id, chat_id, name, username, about, participants_count,
+                pinned_messages, initial_messages, admins, category,
+                category_metadata, entity, entity_metadata, ai_about,
+                last_message_timestamp, evaluated_at
+                FROM chat_metadata
+                WHERE chat_id = ANY($1) AND evaluated_at < $2
+                ORDER BY evaluated_at ASC
+                """,
+                chat_ids,
+                evaluated_before,
+            )
+            await self.leases.release(
+                conn, list(set(chat_ids) - {row["chat_id"] for row in rows})
+            )
+
             logger.info(f"enqueueing {len(rows)} groups")
             for row in rows:
-                if row["chat_id"] in self.processing_ids:
-                    continue
-                self.processing_ids.add(row["chat_id"])
                 chat_metadata = await self._to_chat_metadata(row, conn)
                 await self.queue.put(chat_metadata)
             logger.info(f"enqueued {len(rows)} groups")
@@ -78,14 +127,16 @@ class EntityExtractor(ProcessorBase):
     async def evaluate_chat_item(self):
         while self.running:
             chat_metadata: ChatMetadata = await self.queue.get()
+            retry_seconds = 0
             logger.info(
                 f"processing group: {chat_metadata.name}, left {self.queue.qsize()} groups"
             )
             try:
                 async with self.pg_pool.acquire() as conn:
-                    recent_messages = await self._get_latest_messages(
-                        chat_metadata, conn
+                    snapshot = await chat_snapshots.get(
+                        conn, chat_metadata.chat_id, RECENT_MESSAGES_LIMIT
                     )
+                    recent_messages = snapshot.recent(RECENT_MESSAGES_LIMIT)
                     last_message_timestamp = await self._get_last_message_timestamp(
                         chat_metadata, recent_messages
                     )
@@ -95,18 +146,35 @@ class EntityExtractor(ProcessorBase):
                         await self._record_skipping_evaluation(chat_metadata, conn)
                         raise Exception("skipping group")
 
-                    context = await self._gather_context(
-                        chat_metadata, recent_messages, conn
+                    mentioned_contracts = await get_top_mentions(
+                        conn, chat_metadata.chat_id, CONTRACT_MENTION_KINDS
+                    )
+                    parsed_classification = pre_classify(
+                        chat_metadata.name,
+                        chat_metadata.about,
+                        chat_metadata.pinned_messages,
+                        recent_messages,
+                        mentioned_contracts,
                     )
-                    classification = await self._classify_chat(context, conn)
-                    logger.info(f"classification result: {classification}")
-                    parsed_classification = parse_ai_response(classification)
+                    if not parsed_classification:
+                        context = await self._gather_context(
+                            chat_metadata, snapshot, conn, mentioned_contracts
+                        )
+                        classification = await self._classify_chat(context, conn)
+                        logger.info(f"classification result: {classification}")
+                        parsed_classification = parse_ai_response(
+                            classification, schema=AIClassification
+                        )
                     if not parsed_classification:
                         await self._record_skipping_evaluation(chat_metadata, conn)
                         raise Exception("no classification result")
 
                     logger.info(f"classification: {parsed_classification}")
-                    description = parsed_classification.get("description")
+                    # rule based classifications keep the previous description
+                    description = (
+                        parsed_classification.get("description")
+                        or chat_metadata.ai_about
+                    )
                     category_data = parsed_classification.get("category", {})
                     entity_data = parsed_classification.get("entity", {})
 
@@ -144,10 +212,20 @@ class EntityExtractor(ProcessorBase):
                     )
             except Exception as e:
                 logger.error(f"error processing group: {chat_metadata.chat_id} - {e}")
+                # retry failed groups after a while, not on the next pass
+                retry_seconds = FAILED_RETRY_SECONDS
             finally:
-                self.processing_ids.remove(chat_metadata.chat_id)
+                await self._release_lease(chat_metadata.chat_id, retry_seconds)
                 self.queue.task_done()
 
+    async def _release_lease(self, chat_id: str, retry_seconds: int = 0):
+        try:
+            async with self.pg_pool.acquire() as conn:
+                await self.leases.release(conn, [chat_id], retry_seconds)
+        except Exception as e:
+            # the lease expires once no longer heartbeated
+            logger.error(f"error releasing lease of group: {chat_id} - {e}")
+
     async def should_evaluate(
         self, chat_metadata: ChatMetadata, last_message_timestamp: int
     ) -> bool:
@@ -277,62 +355,59 @@ class EntityExtractor(ProcessorBase):
             last_message_timestamp=row["last_message_timestamp"],
         )
 
-    async def _get_latest_messages(
-        self, chat_metadata: ChatMetadata, conn, limit: int = 50
-    ) -> list[ChatMessage]:
-        rows = await conn.fetch(
-            """
-            SELECT chat_id, message_id, reply_to, topic_id,
-            sender_id, message_text, buttons, message_timestamp
-            FROM chat_messages
-            WHERE chat_id = $1
-            ORDER BY message_timestamp DESC
-            LIMIT $2
-            """,
-            chat_metadata.chat_id,
-            limit,
-        )
-        if not rows:
-            return []
-
-        messages = [db_row_to_chat_message(row) for row in rows]
-        messages.reverse()
-        return messages
-
     async def _gather_context(
-        self, chat_metadata: ChatMetadata, recent_messages: list[ChatMessage], conn
+        self,
+        chat_metadata: ChatMetadata,
+        snapshot: ChatSnapshot,
+        conn,
+        mentioned_contracts: Optional[list[dict]] = None,
     ) -> Optional[str]:
         """Gather context from various sources in the chat."""
-        context_parts = []
-        context_parts.append(f"\nChat Title: {chat_metadata.name}\n")
-        if chat_metadata.about:
-            context_parts.append(f"\nDescription: {chat_metadata.about[:500]}\n")
-
-        context_parts.extend(
-            [
-                f"\nPinned Message: {gen_message_content(message)}"
-                for message in chat_metadata.pinned_messages
-            ]
-        )
-
-        context_parts.extend([f"\nTotal Members: {chat_metadata.participants_count}"])
-
-        context_parts.append("\n\nRecent Messages:\n")
+        recent_messages = snapshot.recent(RECENT_MESSAGES_LIMIT)
         if len(recent_messages) < len(chat_metadata.initial_messages):
-            context_parts.extend(
-                [
-                    gen_message_content(msg)
-                    for msg in chat_metadata.initial_messages
-                    if msg
-                ]
-            )
+            lines = [
+                gen_message_content(msg)
+                for msg in chat_metadata.initial_messages
+                if msg
+            ]
+            tokens = None
+            dedup_stats = None
         else:
-            context_parts.extend(
-                [gen_message_content(msg) for msg in recent_messages if msg]
+            lines, tokens, dedup_stats = snapshot.compressed(
+                "content", RECENT_MESSAGES_LIMIT
             )
 
-        context = "\n".join(filter(None, context_parts))
-        return context[:24000]  # Limit total context length to be safe
+        header = [
+            f"Chat Title: {chat_metadata.name}",
+            f"Total Members: {chat_metadata.participants_count}",
+        ]
+        if mentioned_contracts:
+            header.append(
+                "Mentioned Contracts: "
+                + ", ".join(
+                    f"{mention['value']} ({mention['chain']}, "
+                    f"{mention['mentions']} mentions)"
+                    for mention in mentioned_contracts
+                )
+            )
+        if dedup_stats and dedup_stats.duplicates:
+            header.append(dedup_stats.summary())
+        context = build_chat_context(
+            header=header,
+            description=chat_metadata.about,
+            pinned_messages=[
+                gen_message_content(message)
+                for message in chat_metadata.pinned_messages
+            ],
+            recent_messages=lines,
+            recent_message_tokens=tokens,
+            token_budget=context_token_budget(self.agent_client.model),
+        )
+        logger.info(
+            f"context for {chat_metadata.chat_id}: "
+            f"{context.tokens_used}/{context.token_budget} tokens"
+        )
+        return context.text
 
     async def _get_last_message_timestamp(
         self, chat_metadata: ChatMetadata, recent_messages: list[ChatMessage]
@@ -359,7 +434,8 @@ class EntityExtractor(ProcessorBase):
         return max(timestamps) if timestamps else chat_metadata.last_message_timestamp
 
     async def _classify_chat(self, context: str, conn) -> str | None:
-        response = await self.agent_client.chat_completion(
+        response = await self.agent_client.cascade_completion(
+            self.classify_cascade,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {
@@ -379,6 +455,8 @@ class EntityExtractor(ProcessorBase):
             ],
             temperature=0.1,  # Lower temperature for more consistent results
             response_format={"type": "json_object"},  # Ensure JSON response
+            stream=True,
+            schema=AIClassification,
         )
         return response
 
@@ -1,10 +1,7 @@
 import asyncio
-import imghdr
 import json
 import logging
-import os
 import time
-from datetime import datetime, timedelta
 from typing import Optional
 
 import asyncpg
@@ -18,10 +15,17 @@ from telethon.tl.types import (
 )
 
 from src.common.config import DATABASE_URL
-from src.common.r2_client import upload_file
 from src.common.types import AccountChatStatus, ChatPhoto, ChatStatus, ChatType
 from src.common.utils import normalize_chat_id
 from src.helpers.message_helper import should_process, store_messages, to_chat_message
+from src.helpers.photo_helper import store_photo
+from src.helpers.refresh_scheduler import (
+    LEASE_EXTEND_SECONDS,
+    claim_chat_refreshes,
+    complete_chat_refreshes,
+    extend_chat_refreshes,
+    release_chat_refreshes,
+)
 from src.processors.processor import ProcessorBase
 
 logging.basicConfig(
@@ -33,7 +37,23 @@ logger = logging.getLogger(__name__)
 # Constants
 NO_INITIAL_MESSAGES_ID = "no_initial_messages"
 PERMISSION_DENIED_ADMIN_ID = "permission_denied"
-GROUP_UPDATE_INTERVAL = 3600
+# queued chat metadata is written every this many refreshed chats
+METADATA_FLUSH_SIZE = 20
+
+METADATA_COLUMNS = (
+    "chat_id",
+    "type",
+    "name",
+    "username",
+    "about",
+    "photo",
+    "participants_count",
+    "pinned_messages",
+    "initial_messages",
+    "admins",
+    "max_pinned_message_id",
+    "last_fetched_message_id",
+)
 
 
 class GroupProcessor(ProcessorBase):
@@ -42,6 +62,8 @@ class GroupProcessor(ProcessorBase):
         self.account_id = account_id
         self.client = client
         self.pg_conn = None
+        self.pending_metadata: dict[str, dict] = {}
+        self.pending_uploads: dict[str, asyncio.Task] = {}
 
     async def process(self):
         if not self.pg_conn:
@@ -52,116 +74,220 @@ class GroupProcessor(ProcessorBase):
         chat_info_map = await self.get_all_chat_metadata(chat_ids)
         logger.info(f"loaded {len(chat_info_map)} group metadata")
 
-        # update account chat map
         me = await self.client.get_me()
-        logger.info(f"updating account chat map for {me.id}")
-        await self.update_account_chat_map(str(me.id), chat_ids)
-        logger.info(f"updated account chat map for {me.id}")
+        account_id = str(me.id)
+        claimed_chat_ids = await claim_chat_refreshes(
+            self.pg_conn, account_id, chat_ids
+        )
+        refreshed_chat_ids = set()
+        left_chat_ids = set()
+        try:
+            await self.update_groups(
+                me,
+                chat_ids,
+                dialogs,
+                chat_info_map,
+                claimed_chat_ids,
+                refreshed_chat_ids,
+                left_chat_ids,
+            )
+        finally:
+            # metadata was flushed in chunks, sync the account chat map once
+            watching_chat_ids = [c for c in chat_ids if c not in left_chat_ids]
+            async with self.pg_conn.transaction():
+                logger.info(f"updating account chat map for {me.id}")
+                await self.update_account_chat_map(account_id, watching_chat_ids)
+                await release_chat_refreshes(
+                    self.pg_conn,
+                    account_id,
+                    list(claimed_chat_ids - refreshed_chat_ids),
+                )
+            logger.info(f"updated account chat map for {me.id}")
 
+    async def update_groups(
+        self,
+        me: any,
+        chat_ids: list[str],
+        dialogs: list,
+        chat_info_map: dict,
+        claimed_chat_ids: set[str],
+        refreshed_chat_ids: set[str],
+        left_chat_ids: set[str],
+    ):
         logger.info(f"updating {len(chat_ids)} groups for {me.username}")
-        for chat_id, dialog in zip(chat_ids, dialogs):
-            if not dialog.is_group and not dialog.is_channel:
-                continue
-
-            chat_info = chat_info_map.get(
-                chat_id,
-                {
-                    "status": ChatStatus.EVALUATING.value,
-                    "type": ChatType.GROUP.value,
-                    "admins": [],
-                    "pinned_messages": [],
-                    "photo": None,
-                    "category": None,
-                    "category_metadata": None,
-                    "entity": None,
-                    "entity_metadata": None,
-                    "updated_at": datetime.now() - timedelta(hours=2),
-                },
-            )
+        account_id = str(me.id)
+        unflushed_chat_ids = []
+        extended_at = time.monotonic()
+        try:
+            for chat_id, dialog in zip(chat_ids, dialogs):
+                if not dialog.is_group and not dialog.is_channel:
+                    continue
+
+                if chat_id not in claimed_chat_ids:
+                    logger.info(
+                        f"skipping group {dialog.name}, not due or claimed by "
+                        "another account"
+                    )
+                    continue
+
+                # a cycle can outlast the leases claimed at its start
+                if time.monotonic() >= extended_at + LEASE_EXTEND_SECONDS:
+                    await self._extend_leases(account_id)
+                    extended_at = time.monotonic()
 
-            updated_at_epoch = int(
-                chat_info.get("updated_at", datetime.now()).timestamp()
+                try:
+                    await self.update_group(
+                        me,
+                        chat_id,
+                        dialog,
+                        chat_info_map,
+                        refreshed_chat_ids,
+                        left_chat_ids,
+                    )
+                except Exception as e:
+                    # the lease is released at the end of the cycle
+                    logger.error(f"Failed to update group {dialog.name}: {e}")
+                    continue
+
+                if chat_id in refreshed_chat_ids:
+                    unflushed_chat_ids.append(chat_id)
+                if len(unflushed_chat_ids) >= METADATA_FLUSH_SIZE:
+                    await self._flush_refreshed(
+                        account_id, unflushed_chat_ids, refreshed_chat_ids
+                    )
+                    unflushed_chat_ids = []
+        finally:
+            await self._flush_refreshed(
+                account_id, unflushed_chat_ids, refreshed_chat_ids
             )
-            if updated_at_epoch > int(time.time()) - GROUP_UPDATE_INTERVAL:
-                logger.info(
-                    f"skipping group {dialog.name} because it was updated recently"
-                )
-                continue
-
-            logger.info(f"processing group {dialog.name}")
-            status = chat_info.get("status", ChatStatus.EVALUATING.value)
-            if status == ChatStatus.BLOCKED.value:
-                logger.info(f"skipping blocked group {dialog.name}")
-                continue
 
-            if chat_info.get("category") == "PORTAL_GROUP":
-                await self.leave_group(chat_id, dialog, me)
-                continue
+    async def update_group(
+        self,
+        me: any,
+        chat_id: str,
+        dialog: any,
+        chat_info_map: dict,
+        refreshed_chat_ids: set[str],
+        left_chat_ids: set[str],
+    ):
+        chat_info = chat_info_map.get(
+            chat_id,
+            {
+                "status": ChatStatus.EVALUATING.value,
+                "type": ChatType.GROUP.value,
+                "admins": [],
+                "pinned_messages": [],
+                "photo": None,
+                "category": None,
+                "category_metadata": None,
+                "entity": None,
+                "entity_metadata": None,
+            },
+        )
 
-            # 1. Get group description
-            logger.info("Getting group description...")
-            description = await self.get_group_description(dialog)
-            logger.info(f"group description: {description}")
-
-            # 2. update photo
-            logger.info("Updating photo...")
-            photo = chat_info.get("photo", None)
-            photo = ChatPhoto.model_validate_json(photo) if photo else None
-            photo = await self.get_group_photo(dialog, photo)
-
-            # 3. update group type
-            logger.info("Updating group type...")
-            type = chat_info.get("type", ChatType.GROUP.value)
-            new_type = self._get_group_type(dialog)
-            if type != new_type:
-                logger.info(f"group type changed from {type} to {new_type}")
-                type = new_type
-
-            # 4. get pinned messages
-            logger.info("Getting pinned messages...")
+        logger.info(f"processing group {dialog.name}")
+        status = chat_info.get("status", ChatStatus.EVALUATING.value)
+        if status == ChatStatus.BLOCKED.value:
+            logger.info(f"skipping blocked group {dialog.name}")
+            refreshed_chat_ids.add(chat_id)
+            return
+
+        if chat_info.get("category") == "PORTAL_GROUP":
+            await self.leave_group(chat_id, dialog, me)
+            left_chat_ids.add(chat_id)
+            refreshed_chat_ids.add(chat_id)
+            return
+
+        # 1. Get group description and latest pin
+        logger.info("Getting group description...")
+        description, pinned_msg_id = await self.get_group_description(dialog)
+        logger.info(f"group description: {description}")
+
+        # 2. update photo
+        logger.info("Updating photo...")
+        photo = chat_info.get("photo", None)
+        photo = ChatPhoto.model_validate_json(photo) if photo else None
+        photo = await self.get_group_photo(chat_id, dialog, photo)
+
+        # 3. update group type
+        logger.info("Updating group type...")
+        type = chat_info.get("type", ChatType.GROUP.value)
+        new_type = self._get_group_type(dialog)
+        if type != new_type:
+            logger.info(f"group type changed from {type} to {new_type}")
+            type = new_type
+
+        # 4. get pinned messages, refetched in full when the latest pin moved
+        # as messages pinned late can be older than it and unpinned ones must go
+        logger.info("Getting pinned messages...")
+        pinned_message_ids = chat_info.get("pinned_messages", [])
+        max_pinned_message_id = chat_info.get("max_pinned_message_id", 0)
+        if pinned_msg_id != max_pinned_message_id:
             pinned_message_ids = await self.get_pinned_messages(dialog)
+            max_pinned_message_id = pinned_msg_id
             logger.info(f"pinned messages: {pinned_message_ids}")
-
-            # 5. get initial messages
-            logger.info("Getting initial messages...")
-            initial_message_ids = chat_info.get("initial_messages", [])
-            if not initial_message_ids:
-                initial_message_ids = await self.get_initial_messages(dialog)
-                logger.info(f"initial messages: {initial_message_ids}")
-            else:
-                logger.info(f"initial messages already fetched: {initial_message_ids}")
-
-            # 6. get admins
-            logger.info("Getting admins...")
-            admins = chat_info.get("admins", [])
-            if admins and admins[0] == PERMISSION_DENIED_ADMIN_ID:
-                logger.info(f"admin permission denied for {dialog.name}, skipping...")
-            else:
-                admins = await self.get_admins(dialog)
-                logger.info(f"admins: {admins}")
-
-            logger.info(f"updating metadata for {chat_id}: {dialog.name}")
-
-            await self._update_metadata(
-                chat_id,
-                type,
-                dialog.name or None,
-                getattr(dialog.entity, "username", None),
-                description or None,
-                photo.model_dump_json() if photo else None,
-                getattr(dialog.entity, "participants_count", 0),
-                json.dumps(pinned_message_ids),
-                json.dumps(initial_message_ids),
-                json.dumps(admins),
+        else:
+            logger.info(f"pinned messages unchanged: {pinned_message_ids}")
+
+        # 5. get initial messages, once per chat, chats without any are only
+        # fetched again from their mark once a newer message arrived
+        logger.info("Getting initial messages...")
+        initial_message_ids = chat_info.get("initial_messages", [])
+        last_fetched_message_id = chat_info.get("last_fetched_message_id", 0)
+        top_message = getattr(dialog, "message", None)
+        if not initial_message_ids or (
+            initial_message_ids == [NO_INITIAL_MESSAGES_ID]
+            and top_message
+            and top_message.id > last_fetched_message_id
+        ):
+            initial_message_ids, last_fetched_message_id = (
+                await self.get_initial_messages(dialog, last_fetched_message_id)
             )
-            await asyncio.sleep(1)
+            logger.info(f"initial messages: {initial_message_ids}")
+        else:
+            logger.info(f"initial messages already fetched: {initial_message_ids}")
+
+        # 6. get admins
+        logger.info("Getting admins...")
+        admins = chat_info.get("admins", [])
+        if admins and admins[0] == PERMISSION_DENIED_ADMIN_ID:
+            logger.info(f"admin permission denied for {dialog.name}, skipping...")
+        else:
+            admins = await self.get_admins(dialog)
+            logger.info(f"admins: {admins}")
+
+        logger.info(f"queueing metadata for {chat_id}: {dialog.name}")
+
+        self._queue_metadata(
+            chat_id,
+            type,
+            dialog.name or None,
+            getattr(dialog.entity, "username", None),
+            description or None,
+            photo.model_dump_json() if photo else None,
+            getattr(dialog.entity, "participants_count", 0),
+            json.dumps(pinned_message_ids),
+            json.dumps(initial_message_ids),
+            json.dumps(admins),
+            max_pinned_message_id,
+            last_fetched_message_id,
+        )
+        refreshed_chat_ids.add(chat_id)
+        await asyncio.sleep(1)
 
     async def store_unprocessed_messages(
         self, chat_id: str, messages: list[Optional[Message]]
-    ):
-        message_ids = [str(msg.id) for msg in messages if should_process(msg)]
-        existing_messages = await self.pg_conn.fetch(
+    ) -> list[str]:
+        messages = [msg for msg in messages if should_process(msg)]
+        message_ids = [str(msg.id) for msg in messages]
+        if not message_ids:
+            return []
+
+        # set difference in SQL, only ids missing from chat_messages come back
+        new_rows = await self.pg_conn.fetch(
             """
+            SELECT message_id FROM unnest($2::text[]) AS message_id
+            EXCEPT
             SELECT message_id
             FROM chat_messages
             WHERE chat_id = $1 AND message_id = ANY($2)
@@ -169,34 +295,46 @@ class GroupProcessor(ProcessorBase):
             chat_id,
             message_ids,
         )
-        existing_message_ids = {row["message_id"] for row in existing_messages}
+        new_message_ids = {row["message_id"] for row in new_rows}
         messages_to_insert = [
-            to_chat_message(msg)
-            for msg in messages
-            if msg.id not in existing_message_ids
+            to_chat_message(msg) for msg in messages if str(msg.id) in new_message_ids
         ]
         if messages_to_insert:
             await store_messages(self.pg_conn, messages_to_insert)
         return message_ids
 
-    async def get_initial_messages(self, dialog: any) -> list[str]:
+    async def get_initial_messages(
+        self, dialog: any, min_id: int = 0
+    ) -> tuple[list[str], int]:
+        """Fetch messages newer than min_id, returning ids and the new mark.
+
+        The mark covers skipped messages too, so they are not fetched again.
+        """
         messages = await self.client.get_messages(
             dialog.entity,
             limit=10,
+            min_id=min_id,
         )
-        messages = [m for m in messages if m and should_process(m)]
+        messages = [m for m in messages if m]
+        last_fetched_message_id = max([min_id, *(m.id for m in messages)])
+        messages = [m for m in messages if should_process(m)]
         if not messages:
-            return [NO_INITIAL_MESSAGES_ID]
-        return await self.store_unprocessed_messages(
+            return [NO_INITIAL_MESSAGES_ID], last_fetched_message_id
+        message_ids = await self.store_unprocessed_messages(
             normalize_chat_id(dialog.entity.id), messages
         )
+        return message_ids, last_fetched_message_id
 
     async def get_pinned_messages(self, dialog: any) -> list[str]:
+        """Fetch all pinned messages, returning their ids."""
         pinned_messages = await self.client.get_messages(
             dialog.entity,
             filter=InputMessagesFilterPinned,
             limit=50,
         )
+        pinned_messages = [m for m in pinned_messages if m]
+        if not pinned_messages:
+            return []
         return await self.store_unprocessed_messages(
             normalize_chat_id(dialog.entity.id), pinned_messages
         )
@@ -211,17 +349,22 @@ class GroupProcessor(ProcessorBase):
             logger.error(f"Failed to get admins: {e}")
             return [PERMISSION_DENIED_ADMIN_ID]
 
-    async def get_group_description(self, dialog: any) -> str:
+    async def get_group_description(self, dialog: any) -> tuple[str, int]:
+        """Return the description and the id of the latest pin, 0 without one."""
         if dialog.is_channel:
             result = await self.client(GetFullChannelRequest(channel=dialog.entity))
-            return result.full_chat.about or ""
         else:
             result = await self.client(GetFullChatRequest(chat_id=dialog.entity.id))
-            return result.full_chat.about or ""
+        return result.full_chat.about or "", result.full_chat.pinned_msg_id or 0
 
     async def get_group_photo(
-        self, dialog: any, photo: ChatPhoto | None
+        self, chat_id: str, dialog: any, photo: ChatPhoto | None
     ) -> Optional[ChatPhoto]:
+        """Return the stored photo, scheduling an upload when it changed.
+
+        The new photo is downloaded into memory and stored in the background,
+        the queued metadata row is updated once the upload finishes.
+        """
         new_photo = getattr(dialog.entity, "photo", {})
         logger.info(f"current photo: {new_photo}")
         if not new_photo:
@@ -234,19 +377,11 @@ class GroupProcessor(ProcessorBase):
 
         # got new photo
         if not photo or str(photo_id) != str(photo.id):
-            local_photo_path = await self.client.download_profile_photo(
-                dialog.entity, file=f"temp_photo_{new_photo.photo_id}"
-            )
-            if local_photo_path:
-                logger.info(f"local photo path: {local_photo_path}")
-                extension = await self._get_photo_extension(local_photo_path)
-                photo_path = f"photos/{new_photo.photo_id}{extension}"
-                upload_file(local_photo_path, photo_path)
-                try:
-                    os.remove(local_photo_path)
-                except Exception as e:
-                    logger.error(f"Failed to remove local photo: {e}")
-                photo = ChatPhoto(id=str(new_photo.photo_id), path=photo_path)
+            data = await self.client.download_profile_photo(dialog.entity, file=bytes)
+            if data:
+                self.pending_uploads[chat_id] = asyncio.create_task(
+                    store_photo(photo_id, data)
+                )
         return photo
 
     async def get_all_dialogs(self):
@@ -260,7 +395,9 @@ class GroupProcessor(ProcessorBase):
     async def get_all_chat_metadata(self, chat_ids: list[str]) -> dict:
         rows = await self.pg_conn.fetch(
             """
-            SELECT chat_id, status, type, admins, photo, initial_messages, updated_at
+            SELECT chat_id, status, type, admins, photo, pinned_messages,
+            initial_messages, max_pinned_message_id, last_fetched_message_id,
+            updated_at
             FROM chat_metadata WHERE chat_id = ANY($1)
             """,
             chat_ids,
@@ -271,13 +408,16 @@ class GroupProcessor(ProcessorBase):
                 "type": row["type"],
                 "admins": json.loads(row["admins"]),
                 "photo": row["photo"],
+                "pinned_messages": json.loads(row["pinned_messages"] or "[]"),
                 "initial_messages": json.loads(row["initial_messages"]),
+                "max_pinned_message_id": row["max_pinned_message_id"] or 0,
+                "last_fetched_message_id": row["last_fetched_message_id"] or 0,
                 "updated_at": row["updated_at"],
             }
             for row in rows
         }
 
-    async def _update_metadata(
+    def _queue_metadata(
         self,
         chat_id: str,
         type: str,
@@ -286,81 +426,167 @@ class GroupProcessor(ProcessorBase):
         about: str,
         photo: str,
         participants_count: int,
-        pinned_messages: list[str],
-        initial_messages: list[str],
-        admins: list[str],
+        pinned_messages: str,
+        initial_messages: str,
+        admins: str,
+        max_pinned_message_id: int,
+        last_fetched_message_id: int,
     ):
-        """Update chat metadata."""
+        """Queue chat metadata to be flushed with the next chunk."""
+        self.pending_metadata[chat_id] = {
+            "chat_id": chat_id,
+            "type": type,
+            "name": name,
+            "username": username,
+            "about": about,
+            "photo": photo,
+            "participants_count": participants_count,
+            "pinned_messages": pinned_messages,
+            "initial_messages": initial_messages,
+            "admins": admins,
+            "max_pinned_message_id": max_pinned_message_id,
+            "last_fetched_message_id": last_fetched_message_id,
+        }
+
+    async def _resolve_photo_uploads(self):
+        """Wait for background photo uploads and apply them to queued rows."""
+        if not self.pending_uploads:
+            return
+
+        chat_ids = list(self.pending_uploads.keys())
+        results = await asyncio.gather(
+            *self.pending_uploads.values(), return_exceptions=True
+        )
+        self.pending_uploads.clear()
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to store photo for {chat_id}: {result}")
+                continue
+            if chat_id in self.pending_metadata:
+                self.pending_metadata[chat_id]["photo"] = result.model_dump_json()
+
+    async def _extend_leases(self, account_id: str):
         try:
-            await self.pg_conn.execute(
-                """
-                INSERT INTO chat_metadata (
-                    chat_id, type, name, username, about, photo, participants_count,
-                    pinned_messages, initial_messages, admins, updated_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, CURRENT_TIMESTAMP)
-                ON CONFLICT (chat_id) DO UPDATE SET
-                    type = EXCLUDED.type,
-                    name = EXCLUDED.name,
-                    username = EXCLUDED.username,
-                    about = EXCLUDED.about,
-                    photo = EXCLUDED.photo,
-                    participants_count = EXCLUDED.participants_count,
-                    pinned_messages = EXCLUDED.pinned_messages,
-                    initial_messages = EXCLUDED.initial_messages,
-                    admins = EXCLUDED.admins,
-                    updated_at = CURRENT_TIMESTAMP
-                """,
-                chat_id,
-                type,
-                name,
-                username,
-                about,
-                photo,
-                participants_count,
-                pinned_messages,
-                initial_messages,
-                admins,
-            )
+            extended = await extend_chat_refreshes(self.pg_conn, account_id)
+            logger.info(f"extended {extended} chat refresh leases of {account_id}")
         except Exception as e:
-            logger.error(f"Failed to update metadata: {e}")
+            logger.error(f"Failed to extend chat refresh leases: {e}")
+
+    async def _flush_refreshed(
+        self, account_id: str, chat_ids: list[str], refreshed_chat_ids: set[str]
+    ):
+        """Write the queued metadata and complete the refreshes of the chats.
+
+        A failed chunk is dropped and its chats are taken out of
+        `refreshed_chat_ids`, so their leases are released for a retry.
+        """
+        if not chat_ids and not self.pending_metadata:
+            return
+        await self._resolve_photo_uploads()
+        try:
+            async with self.pg_conn.transaction():
+                await self._flush_metadata()
+                await complete_chat_refreshes(self.pg_conn, account_id, chat_ids)
+        except Exception as e:
+            logger.error(f"Failed to flush metadata of {len(chat_ids)} groups: {e}")
+            self.pending_metadata.clear()
+            refreshed_chat_ids.difference_update(chat_ids)
+
+    async def _flush_metadata(self):
+        """Upsert all queued chat metadata with a single multi-row statement."""
+        if not self.pending_metadata:
+            return
+
+        rows = list(self.pending_metadata.values())
+        columns = [[row[column] for row in rows] for column in METADATA_COLUMNS]
+        await self.pg_conn.execute(
+            """
+            INSERT INTO chat_metadata (
+                chat_id, type, name, username, about, photo, participants_count,
+                pinned_messages, initial_messages, admins, max_pinned_message_id,
+                last_fetched_message_id, updated_at
+            )
+            SELECT
+                chat_id, type, name, username, about, photo, participants_count,
+                pinned_messages, initial_messages, admins, max_pinned_message_id,
+                last_fetched_message_id, CURRENT_TIMESTAMP
+            FROM unnest(
+                $1::text[], $2::text[], $3::text[], $4::text[], $5::text[],
+                $6::text[], $7::int[], $8::text[], $9::text[], $10::text[],
+                $11::bigint[], $12::bigint[]
+            ) AS v(
+                chat_id, type, name, username, about, photo, participants_count,
+                pinned_messages, initial_messages, admins, max_pinned_message_id,
+                last_fetched_message_id
+            )
+            ON CONFLICT (chat_id) DO UPDATE SET
+                type = EXCLUDED.type,
+                name = EXCLUDED.name,
+                username = EXCLUDED.username,
+                about = EXCLUDED.about,
+                photo = EXCLUDED.photo,
+                participants_count = EXCLUDED.participants_count,
+                pinned_messages = EXCLUDED.pinned_messages,
+                initial_messages = EXCLUDED.initial_messages,
+                admins = EXCLUDED.admins,
+                max_pinned_message_id = EXCLUDED.max_pinned_message_id,
+                last_fetched_message_id = EXCLUDED.last_fetched_message_id,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            *columns,
+        )
+        logger.info(f"flushed metadata for {len(rows)} groups")
+        self.pending_metadata.clear()
 
     async def update_account_chat_map(self, account_id: str, chat_ids: list[str]):
-        async with self.pg_conn.transaction():
-            # Insert or update all chat_ids for this account
-            await self.pg_conn.executemany(
+        """Sync account_chat, only writing rows whose status actually changed."""
+        rows = await self.pg_conn.fetch(
+            "SELECT chat_id, status FROM account_chat WHERE account_id = $1",
+            account_id,
+        )
+        current_status = {row["chat_id"]: row["status"] for row in rows}
+        watching = set(chat_ids)
+
+        to_watch = [
+            chat_id
+            for chat_id in watching
+            if current_status.get(chat_id) != AccountChatStatus.WATCHING.value
+        ]
+        to_quit = [
+            chat_id
+            for chat_id, status in current_status.items()
+            if chat_id not in watching and status != AccountChatStatus.QUIT.value
+        ]
+
+        if to_watch:
+            await self.pg_conn.execute(
                 """
                 INSERT INTO account_chat (account_id, chat_id, status)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (account_id, chat_id) DO UPDATE SET status = $3
+                SELECT $1, chat_id, $3 FROM unnest($2::text[]) AS chat_id
+                ON CONFLICT (account_id, chat_id) DO UPDATE SET
+                    status = EXCLUDED.status,
+                    updated_at = CURRENT_TIMESTAMP
                 """,
-                [
-                    (account_id, chat_id, AccountChatStatus.WATCHING.value)
-                    for chat_id in chat_ids
-                ],
+                account_id,
+                to_watch,
+                AccountChatStatus.WATCHING.value,
             )
 
-            # Update status to QUIT for chats not in the list
+        if to_quit:
             await self.pg_conn.execute(
                 """
                 UPDATE account_chat
-                SET status = $1
-                WHERE account_id = $2
-                AND chat_id != ALL($3)
+                SET status = $1, updated_at = CURRENT_TIMESTAMP
+                WHERE account_id = $2 AND chat_id = ANY($3)
                 """,
                 AccountChatStatus.QUIT.value,
                 account_id,
-                chat_ids,
+                to_quit,
             )
-
-    async def _get_photo_extension(self, file_path: str) -> str:
-        """Detect the file extension of the downloaded photo."""
-        try:
-            img_type = imghdr.what(file_path)
-            if img_type:
-                return f".{img_type}"
-        except Exception as e:
-            logger.error(f"Failed to get photo extension: {e}")
-        return ".jpg"
+        logger.info(
+            f"account chat map for {account_id}: "
+            f"{len(to_watch)} watching, {len(to_quit)} quit"
+        )
 
     def _get_group_type(self, dialog: any) -> str:
         entity = dialog.entity
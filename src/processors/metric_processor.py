@@ -2,16 +2,31 @@ import asyncio
 import json
 import logging
 import time
-from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
 
 import asyncpg
 
-from src.common.agent_client import AgentClient
-from src.common.config import DATABASE_URL
-from src.common.types import ChatMessage, ChatMetadata
+from src.common.agent_client import AgentClient, CascadePolicy
+from src.common.config import DATABASE_URL, METRIC_FORCED_REFRESH_HOURS
+from src.common.llm_cache import LLMResponseCache
+from src.common.types import AIMetricBatch, AIMetricResult, ChatMetadata
 from src.common.utils import parse_ai_response
-from src.helpers.message_helper import db_row_to_chat_message, gen_message_content
-from src.processors.processor import ProcessorBase
+from src.helpers.chat_snapshot import ChatSnapshot, chat_snapshots
+from src.helpers.context_builder import build_chat_context, context_token_budget
+from src.helpers.metric_jobs import (
+    HORIZON_SECONDS,
+    REFILL_SECONDS,
+    RETRY_SECONDS,
+    DueTimer,
+    claim_metric_jobs,
+    complete_metric_jobs,
+    extend_metric_job_claims,
+    load_upcoming_metric_jobs,
+    release_expired_metric_jobs,
+    release_metric_jobs,
+)
+from src.processors.processor import ProcessorBase, instance_id
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,19 +34,61 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MAX_METRICS_PER_BATCH = 8
+RECENT_MESSAGES_LIMIT = 50
+ERROR_BACKOFF_SECONDS = 10
+# notified by the triggers of migrations/create_metric_change_notify.sql
+METRIC_CHANGES_CHANNEL = "metric_changes"
+LISTEN_CHECK_SECONDS = 30
+
+BATCH_METRICS_SYSTEM_PROMPT = """
+You are a Web3 community analyst evaluating several metrics of a Telegram group
+at once. Each metric comes with its own guidelines, follow them independently.
+
+Respond with a single JSON object of this shape:
+{
+    "results": [
+        {
+            "metric_id": <the metric id>,
+            "value": <metric value as described by its guidelines>,
+            "confidence": <number between 0-100>,
+            "reason": "Explanation for the value and confidence level"
+        }
+    ]
+}
+Include exactly one entry per metric id.
+"""
+
+
 class MetricProcessor(ProcessorBase):
     def __init__(self):
-        super().__init__(interval=60)  # Check every minute
+        super().__init__(interval=0)  # process() sleeps until a job is due
         self.batch_size = 20
         self.pg_pool = None
-        self.agent_client = AgentClient()
-        self.processing_ids = set()
+        self.agent_client = AgentClient(
+            caller="metric_processor", cache=LLMResponseCache()
+        )
+        # try the cheap model first, escalating uncertain or invalid results
+        self.metric_cascade = CascadePolicy(
+            "metric", confidence=self._metric_confidence
+        )
+        self.batch_cascade = CascadePolicy(
+            "metric_batch", confidence=self._batch_confidence
+        )
+        self.instance_id = instance_id()
+        self.timer = DueTimer()
+        self.refilled_at = 0.0
+        self.change_tasks = set()
+        # (chat, metric) jobs queued or being computed by this instance
+        self.in_flight = set()
         self.queue = asyncio.Queue()
         self.workers = []
         self.metric_definitions = {}
+        # evaluate metrics sharing a model with a single call
+        self.batch_evaluation = True
         # 添加测试模式数据限制
         self.is_testing = True
-        self.test_limit = 2  # 测试时只处理2条数据
+        self.test_limit = 2  # 测试时每次只认领2个任务
 
     async def prepare(self):
         self.pg_pool = await asyncpg.create_pool(
@@ -44,180 +101,378 @@ class MetricProcessor(ProcessorBase):
             asyncio.create_task(self.process_chat_metrics())
             for _ in range(self.batch_size)
         ]
+        # and the listener applying metric changes made meanwhile
+        self.workers.append(asyncio.create_task(self._listen_for_metric_changes()))
+        # claims of slow chats would otherwise expire and be computed twice
+        self.workers.append(
+            asyncio.create_task(
+                self.keep_leases_alive(self.pg_pool, self._extend_claims)
+            )
+        )
         logger.info(f"{self.__class__.__name__} processor initiated")
 
     async def load_metric_definitions(self):
-        """
-        Load metric definitions from database, organized by user_id
-        return:
-            {
-                'user_id': {
-                    'metric_id': {
-                        'name': 'metric_name',
-                    }
-                }
-            }
-        """
+        """Load metric definitions from database, by metric id"""
         async with self.pg_pool.acquire() as conn:
-            # Get preset metrics and user-enabled metrics
             rows = await conn.fetch("""
-                -- Get preset metrics (available to all users)
-                SELECT DISTINCT 
-                    cmd.id, cmd.name, cmd.prompt, cmd.model, cmd.refresh_interval_hours,
-                    'system' as user_id  -- Use 'system' for preset metrics
-                FROM chat_metric_definitions cmd
-                WHERE cmd.is_preset = true
-                
-                UNION ALL
-                
-                -- Get user-specific enabled metrics
-                SELECT DISTINCT 
-                    cmd.id, cmd.name, cmd.prompt, cmd.model, cmd.refresh_interval_hours,
-                    um.user_id
-                FROM chat_metric_definitions cmd
-                INNER JOIN user_metric um ON cmd.id = um.metric_definition_id
-                WHERE um.is_enabled = true
-                
-                ORDER BY user_id, id
+                SELECT id, name, prompt, model, refresh_interval_hours
+                FROM chat_metric_definitions
             """)
-            
-            # Reorganize metrics by user_id
-            self.metric_definitions = {}
-            for row in rows:
-                user_id = row['user_id']
-                metric_id = row['id']
-                
-                if user_id not in self.metric_definitions:
-                    self.metric_definitions[user_id] = {}
-                    
-                self.metric_definitions[user_id][metric_id] = {
-                    'id': metric_id,
-                    'name': row['name'],
-                    'prompt': row['prompt'],
-                    'model': row['model'],
-                    'refresh_interval_hours': row['refresh_interval_hours']
-                }
-            
-            logger.info(f"Loaded metrics for {len(self.metric_definitions)} users")
+
+        self.metric_definitions = {
+            row["id"]: self._to_metric_definition(row) for row in rows
+        }
+        logger.info(f"Loaded {len(self.metric_definitions)} metric definitions")
+
+    @staticmethod
+    def _to_metric_definition(row) -> Dict:
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "prompt": row["prompt"],
+            "model": row["model"],
+            "refresh_interval_hours": row["refresh_interval_hours"],
+        }
+
+    async def _listen_for_metric_changes(self):
+        """LISTEN for metric changes on a dedicated connection, reconnecting
+
+        Changes made while disconnected are caught up with a full reload.
+        """
+        reconnecting = False
+        while self.running:
+            conn = None
+            try:
+                conn = await asyncpg.connect(DATABASE_URL)
+                await conn.add_listener(
+                    METRIC_CHANGES_CHANNEL, self._on_metric_change_notification
+                )
+                if reconnecting:
+                    await self.load_metric_definitions()
+                    self._retime_jobs()
+                logger.info(f"Listening on {METRIC_CHANGES_CHANNEL}")
+                while self.running and not conn.is_closed():
+                    await asyncio.sleep(LISTEN_CHECK_SECONDS)
+            except Exception as e:
+                logger.error(f"Metric change listener error: {e}")
+            finally:
+                if conn and not conn.is_closed():
+                    await conn.close()
+            reconnecting = True
+            await asyncio.sleep(LISTEN_CHECK_SECONDS)
+
+    def _on_metric_change_notification(self, conn, pid, channel, payload):
+        task = asyncio.create_task(self._apply_metric_change(json.loads(payload)))
+        self.change_tasks.add(task)
+        task.add_done_callback(self.change_tasks.discard)
+
+    async def _apply_metric_change(self, change: Dict):
+        """Apply a changed definition and time the jobs it added at once"""
+        metric_id = change["metric_definition_id"]
+        try:
+            if change["table"] == "chat_metric_definitions":
+                if change["op"] == "DELETE":
+                    self.metric_definitions.pop(metric_id, None)
+                else:
+                    async with self.pg_pool.acquire() as conn:
+                        row = await conn.fetchrow(
+                            """
+                            SELECT id, name, prompt, model, refresh_interval_hours
+                            FROM chat_metric_definitions
+                            WHERE id = $1
+                            """,
+                            metric_id,
+                        )
+                    if row:
+                        definition = self._to_metric_definition(row)
+                        self.metric_definitions[metric_id] = definition
+            logger.info(f"Applied {change['op']} on {change['table']} #{metric_id}")
+        except Exception as e:
+            logger.error(f"Error applying metric change {change}: {e}")
+        # the triggers of metric_jobs already added or dropped its jobs
+        self._retime_jobs()
+
+    def _retime_jobs(self):
+        """Reload the due times of upcoming jobs on the next dispatch, now"""
+        self.refilled_at = 0.0
+        self.timer.wake()
 
     async def process(self):
-        """Find chats that need metric updates and queue them for processing"""
+        """Sleep until the next metric job is due, then dispatch the due ones"""
+        await self.timer.wait(max(self.refilled_at + REFILL_SECONDS - time.time(), 0))
+        try:
+            await self.dispatch_due_jobs()
+        except Exception:
+            # the loop has no interval, don't spin on a failing database
+            await asyncio.sleep(ERROR_BACKOFF_SECONDS)
+            raise
+
+    async def dispatch_due_jobs(self):
+        """Claim the jobs due by now and queue them for processing by chat
+
+        Due times of the jobs within the horizon are kept in the timer and
+        reloaded from metric_jobs every REFILL_SECONDS.
+        """
+        # claim only what the workers can start on, other instances take the rest
+        if self.queue.qsize() >= self.batch_size:
+            await self.queue.join()
+
         async with self.pg_pool.acquire() as conn:
-            # Find chats that need metric updates with user associations
-            query = """
-                WITH user_chats AS (
-                    -- Get all enabled chats for each user through the association chain
-                    SELECT DISTINCT 
-                        u.id as user_id,
-                        cm.id, cm.chat_id, cm.name, cm.username, cm.about, 
-                        cm.participants_count, cm.admins
-                    FROM users u
-                    INNER JOIN user_account ua ON u.id = ua.user_id
-                    INNER JOIN accounts a ON ua.account_id = a.id
-                    INNER JOIN account_chat ac ON a.tg_id = ac.account_id
-                    INNER JOIN chat_metadata cm ON ac.chat_id = cm.chat_id
-                    WHERE ac.status = 'watching' AND cm.is_enabled = true
-                )
-                SELECT 
-                    uc.*,
-                    CASE 
-                        WHEN cmv.id IS NULL THEN true  -- No metrics yet
-                        WHEN cmv.next_refresh_at <= CURRENT_TIMESTAMP THEN true  -- Need refresh
-                        ELSE false
-                    END as needs_refresh
-                FROM user_chats uc
-                LEFT JOIN chat_metric_values cmv ON uc.chat_id = cmv.chat_id
-                WHERE uc.chat_id != ALL($1)  -- Not currently processing
-                AND (
-                    cmv.id IS NULL  -- No metrics yet
-                    OR cmv.next_refresh_at <= CURRENT_TIMESTAMP  -- Need refresh
-                )
-            """
+            if time.time() >= self.refilled_at + REFILL_SECONDS:
+                await release_expired_metric_jobs(conn)
+                self.timer.replace(await load_upcoming_metric_jobs(conn))
+                self.refilled_at = time.time()
+                logger.info(f"Timing {len(self.timer)} upcoming metric jobs")
 
-            if self.is_testing:
-                query = f"""
-                    SELECT * FROM ({query}) sub
-                    ORDER BY RANDOM() LIMIT $2
-                """
-                rows = await conn.fetch(query, list(self.processing_ids), self.test_limit)
-            else:
-                rows = await conn.fetch(query, list(self.processing_ids))
-            
-            if not rows:
+            limit = (
+                self.test_limit
+                if self.is_testing
+                else self.batch_size * MAX_METRICS_PER_BATCH
+            )
+            # a job still running here after its claim expired is not redone
+            keys = [
+                key for key in self.timer.pop_due(limit) if key not in self.in_flight
+            ]
+            jobs = await claim_metric_jobs(conn, self.instance_id, keys)
+            if not jobs:
                 return
+            self.in_flight.update(
+                (chat_id, metric_id)
+                for chat_id, metric_ids in jobs.items()
+                for metric_id in metric_ids
+            )
+
+            if any(
+                metric_id not in self.metric_definitions
+                for metric_ids in jobs.values()
+                for metric_id in metric_ids
+            ):
+                await self.load_metric_definitions()
 
-            # Organize chats by user_id
-            user_chats = {}
+            rows = await conn.fetch(
+                """
+                SELECT chat_id, name, username, about, participants_count, admins
+                FROM chat_metadata
+                WHERE chat_id = ANY($1)
+                """,
+                list(jobs.keys()),
+            )
+            # chats deleted meanwhile, their jobs went with them
+            for chat_id in jobs.keys() - {row["chat_id"] for row in rows}:
+                self.in_flight.difference_update(
+                    (chat_id, metric_id) for metric_id in jobs[chat_id]
+                )
+            logger.info(f"Enqueueing {len(rows)} chats")
             for row in rows:
-                user_id = row['user_id']
-                if user_id not in user_chats:
-                    user_chats[user_id] = []
-                
-                if row['chat_id'] in self.processing_ids:
-                    continue
-                    
-                self.processing_ids.add(row['chat_id'])
                 chat_metadata = await self._to_chat_metadata(row, conn)
-                user_chats[user_id].append(chat_metadata)
-
-            # Queue chats for processing
-            logger.info(f"Enqueueing chats for {len(user_chats)} users")
-            for user_id, chats in user_chats.items():
-                logger.info(f"User {user_id}: enqueueing {len(chats)} chats")
-                for chat_metadata in chats:
-                    await self.queue.put((user_id, chat_metadata))
+                await self.queue.put((chat_metadata, jobs[row["chat_id"]]))
 
     async def process_chat_metrics(self):
-        """Worker that processes metrics for each chat"""
+        """Worker that processes the claimed metrics of each chat"""
         while self.running:
             try:
-                user_id, chat_metadata = await self.queue.get()
-                logger.info(f"Processing metrics for user {user_id}, chat: {chat_metadata.name}")
-                
+                chat_metadata, metric_ids = await self.queue.get()
+                logger.info(
+                    f"Processing {len(metric_ids)} metrics for chat: "
+                    f"{chat_metadata.name}"
+                )
+
+                completed = []
                 try:
                     async with self.pg_pool.acquire() as conn:
-                        # Get context data
-                        context = await self._gather_context(chat_metadata, conn)
-                        
-                        # Get metrics for this user
-                        user_metrics = self.metric_definitions.get(user_id, {})
-                        system_metrics = self.metric_definitions.get('system', {})
-                        all_metrics = {**system_metrics, **user_metrics}  # User metrics override system metrics
-                        
-                        # Process each metric
-                        for metric_id, metric_def in all_metrics.items():
+                        metrics = {
+                            metric_id: self.metric_definitions[metric_id]
+                            for metric_id in metric_ids
+                            if metric_id in self.metric_definitions
+                        }
+
+                        snapshot = await chat_snapshots.get(
+                            conn, chat_metadata.chat_id, RECENT_MESSAGES_LIMIT
+                        )
+                        idle = await self._postpone_idle_metrics(
+                            conn,
+                            chat_metadata.chat_id,
+                            list(metrics.keys()),
+                            snapshot.high_water_mark,
+                        )
+                        for metric_id in idle:
+                            completed.append(metric_id)
+                            self._schedule(
+                                chat_metadata.chat_id,
+                                metric_id,
+                                metrics.pop(metric_id)["refresh_interval_hours"] * 3600,
+                            )
+
+                        # Get context data, sized for the smallest model in use
+                        token_budget = min(
+                            (
+                                context_token_budget(m["model"])
+                                for m in metrics.values()
+                            ),
+                            default=context_token_budget(self.agent_client.model),
+                        )
+                        results = {}
+                        if metrics:
+                            context = self._gather_context(
+                                chat_metadata, snapshot, token_budget
+                            )
+                            results = await self._calculate_metrics(context, metrics)
+                        for metric_id, result in results.items():
+                            metric_def = metrics[metric_id]
                             try:
-                                # Calculate metric
-                                result = await self._calculate_metric(
-                                    context, 
-                                    metric_def['prompt'],
-                                    metric_def['model']
+                                # Store metric value
+                                await self._store_metric_value(
+                                    conn,
+                                    chat_metadata.chat_id,
+                                    metric_id,
+                                    result["value"],
+                                    result["confidence"],
+                                    result["reason"],
+                                    metric_def["refresh_interval_hours"],
+                                    snapshot.high_water_mark,
+                                )
+                                completed.append(metric_id)
+                                self._schedule(
+                                    chat_metadata.chat_id,
+                                    metric_id,
+                                    metric_def["refresh_interval_hours"] * 3600,
                                 )
-                                
-                                if result:
-                                    # Store metric value
-                                    await self._store_metric_value(
-                                        conn,
-                                        chat_metadata.chat_id,
-                                        metric_id,
-                                        result['value'],
-                                        result['confidence'],
-                                        result['reason'],
-                                        metric_def['refresh_interval_hours']
-                                    )
                             except Exception as e:
-                                logger.error(f"Error processing metric {metric_def['name']}: {e}")
-                                
+                                logger.error(
+                                    f"Error storing metric {metric_def['name']}: {e}"
+                                )
+                        await complete_metric_jobs(
+                            conn, self.instance_id, chat_metadata.chat_id, completed
+                        )
+
                 except Exception as e:
                     logger.error(f"Error processing chat {chat_metadata.chat_id}: {e}")
                 finally:
-                    self.processing_ids.remove(chat_metadata.chat_id)
+                    await self._release_failed_jobs(
+                        chat_metadata.chat_id,
+                        [m for m in metric_ids if m not in completed],
+                    )
+                    self.in_flight.difference_update(
+                        (chat_metadata.chat_id, metric_id) for metric_id in metric_ids
+                    )
                     self.queue.task_done()
-                    
+
             except Exception as e:
                 logger.error(f"Worker error: {e}")
                 await asyncio.sleep(1)
 
+    async def _extend_claims(self, conn: asyncpg.Connection):
+        await extend_metric_job_claims(conn, self.instance_id)
+
+    async def _release_failed_jobs(self, chat_id: str, metric_ids: list[int]):
+        """Retry failed metrics later, expired claims would stall them longer"""
+        if not metric_ids:
+            return
+        try:
+            async with self.pg_pool.acquire() as conn:
+                await release_metric_jobs(conn, self.instance_id, chat_id, metric_ids)
+        except Exception as e:
+            logger.error(f"Error releasing metric jobs of chat {chat_id}: {e}")
+            return
+        for metric_id in metric_ids:
+            self._schedule(chat_id, metric_id, RETRY_SECONDS)
+
+    def _schedule(self, chat_id: str, metric_id: int, delay_seconds: float):
+        """Time a job's next run, later ones are picked up by a refill"""
+        if delay_seconds <= HORIZON_SECONDS:
+            self.timer.schedule((chat_id, metric_id), time.time() + delay_seconds)
+
+    async def _calculate_metrics(
+        self, context: str, metrics: Dict[int, Dict]
+    ) -> Dict[int, Dict]:
+        """Calculate metric values, batching metrics that share a model.
+
+        Metrics missing or invalid in the batched response fall back to one
+        call per metric.
+        """
+        results = {}
+        if self.batch_evaluation:
+            metrics_by_model = defaultdict(dict)
+            for metric_id, metric_def in metrics.items():
+                metrics_by_model[metric_def["model"]][metric_id] = metric_def
+
+            for model, model_metrics in metrics_by_model.items():
+                metric_ids = list(model_metrics.keys())
+                while metric_ids:
+                    batch_ids = metric_ids[:MAX_METRICS_PER_BATCH]
+                    metric_ids = metric_ids[MAX_METRICS_PER_BATCH:]
+                    batch = {
+                        metric_id: model_metrics[metric_id] for metric_id in batch_ids
+                    }
+                    if len(batch) > 1:
+                        results.update(
+                            await self._calculate_metric_batch(context, batch, model)
+                        )
+
+        for metric_id, metric_def in metrics.items():
+            if metric_id in results:
+                continue
+            result = await self._calculate_metric(
+                context, metric_def["prompt"], metric_def["model"]
+            )
+            if result:
+                results[metric_id] = result
+        return results
+
+    async def _calculate_metric_batch(
+        self, context: str, metrics: Dict[int, Dict], model: str
+    ) -> Dict[int, Dict]:
+        """Calculate several metrics with a single AI call sharing the context"""
+        metric_sections = "\n\n".join(
+            f"### METRIC {metric_id}: {metric_def['name']}\n"
+            f"{metric_def['prompt'].strip()}"
+            for metric_id, metric_def in metrics.items()
+        )
+        user_prompt = f"""
+Please analyze this Telegram group based on the provided context:
+
+{context}
+
+Evaluate each of the following metrics by its own guidelines:
+
+{metric_sections}
+"""
+        try:
+            response = await self.agent_client.cascade_completion(
+                self.batch_cascade,
+                messages=[
+                    {"role": "system", "content": BATCH_METRICS_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.1,
+                response_format={"type": "json_object"},
+                model=model,
+                stream=True,
+                schema=AIMetricBatch,
+            )
+        except Exception as e:
+            logger.error(f"Error calculating metric batch: {e}")
+            return {}
+
+        parsed = parse_ai_response(response, schema=AIMetricBatch)
+        results = {}
+        for entry in parsed.get("results", []):
+            try:
+                metric_id = int(entry.get("metric_id"))
+            except (AttributeError, TypeError, ValueError):
+                logger.warning(f"Invalid metric id in batch result: {entry}")
+                continue
+            if metric_id not in metrics:
+                continue
+            result = self._validate_metric_result(entry)
+            if result:
+                results[metric_id] = result
+
+        missing = [metric_id for metric_id in metrics if metric_id not in results]
+        if missing:
+            logger.warning(f"Batch missed metrics {missing}, falling back")
+        return results
+
     async def _calculate_metric(
         self, context: str, prompt: str, model: str
     ) -> Optional[Dict]:
@@ -232,50 +487,75 @@ Please analyze this Telegram group based on the provided context and guidelines:
 
 Provide your analysis in the specified JSON format with value, confidence, and reason fields.
 """
-            
-            response = await self.agent_client.chat_completion(
+
+            response = await self.agent_client.cascade_completion(
+                self.metric_cascade,
                 messages=[
                     {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
+                    {"role": "user", "content": user_prompt},
                 ],
                 temperature=0.1,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                model=model,
+                stream=True,
+                schema=AIMetricResult,
             )
-            
-            result = parse_ai_response(response)
+
+            result = parse_ai_response(response, schema=AIMetricResult)
             if not result:
                 logger.warning("Failed to parse AI response")
                 return None
-                
-            # Validate required fields
-            if not all(k in result for k in ["value", "confidence", "reason"]):
-                logger.warning(f"Missing required fields in result: {result}")
-                return None
-                
-            # Ensure value is not None/empty
-            if not result["value"]:
-                logger.warning(f"Empty value in result: {result}")
-                return None
-                
-            # Ensure confidence is a float between 0-100
-            try:
-                confidence = float(result["confidence"])
-                if not (0 <= confidence <= 100):
-                    raise ValueError("Confidence must be between 0 and 100")
-            except (TypeError, ValueError) as e:
-                logger.warning(f"Invalid confidence value: {e}")
-                return None
-                
-            return {
-                "value": str(result["value"]),  # Ensure value is string
-                "confidence": confidence,
-                "reason": str(result.get("reason", ""))  # Ensure reason is string
-            }
-            
+            return self._validate_metric_result(result)
+
         except Exception as e:
             logger.error(f"Error calculating metric: {e}")
             return None
 
+    def _metric_confidence(self, response: str | None) -> Optional[float]:
+        result = self._validate_metric_result(
+            parse_ai_response(response, schema=AIMetricResult)
+        )
+        return result["confidence"] if result else None
+
+    def _batch_confidence(self, response: str | None) -> Optional[float]:
+        """Lowest confidence among the valid entries of a batched response"""
+        parsed = parse_ai_response(response, schema=AIMetricBatch)
+        confidences = [
+            result["confidence"]
+            for entry in parsed.get("results", [])
+            if (result := self._validate_metric_result(entry))
+        ]
+        return min(confidences, default=None)
+
+    def _validate_metric_result(self, result: Dict) -> Optional[Dict]:
+        """Validate and normalize a metric result from the AI"""
+        # Validate required fields
+        if not isinstance(result, dict) or not all(
+            k in result for k in ["value", "confidence", "reason"]
+        ):
+            logger.warning(f"Missing required fields in result: {result}")
+            return None
+
+        # Ensure value is not None/empty
+        if not result["value"]:
+            logger.warning(f"Empty value in result: {result}")
+            return None
+
+        # Ensure confidence is a float between 0-100
+        try:
+            confidence = float(result["confidence"])
+            if not (0 <= confidence <= 100):
+                raise ValueError("Confidence must be between 0 and 100")
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Invalid confidence value: {e}")
+            return None
+
+        return {
+            "value": str(result["value"]),  # Ensure value is string
+            "confidence": confidence,
+            "reason": str(result.get("reason", "")),  # Ensure reason is string
+        }
+
     async def _store_metric_value(
         self,
         conn: asyncpg.Connection,
@@ -284,80 +564,122 @@ Provide your analysis in the specified JSON format with value, confidence, and r
         value: str,
         confidence: float,
         reason: str,
-        refresh_interval_hours: int
+        refresh_interval_hours: int,
+        high_water_mark: Tuple[int, int],
     ):
-        """Store a metric value in the database"""
-        
-        await conn.execute("""
+        """Store a metric value and the latest message it was computed from"""
+
+        await conn.execute(
+            """
             INSERT INTO chat_metric_values (
                 chat_id, metric_definition_id, value, confidence, reason,
-                last_refresh_at, next_refresh_at
+                last_refresh_at, next_refresh_at,
+                source_message_timestamp, source_message_row_id
             ) VALUES ($1, $2, $3, $4, $5, CURRENT_TIMESTAMP, 
-                     CURRENT_TIMESTAMP + INTERVAL '1 hour' * $6)
+                     CURRENT_TIMESTAMP + INTERVAL '1 hour' * $6, $7, $8)
             ON CONFLICT (chat_id, metric_definition_id) DO UPDATE
             SET value = EXCLUDED.value,
                 confidence = EXCLUDED.confidence,
                 reason = EXCLUDED.reason,
                 last_refresh_at = CURRENT_TIMESTAMP,
-                next_refresh_at = CURRENT_TIMESTAMP + INTERVAL '1 hour' * $6
-        """, chat_id, metric_id, value, confidence, reason, refresh_interval_hours)
+                next_refresh_at = CURRENT_TIMESTAMP + INTERVAL '1 hour' * $6,
+                source_message_timestamp = EXCLUDED.source_message_timestamp,
+                source_message_row_id = EXCLUDED.source_message_row_id
+        """,
+            chat_id,
+            metric_id,
+            value,
+            confidence,
+            reason,
+            refresh_interval_hours,
+            *high_water_mark,
+        )
+
+    async def _postpone_idle_metrics(
+        self,
+        conn: asyncpg.Connection,
+        chat_id: str,
+        metric_ids: list[int],
+        high_water_mark: Tuple[int, int],
+    ) -> list[int]:
+        """Push the next refresh of metrics the chat has no new messages for
+
+        Values older than METRIC_FORCED_REFRESH_HOURS are recomputed anyway.
+        Returns the postponed metric ids.
+        """
+        rows = await conn.fetch(
+            """
+            UPDATE chat_metric_values v
+            SET next_refresh_at = CURRENT_TIMESTAMP
+                + INTERVAL '1 hour' * d.refresh_interval_hours
+            FROM chat_metric_definitions d
+            WHERE d.id = v.metric_definition_id
+            AND v.chat_id = $1
+            AND v.metric_definition_id = ANY($2)
+            AND v.source_message_timestamp = $3
+            AND v.source_message_row_id = $4
+            AND v.last_refresh_at > CURRENT_TIMESTAMP - INTERVAL '1 hour' * $5
+            RETURNING v.metric_definition_id
+            """,
+            chat_id,
+            metric_ids,
+            *high_water_mark,
+            METRIC_FORCED_REFRESH_HOURS,
+        )
+        idle = [row["metric_definition_id"] for row in rows]
+        if idle:
+            logger.info(f"No new messages in {chat_id}, postponed metrics {idle}")
+        return idle
 
-    async def _gather_context(
-        self, chat_metadata: ChatMetadata, conn: asyncpg.Connection
+    def _gather_context(
+        self,
+        chat_metadata: ChatMetadata,
+        snapshot: ChatSnapshot,
+        token_budget: Optional[int] = None,
     ) -> str:
         """Gather context data for metric calculation"""
-        # Get recent messages
-        messages = await self._get_latest_messages(chat_metadata.chat_id, conn)
-        
-        # Build context
-        context_parts = [
+        lines, tokens, dedup_stats = snapshot.compressed(
+            "content", RECENT_MESSAGES_LIMIT
+        )
+        header = [
             f"Chat Name: {chat_metadata.name}",
-            f"Description: {chat_metadata.about or 'No description'}",
             f"Participants: {chat_metadata.participants_count}",
-            "\nRecent Messages:",
         ]
-        
-        for msg in messages:
-            context_parts.append(gen_message_content(msg))
-            
-        return "\n".join(context_parts)
-
-    async def _get_latest_messages(
-        self, chat_id: str, conn: asyncpg.Connection, limit: int = 50
-    ) -> List[ChatMessage]:
-        """Get recent messages for a chat"""
-        rows = await conn.fetch("""
-            SELECT chat_id, message_id, reply_to, topic_id,
-                   sender_id, message_text, buttons, message_timestamp
-            FROM chat_messages 
-            WHERE chat_id = $1
-            ORDER BY message_timestamp DESC
-            LIMIT $2
-        """, chat_id, limit)
-        
-        messages = [db_row_to_chat_message(row) for row in rows]
-        messages.reverse()
-        return messages
+        if dedup_stats.duplicates:
+            header.append(dedup_stats.summary())
+
+        context = build_chat_context(
+            header=header,
+            description=chat_metadata.about or "No description",
+            recent_messages=lines,
+            recent_message_tokens=tokens,
+            token_budget=token_budget or context_token_budget(self.agent_client.model),
+        )
+        logger.info(
+            f"context for {chat_metadata.chat_id}: "
+            f"{context.tokens_used}/{context.token_budget} tokens"
+        )
+        return context.text
 
     async def _to_chat_metadata(self, row: dict, conn) -> ChatMetadata:
         """Convert database row to ChatMetadata object"""
         try:
             return ChatMetadata(
-                chat_id=row['chat_id'],
-                name=row['name'],
-                username=row['username'],
-                about=row['about'],
-                participants_count=row['participants_count'],
-                admins=row['admins']
+                chat_id=row["chat_id"],
+                name=row["name"],
+                username=row["username"],
+                about=row["about"],
+                participants_count=row["participants_count"],
+                admins=row["admins"],
             )
         except Exception as e:
             logger.error(f"Error converting row to ChatMetadata: {e}, row: {row}")
             # 返回一个带有默认值的对象
             return ChatMetadata(
-                chat_id=row['chat_id'],
-                name=row['name'] or '',
-                username=row['username'] or '',
-                about=row['about'] or '',
-                participants_count=row['participants_count'] or 0,
-                admins=row['admins'] or ''
+                chat_id=row["chat_id"],
+                name=row["name"] or "",
+                username=row["username"] or "",
+                about=row["about"] or "",
+                participants_count=row["participants_count"] or 0,
+                admins=row["admins"] or "",
             )
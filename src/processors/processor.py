@@ -1,8 +1,132 @@
 import asyncio
 import logging
+import os
+import socket
+from typing import Awaitable, Callable
+
+import asyncpg
 
 logger = logging.getLogger(__name__)
 
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+
+# Lease the given items that no live lease holds. Rows are created on first
+# claim and locked with SKIP LOCKED, so concurrent instances split the items
+# instead of waiting on each other.
+CLAIM_LEASES_QUERY = """
+    WITH free AS (
+        SELECT item_id
+        FROM work_leases
+        WHERE kind = $1 AND item_id = ANY($2) AND leased_until <= NOW()
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE work_leases l
+    SET owner = $3,
+        leased_until = NOW() + make_interval(secs => $4),
+        updated_at = NOW()
+    FROM free
+    WHERE l.kind = $1 AND l.item_id = free.item_id
+    RETURNING l.item_id
+"""
+
+
+def instance_id() -> str:
+    """Identify this process as the owner of its leases and claims."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkLeases:
+    """Leases in work_leases on the items of one kind of work.
+
+    A lease expires unless heartbeated, so the items of a crashed instance are
+    claimed again by the others after at most `lease_seconds`.
+    """
+
+    def __init__(self, kind: str, lease_seconds: int = LEASE_SECONDS):
+        self.kind = kind
+        self.owner = instance_id()
+        self.lease_seconds = lease_seconds
+
+    async def claim(
+        self, pg_conn: asyncpg.Connection, item_ids: list[str]
+    ) -> list[str]:
+        """Lease the items no other instance holds, in the given order."""
+        if not item_ids:
+            return []
+        async with pg_conn.transaction():
+            await pg_conn.execute(
+                """
+                INSERT INTO work_leases (kind, item_id)
+                SELECT $1, unnest($2::text[])
+                ON CONFLICT (kind, item_id) DO NOTHING
+                """,
+                self.kind,
+                item_ids,
+            )
+            rows = await pg_conn.fetch(
+                CLAIM_LEASES_QUERY,
+                self.kind,
+                item_ids,
+                self.owner,
+                self.lease_seconds,
+            )
+        claimed = {row["item_id"] for row in rows}
+        logger.info(f"{self.owner} leased {len(claimed)}/{len(item_ids)} {self.kind}")
+        return [item_id for item_id in item_ids if item_id in claimed]
+
+    async def heartbeat(self, pg_conn: asyncpg.Connection) -> int:
+        """Extend every live lease held by this instance."""
+        result = await pg_conn.execute(
+            """
+            UPDATE work_leases
+            SET leased_until = NOW() + make_interval(secs => $3), updated_at = NOW()
+            WHERE owner = $1 AND kind = $2 AND leased_until > NOW()
+            """,
+            self.owner,
+            self.kind,
+            self.lease_seconds,
+        )
+        return int(result.split()[-1])
+
+    async def release(
+        self,
+        pg_conn: asyncpg.Connection,
+        item_ids: list[str],
+        retry_seconds: int = 0,
+    ):
+        """Drop the leases of finished items, those lost meanwhile are kept.
+
+        With `retry_seconds` the leases are left ownerless until then instead,
+        so failed items are not claimed again right away.
+        """
+        if not item_ids:
+            return
+        if retry_seconds:
+            await pg_conn.execute(
+                """
+                UPDATE work_leases
+                SET owner = NULL,
+                    leased_until = NOW() + make_interval(secs => $4),
+                    updated_at = NOW()
+                WHERE owner = $1 AND kind = $2 AND item_id = ANY($3)
+                """,
+                self.owner,
+                self.kind,
+                item_ids,
+                retry_seconds,
+            )
+            return
+        await pg_conn.execute(
+            """
+            DELETE FROM work_leases
+            WHERE owner = $1 AND kind = $2 AND item_id = ANY($3)
+            """,
+            self.owner,
+            self.kind,
+            item_ids,
+        )
+
 
 class ProcessorBase:
     def __init__(self, interval: int):
@@ -28,3 +152,24 @@ class ProcessorBase:
 
     async def process(self):
         raise NotImplementedError("Process method must be implemented")
+
+    async def keep_leases_alive(
+        self,
+        pg_pool: asyncpg.Pool,
+        heartbeat: Callable[[asyncpg.Connection], Awaitable],
+        interval: int = HEARTBEAT_SECONDS,
+    ):
+        """Heartbeat the leases of this instance until it stops.
+
+        Run as a task next to the workers, `interval` has to stay well below
+        the lease duration.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if not self.running:
+                return
+            try:
+                async with pg_pool.acquire() as conn:
+                    await heartbeat(conn)
+            except Exception as e:
+                logger.error(f"Failed to heartbeat leases: {e}")
@@ -4,6 +4,7 @@ import asyncpg
 
 from src.common.agent_client import AgentClient
 from src.common.config import DATABASE_URL
+from src.common.llm_cache import LLMResponseCache
 from src.helpers.quality_evaluation_helper import evaluate_chat_qualities
 from src.processors.processor import ProcessorBase
 
@@ -20,7 +21,9 @@ class QualityEvaluationProcessor(ProcessorBase):
     def __init__(self):
         super().__init__(interval=QUALITY_EVALUATION_INTERVAL_SECONDS)
         self.pg_conn = None
-        self.agent_client = AgentClient()
+        self.agent_client = AgentClient(
+            caller="quality_evaluation", cache=LLMResponseCache()
+        )
 
     async def process(self):
         if not self.pg_conn:
@@ -1,12 +1,15 @@
+import asyncio
 import json
 import logging
 import time
 from asyncio.log import logger
 from datetime import datetime
+from typing import Optional
 
 import asyncpg
 
 from src.common.agent_client import AgentClient
+from src.common.types import AIScoreSummary
 from src.common.utils import parse_ai_response
 from src.processors.processor import ProcessorBase
 
@@ -49,6 +52,44 @@ Output Instructions:
 # format on
 
 MIN_MESSAGES_TO_PROCESS = 10
+MAX_CONCURRENT_EVALUATIONS = 10
+CURSOR_PREFETCH = 1000
+# a window holding more messages is split, so a backlog after downtime is
+# evaluated in several windows instead of loaded at once
+MAX_WINDOW_MESSAGES = 50000
+
+# End of the window holding at most $3 messages, the timestamp of the next one.
+WINDOW_END_QUERY = """
+    SELECT message_timestamp
+    FROM chat_messages
+    WHERE message_timestamp > $1 AND message_timestamp < $2
+    ORDER BY message_timestamp
+    OFFSET $3
+    LIMIT 1
+"""
+
+# Messages of the window grouped by chat, with the stats of each chat computed
+# in the same scan. Chats with too few messages are filtered out in SQL.
+WINDOWED_MESSAGES_QUERY = """
+    WITH windowed AS (
+        SELECT chat_id, sender_id, message_text, message_timestamp
+        FROM chat_messages
+        WHERE message_timestamp > $1 AND message_timestamp < $2
+    ),
+    stats AS (
+        SELECT chat_id,
+               COUNT(*) AS messages_count,
+               COUNT(DISTINCT sender_id) AS unique_users_count
+        FROM windowed
+        GROUP BY chat_id
+        HAVING COUNT(*) >= $3
+    )
+    SELECT w.chat_id, w.sender_id, w.message_text, w.message_timestamp,
+           s.messages_count, s.unique_users_count
+    FROM windowed w
+    INNER JOIN stats s ON s.chat_id = w.chat_id
+    ORDER BY w.chat_id, w.message_timestamp
+"""
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -62,7 +103,7 @@ class ChatScoreSummarizer(ProcessorBase):
         super().__init__(interval=MIN_SUMMARY_INTERVAL)
         self.pg_conn = pg_conn
         self.last_processed_time = 0
-        self.client = AgentClient()
+        self.client = AgentClient(caller="score_summarizer")
 
     async def _get_last_message_timestamp(self) -> int:
         result = await self.pg_conn.fetchval(
@@ -76,40 +117,86 @@ class ChatScoreSummarizer(ProcessorBase):
             self.last_processed_time = await self._get_last_message_timestamp()
         logger.info(f"Last processed time: {self.last_processed_time}")
 
-        # Get all unique chat IDs
         current_time = int(time.time())
-        chat_ids = await self.pg_conn.fetch(
-            """
-            SELECT DISTINCT chat_id FROM chat_messages
-            WHERE message_timestamp > $1 AND message_timestamp < $2
-            """,
+        while True:
+            window_end = await self._get_window_end(current_time)
+            await self._process_window(window_end)
+            # messages at window_end itself belong to the next window
+            self.last_processed_time = window_end - 1
+            if window_end == current_time:
+                return
+
+    async def _get_window_end(self, current_time: int) -> int:
+        """End of the next window, current_time unless the backlog is too big."""
+        window_end = await self.pg_conn.fetchval(
+            WINDOW_END_QUERY,
             self.last_processed_time,
             current_time,
+            MAX_WINDOW_MESSAGES,
         )
-        if not chat_ids:
+        if window_end is None:
+            return current_time
+        logger.info(f"Splitting backlog, evaluating messages before {window_end}")
+        # a window spans at least one second, however many messages it holds
+        return max(window_end, self.last_processed_time + 2)
+
+    async def _process_window(self, window_end: int):
+        """Evaluate the chats of the window and store their reports."""
+        chats = await self._get_windowed_chats(window_end)
+        if not chats:
             logger.info("No chat groups to process")
-            return
 
-        logger.info(f"Found {len(chat_ids)} chat groups to process")
-        for record in chat_ids:
-            try:
-                logger.info(f"Evaluating chat {record['chat_id']} at {current_time}")
-                await self.evaluate(str(record["chat_id"]), current_time)
-            except Exception as e:
-                logger.error(f"Error processing chat {record['chat_id']}: {e}")
-        self.last_processed_time = current_time
-
-    async def evaluate(self, chat_id: str, current_time: int) -> None:
-        """Build activity report for a chat group."""
-        logger.info(f"Evaluating chat {chat_id} at {current_time}")
-        messages = await self.get_unprocessed_messages(chat_id, current_time)
-        if not messages or len(messages) < MIN_MESSAGES_TO_PROCESS:
-            logger.info(
-                f"Not enough messages to process for chat {chat_id} to summarize, skipping..."
-            )
-            return
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_EVALUATIONS)
 
-        logger.info(f"Found {len(messages)} messages to process for chat {chat_id}")
+        async def evaluate_chat(chat_id: str, messages: list, stats: dict):
+            async with semaphore:
+                try:
+                    return await self.evaluate(chat_id, messages, stats, window_end)
+                except Exception as e:
+                    logger.error(f"Error processing chat {chat_id}: {e}")
+
+        tasks = [evaluate_chat(*chat) for chat in chats]
+        reports = [report for report in await asyncio.gather(*tasks) if report]
+        await self._store_reports(reports)
+        logger.info(f"Stored {len(reports)}/{len(tasks)} chat reports at {window_end}")
+
+    async def _get_windowed_chats(self, window_end: int) -> list[tuple]:
+        """Messages and stats of the window, by chat.
+
+        The whole window is buffered: the cursor is read to the end before any
+        evaluation starts, so its transaction never stays open across LLM
+        calls. The cursor only bounds the rows fetched per round trip, the
+        buffer is bounded by MAX_WINDOW_MESSAGES unless a single second holds
+        more.
+        """
+        chats = []
+        # cursors only live inside a transaction
+        async with self.pg_conn.transaction():
+            async for row in self.pg_conn.cursor(
+                WINDOWED_MESSAGES_QUERY,
+                self.last_processed_time,
+                window_end,
+                MIN_MESSAGES_TO_PROCESS,
+                prefetch=CURSOR_PREFETCH,
+            ):
+                if not chats or chats[-1][0] != row["chat_id"]:
+                    stats = {
+                        "messages_count": row["messages_count"],
+                        "unique_users_count": row["unique_users_count"],
+                    }
+                    chats.append((row["chat_id"], [], stats))
+                chats[-1][1].append(row)
+        return chats
+
+    async def evaluate(
+        self, chat_id: str, messages: list, stats: dict, current_time: int
+    ) -> Optional[tuple]:
+        """Build activity report for a chat group, as a chat_score_summaries row.
+
+        None when the response is not a valid report, so one bad response
+        never fails the batch insert of the others.
+        """
+        logger.info(f"Evaluating {len(messages)} messages of chat {chat_id}")
         # Prepare conversation history for AI
         conversation_text = self._prepare_conversations(messages)
         response = await self.client.chat_completion(
@@ -121,39 +208,39 @@ class ChatScoreSummarizer(ProcessorBase):
                 },
             ]
         )
-        result = parse_ai_response(response, ["score", "summary", "highlights"])
-
-        # Store the report
-        logger.info(f"Storing report for chat {chat_id} at {current_time}")
-        await self.pg_conn.execute(
-            """
-            INSERT INTO chat_score_summaries
-            (chat_id, score, summary, highlights, messages_count,
-             unique_users_count, last_message_timestamp)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-            """,
+        result = parse_ai_response(
+            response, ["score", "summary", "highlights"], schema=AIScoreSummary
+        )
+        if not result:
+            logger.warning(f"No valid report for chat {chat_id}, skipping...")
+            return None
+        return (
             str(chat_id),
             int(result["score"]),
             result["summary"],
             result["highlights"],
-            len(messages),
-            len(set(msg["sender_id"] for msg in messages)),
+            stats["messages_count"],
+            stats["unique_users_count"],
             current_time,
         )
 
-    async def get_unprocessed_messages(self, chat_id: int, current_time: int) -> list:
-        query = """
-            SELECT sender_id, message_text, message_timestamp
-            FROM chat_messages
-            WHERE chat_id = $1
-            AND message_timestamp > $2
-            AND message_timestamp < $3
-            ORDER BY message_timestamp ASC
-        """
-        messages = await self.pg_conn.fetch(
-            query, chat_id, self.last_processed_time, current_time
+    async def _store_reports(self, reports: list[tuple]):
+        """Insert the reports of a cycle with a single statement."""
+        if not reports:
+            return
+        await self.pg_conn.execute(
+            """
+            INSERT INTO chat_score_summaries
+            (chat_id, score, summary, highlights, messages_count,
+             unique_users_count, last_message_timestamp)
+            SELECT * FROM unnest(
+                $1::text[], $2::int[], $3::text[], $4::text[], $5::int[],
+                $6::int[], $7::bigint[]
+            )
+            ON CONFLICT (chat_id, last_message_timestamp) DO NOTHING
+            """,
+            *[list(column) for column in zip(*reports)],
         )
-        return [dict(msg) for msg in messages]
 
     def _prepare_conversations(self, messages: list) -> str:
         conversation_lines = []
@@ -17,6 +17,7 @@ from src.common.types import (
     TgLinkStatus,
 )
 from src.helpers.ip_proxy_helper import pick_ip_proxy
+from src.helpers.mention_extractor import get_mentioning_chats
 from src.processors.processor import ProcessorBase
 
 # flake8: noqa: E501
@@ -28,6 +29,16 @@ CHAIN_FILTERS = {
 }
 
 
+GMGN_SOURCE = "gmgn"
+MENTIONED_SOURCE = "gmgn_mentioned"
+
+
+def token_address(entity: MemeCoinEntity) -> str:
+    """Address of the token as stored in the mentions index."""
+    address = entity.reference.split(":", 1)[-1]
+    return address.lower() if address.startswith("0x") else address
+
+
 async def get_gmgn_24h_ranked_groups():
     scraper = cloudscraper.create_scraper(
         browser={"browser": "chrome", "platform": "darwin", "mobile": False}
@@ -245,19 +256,37 @@ class TgLinkImporter(ProcessorBase):
             logger.warning("No entities found from either API or local file")
             return
 
-        tg_links = [entity.telegram for entity in entities if entity.telegram]
+        entities = [entity for entity in entities if entity.telegram]
 
-        if not tg_links:
+        if not entities:
             logger.info("No telegram links found")
             return
 
-        logger.info(f"Importing {len(tg_links)} telegram links")
+        # tokens already mentioned in watched chats, from the mentions index
+        mentioning_chats = await get_mentioning_chats(
+            self.pg_conn, [token_address(entity) for entity in entities]
+        )
+        logger.info(
+            f"Importing {len(entities)} telegram links, "
+            f"{len(mentioning_chats)} tokens already mentioned in chats"
+        )
         await self.pg_conn.executemany(
             """
-            INSERT INTO tg_link_status (tg_link, status)
-            VALUES ($1, $2)
+            INSERT INTO tg_link_status (tg_link, status, source)
+            VALUES ($1, $2, $3)
             ON CONFLICT DO NOTHING
             """,
-            [(link, TgLinkStatus.PENDING_PRE_PROCESSING.value) for link in tg_links],
+            [
+                (
+                    entity.telegram,
+                    TgLinkStatus.PENDING_PRE_PROCESSING.value,
+                    (
+                        MENTIONED_SOURCE
+                        if token_address(entity) in mentioning_chats
+                        else GMGN_SOURCE
+                    ),
+                )
+                for entity in entities
+            ],
         )
-        logger.info(f"Imported {len(tg_links)} telegram links")
+        logger.info(f"Imported {len(entities)} telegram links")
@@ -0,0 +1,366 @@
+"""Throughput benchmark of the AI processors against the mock LLM server.
+
+Seeds synthetic chats and messages, runs each processor over them with the
+LLM calls served by src/scripts/mock_llm_server.py and reports chats/sec,
+per-chat latency percentiles and database queries per chat.
+
+The processors pick up every chat due for evaluation, so only run this
+against a scratch database with the schema applied:
+
+    python -m src.scripts.benchmark_processors \
+        --database-url postgresql://localhost:5432/sniper_bench --chats 200
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+from src.scripts.mock_llm_server import (
+    add_mock_arguments,
+    settings_from_args,
+    start_mock_server,
+)
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+CHAT_PREFIX = "bench-"
+BENCH_USER_ID = "bench-user"
+BENCH_ACCOUNT_ID = "bench-account"
+PROCESSORS = ["entity_extractor", "metric_processor", "quality_evaluation"]
+WORDS = (
+    "token launch airdrop whitelist presale chart pump dev team roadmap gm "
+    "wen moon listing contract liquidity holders community raid tweet"
+).split()
+
+# queries seen by every connection opened through asyncpg, reset per run
+query_counts = defaultdict(int)
+
+
+def configure_environment(args):
+    """Point src.common.config at the mock server, before it is imported."""
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["OPENROUTER_API_URL"] = f"http://127.0.0.1:{args.mock_port}/v1/"
+    os.environ.setdefault("OPENROUTER_API_KEY", "mock")
+    # route every model through the mock server
+    os.environ["DEEPSEEK_API_KEY"] = ""
+    # the mock server is the bottleneck under test, not the governor
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", "200")
+
+
+def count_queries(asyncpg):
+    """Wrap asyncpg connects so every query is counted in query_counts."""
+
+    def on_query(record):
+        query_counts["queries"] += 1
+
+    async def init(conn):
+        conn.add_query_logger(on_query)
+
+    create_pool, connect = asyncpg.create_pool, asyncpg.connect
+
+    def counted_create_pool(*args, **kwargs):
+        user_init = kwargs.pop("init", None)
+
+        async def chained_init(conn):
+            await init(conn)
+            if user_init:
+                await user_init(conn)
+
+        return create_pool(*args, init=chained_init, **kwargs)
+
+    async def counted_connect(*args, **kwargs):
+        conn = await connect(*args, **kwargs)
+        await init(conn)
+        return conn
+
+    asyncpg.create_pool = counted_create_pool
+    asyncpg.connect = counted_connect
+
+
+class TimedQueue(asyncio.Queue):
+    """Queue recording the time from get() to task_done() of each item.
+
+    Workers call task_done() from the task that got the item, which pairs
+    the two calls without touching the processors.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = {}
+        self.latencies = []
+
+    async def get(self):
+        item = await super().get()
+        self.started[asyncio.current_task()] = time.monotonic()
+        return item
+
+    def task_done(self):
+        started_at = self.started.pop(asyncio.current_task(), None)
+        if started_at is not None:
+            self.latencies.append(time.monotonic() - started_at)
+        super().task_done()
+
+
+async def seed(conn, chats: int, messages: int):
+    chat_ids = [f"{CHAT_PREFIX}{i}" for i in range(chats)]
+    await conn.execute(
+        """
+        INSERT INTO chat_metadata (
+            chat_id, name, about, participants_count, type, evaluated_at, is_enabled
+        )
+        SELECT unnest($1::text[]), unnest($2::text[]), 'benchmark chat',
+               1000, 'mega_group', 0, true
+        ON CONFLICT (chat_id) DO UPDATE SET evaluated_at = 0
+        """,
+        chat_ids,
+        [f"Bench chat {i}" for i in range(chats)],
+    )
+
+    now = int(time.time())
+    rows = [
+        (
+            chat_id,
+            str(message_id),
+            " ".join(random.choices(WORDS, k=random.randint(3, 30))),
+            str(random.randint(1, 200)),
+            now - (messages - message_id) * 60,
+        )
+        for chat_id in chat_ids
+        for message_id in range(messages)
+    ]
+    await conn.execute(
+        """
+        INSERT INTO chat_messages (
+            chat_id, message_id, message_text, sender_id, message_timestamp
+        )
+        SELECT * FROM unnest(
+            $1::text[], $2::text[], $3::text[], $4::text[], $5::bigint[]
+        )
+        ON CONFLICT (chat_id, message_id) DO NOTHING
+        """,
+        *[list(column) for column in zip(*rows)],
+    )
+
+    # user -> account -> watched chats chain used by the metric processor
+    user_pk = await conn.fetchval(
+        """
+        INSERT INTO users (user_id, username) VALUES ($1, $1)
+        ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username
+        RETURNING id
+        """,
+        BENCH_USER_ID,
+    )
+    account_pk = await conn.fetchval(
+        """
+        INSERT INTO accounts (tg_id, api_id, api_hash, phone)
+        VALUES ($1, 'bench', 'bench', $1)
+        ON CONFLICT (tg_id) DO UPDATE SET api_id = EXCLUDED.api_id
+        RETURNING id
+        """,
+        BENCH_ACCOUNT_ID,
+    )
+    await conn.execute(
+        """
+        INSERT INTO user_account (user_id, account_id) VALUES ($1, $2)
+        ON CONFLICT (user_id, account_id) DO NOTHING
+        """,
+        user_pk,
+        account_pk,
+    )
+    await conn.execute(
+        """
+        INSERT INTO account_chat (account_id, chat_id, status)
+        SELECT $1, unnest($2::text[]), 'watching'
+        ON CONFLICT (account_id, chat_id) DO NOTHING
+        """,
+        BENCH_ACCOUNT_ID,
+        chat_ids,
+    )
+    await conn.execute(
+        "DELETE FROM chat_metric_values WHERE chat_id = ANY($1)", chat_ids
+    )
+    # jobs of the chats were created by triggers, make them all due again
+    await conn.execute(
+        """
+        UPDATE metric_jobs
+        SET due_at = NOW(), claimed_by = NULL, claimed_until = NULL
+        WHERE chat_id = ANY($1)
+        """,
+        chat_ids,
+    )
+
+
+async def cleanup(conn):
+    pattern = f"{CHAT_PREFIX}%"
+    await conn.execute("DELETE FROM chat_metric_values WHERE chat_id LIKE $1", pattern)
+    await conn.execute("DELETE FROM chat_messages WHERE chat_id LIKE $1", pattern)
+    await conn.execute("DELETE FROM work_leases WHERE item_id LIKE $1", pattern)
+    await conn.execute(
+        "DELETE FROM account_chat WHERE account_id = $1", BENCH_ACCOUNT_ID
+    )
+    await conn.execute("DELETE FROM chat_metadata WHERE chat_id LIKE $1", pattern)
+    await conn.execute(
+        """
+        DELETE FROM user_account
+        WHERE account_id IN (SELECT id FROM accounts WHERE tg_id = $1)
+        """,
+        BENCH_ACCOUNT_ID,
+    )
+    await conn.execute("DELETE FROM accounts WHERE tg_id = $1", BENCH_ACCOUNT_ID)
+    await conn.execute("DELETE FROM users WHERE user_id = $1", BENCH_USER_ID)
+
+
+async def run_queue_processor(
+    processor, until_drained: bool = False, step=None
+) -> list[float]:
+    """Run one process() pass of a queue based processor until drained.
+
+    `step` replaces process() for a pass. With `until_drained`, passes are
+    repeated until one queues nothing.
+    """
+    processor.queue = TimedQueue()
+    processor.agent_client.cache = None  # measure the llm path, not redis
+    await processor.prepare()
+    processor.running = True
+    try:
+        while True:
+            processed = len(processor.queue.latencies)
+            await (step or processor.process)()
+            await processor.queue.join()
+            if not until_drained or len(processor.queue.latencies) == processed:
+                break
+    finally:
+        processor.running = False
+        for worker in processor.workers:
+            worker.cancel()
+        await asyncio.gather(*processor.workers, return_exceptions=True)
+        await processor.pg_pool.close()
+    return processor.queue.latencies
+
+
+async def run_entity_extractor() -> list[float]:
+    from src.processors.entity_extractor import EntityExtractor
+
+    # each pass leases one batch of groups
+    return await run_queue_processor(EntityExtractor(), until_drained=True)
+
+
+async def run_metric_processor() -> list[float]:
+    from src.processors.metric_processor import MetricProcessor
+
+    processor = MetricProcessor()
+    processor.is_testing = False
+    # each pass claims a bounded number of due jobs, without waiting for more
+    return await run_queue_processor(
+        processor, until_drained=True, step=processor.dispatch_due_jobs
+    )
+
+
+async def run_quality_evaluation() -> list[float]:
+    import asyncpg
+
+    from src.common.agent_client import AgentClient
+    from src.helpers import quality_evaluation_helper
+
+    queues = []
+
+    def make_queue():
+        queues.append(TimedQueue())
+        return queues[-1]
+
+    # the first queue created by evaluate_chat_qualities holds the chats
+    quality_evaluation_helper.Queue = make_queue
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await quality_evaluation_helper.evaluate_chat_qualities(
+            conn, AgentClient(caller="quality_evaluation")
+        )
+    finally:
+        await conn.close()
+    return queues[0].latencies if queues else []
+
+
+RUNNERS = {
+    "entity_extractor": run_entity_extractor,
+    "metric_processor": run_metric_processor,
+    "quality_evaluation": run_quality_evaluation,
+}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def benchmark(args):
+    import asyncpg
+
+    count_queries(asyncpg)
+    settings = settings_from_args(args)
+    runner = await start_mock_server(settings, args.mock_port)
+    conn = await asyncpg.connect(args.database_url)
+    report = {}
+    try:
+        for name in args.processors:
+            await seed(conn, args.chats, args.messages)
+            query_counts.clear()
+            requests_before = settings.stats["requests"]
+            aborted_before = settings.stats["aborted_streams"]
+            started_at = time.monotonic()
+            latencies = await RUNNERS[name]()
+            elapsed = time.monotonic() - started_at
+            processed = len(latencies)
+            report[name] = {
+                "chats": processed,
+                "seconds": round(elapsed, 2),
+                "chats_per_sec": round(processed / elapsed, 2) if elapsed else 0,
+                "p50_latency": round(percentile(latencies, 50), 3),
+                "p99_latency": round(percentile(latencies, 99), 3),
+                "db_queries_per_chat": (
+                    round(query_counts["queries"] / processed, 1) if processed else 0
+                ),
+                "llm_requests": settings.stats["requests"] - requests_before,
+                # streams the client stopped reading once the json was complete
+                "early_stops": settings.stats["aborted_streams"] - aborted_before,
+            }
+            print(f"{name}: {json.dumps(report[name])}")
+    finally:
+        if not args.keep_data:
+            await cleanup(conn)
+        await conn.close()
+        await runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AI processors")
+    parser.add_argument("--database-url", type=str, required=True)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument(
+        "--processors", nargs="+", choices=PROCESSORS, default=PROCESSORS
+    )
+    parser.add_argument("--mock-port", type=int, default=8099)
+    parser.add_argument("--keep-data", action="store_true")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    configure_environment(args)
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""OpenAI compatible stub server for load testing the AI processors.
+
+Point the processors at it with OPENROUTER_API_URL=http://localhost:8099/v1/.
+Responses are canned JSON shaped after the prompt of each processor, served
+after a log-normal latency, with configurable 5xx and 429 error rates.
+Streamed requests get the completion in chunks spread over that latency, and
+a reasoning preamble or trailing chatter can be added to the completions.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# z-score of the 99th percentile of the standard normal distribution
+Z_99 = 2.326
+METRIC_ID_PATTERN = re.compile(r"### METRIC (\d+):")
+CATEGORIES = ["CRYPTO_PROJECT", "KOL", "TECH_DISCUSSION", "EVENT", "OTHERS"]
+CHUNK_PATTERN = re.compile(r".{1,4}", re.DOTALL)
+
+
+class MockLLMSettings:
+    def __init__(
+        self,
+        latency_median: float = 1.0,
+        latency_p99: float = 5.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        responses: dict | None = None,
+        think_tokens: int = 0,
+        trailing_tokens: int = 0,
+    ):
+        self.latency_median = latency_median
+        # log-normal sigma giving the requested p99 for the median
+        self.latency_sigma = (
+            math.log(latency_p99 / latency_median) / Z_99
+            if latency_p99 > latency_median > 0
+            else 0.0
+        )
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # prompt substring -> canned response object, checked before the defaults
+        self.responses = responses or {}
+        # words of reasoning before and of chatter after the json
+        self.think_tokens = think_tokens
+        self.trailing_tokens = trailing_tokens
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "streams": 0,
+            "aborted_streams": 0,
+        }
+
+    def sample_latency(self) -> float:
+        if self.latency_median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+
+def _confidence() -> int:
+    return random.randint(40, 100)
+
+
+def canned_response(messages: list[dict], settings: MockLLMSettings) -> dict:
+    """Build a response in the JSON format the prompt asks for."""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    for pattern, response in settings.responses.items():
+        if pattern in prompt:
+            return response
+
+    metric_ids = METRIC_ID_PATTERN.findall(prompt)
+    if metric_ids:
+        return {
+            "results": [
+                {
+                    "metric_id": int(metric_id),
+                    "value": f"mock value {metric_id}",
+                    "confidence": _confidence(),
+                    "reason": "mock reason",
+                }
+                for metric_id in metric_ids
+            ]
+        }
+    if '"category_alignment"' in prompt:
+        return {
+            "score": random.randint(0, 10),
+            "category_alignment": random.randint(0, 10),
+        }
+    if "classification" in prompt.lower():
+        return {
+            "category": {
+                "data": random.choice(CATEGORIES),
+                "confidence": _confidence(),
+                "reason": "mock reason",
+            },
+            "description": "mock description",
+            "entity": {"data": None, "confidence": 0, "reason": "mock reason"},
+        }
+    return {"value": "mock value", "confidence": _confidence(), "reason": "mock"}
+
+
+def completion_chunks(content: str, settings: MockLLMSettings) -> list[str]:
+    """The completion text around the json, split in streaming chunks."""
+    chunks = []
+    if settings.think_tokens:
+        chunks += ["<think>"] + ["hmm "] * settings.think_tokens + ["</think>\n"]
+    chunks += CHUNK_PATTERN.findall(content)
+    chunks += [" note"] * settings.trailing_tokens
+    return chunks
+
+
+def _error(status: int, message: str, headers: dict | None = None) -> web.Response:
+    return web.json_response(
+        {"error": {"message": message, "type": "mock_error", "code": status}},
+        status=status,
+        headers=headers,
+    )
+
+
+async def handle_chat_completions(request: web.Request) -> web.Response:
+    settings: MockLLMSettings = request.app["settings"]
+    settings.stats["requests"] += 1
+    body = await request.json()
+    latency = settings.sample_latency()
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+
+    roll = random.random()
+    if roll < settings.rate_limit_rate:
+        settings.stats["rate_limited"] += 1
+        return _error(429, "mock rate limit", headers={"retry-after": "1"})
+    if roll < settings.rate_limit_rate + settings.error_rate:
+        settings.stats["errors"] += 1
+        return _error(500, "mock server error")
+
+    messages = body.get("messages", [])
+    chunks = completion_chunks(
+        json.dumps(canned_response(messages, settings)), settings
+    )
+    if body.get("stream"):
+        return await _stream_chunks(request, body, chunks, latency)
+
+    content = "".join(chunks)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    return web.json_response(
+        {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        }
+    )
+
+
+async def _stream_chunks(
+    request: web.Request, body: dict, chunks: list[str], latency: float
+) -> web.StreamResponse:
+    """Send the chunks as server-sent events spread over the latency."""
+    settings: MockLLMSettings = request.app["settings"]
+    settings.stats["streams"] += 1
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    async def send(delta: dict, finish_reason: str | None = None):
+        event = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        await response.write(f"data: {json.dumps(event)}\n\n".encode())
+
+    try:
+        await send({"role": "assistant", "content": ""})
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            await send({"content": chunk})
+        await send({}, finish_reason="stop")
+        await response.write(b"data: [DONE]\n\n")
+    except ConnectionResetError:
+        # the client stopped reading early
+        settings.stats["aborted_streams"] += 1
+    except asyncio.CancelledError:
+        settings.stats["aborted_streams"] += 1
+        raise
+    return response
+
+
+def create_app(settings: MockLLMSettings) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app["settings"] = settings
+    app.router.add_post("/v1/chat/completions", handle_chat_completions)
+    return app
+
+
+async def start_mock_server(settings: MockLLMSettings, port: int) -> web.AppRunner:
+    runner = web.AppRunner(create_app(settings))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    logger.info(f"mock llm server listening on http://127.0.0.1:{port}/v1/")
+    return runner
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-median", type=float, default=1.0)
+    parser.add_argument("--latency-p99", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--responses",
+        type=str,
+        help="JSON file mapping prompt substrings to canned responses",
+    )
+    parser.add_argument(
+        "--think-tokens",
+        type=int,
+        default=0,
+        help="words of <think> reasoning before each json completion",
+    )
+    parser.add_argument(
+        "--trailing-tokens",
+        type=int,
+        default=0,
+        help="words of chatter after each json completion",
+    )
+
+
+def settings_from_args(args) -> MockLLMSettings:
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    return MockLLMSettings(
+        latency_median=args.latency_median,
+        latency_p99=args.latency_p99,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        responses=responses,
+        think_tokens=args.think_tokens,
+        trailing_tokens=args.trailing_tokens,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock LLM server")
+    parser.add_argument("--port", type=int, default=8099)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(create_app(settings_from_args(args)), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()